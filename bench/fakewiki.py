@@ -0,0 +1,418 @@
+"""
+Local stand-in for the MediaWiki API of Fandom wikis, for the benchmarks.
+
+Every synthetic wiki is served on its own port, so the plugin sees one host
+per wiki as it does with ``<wiki>.fandom.com``. Supported requests:
+
+    list=allpages                 paged with apcontinue, apfilterredir
+    generator=allpages            redirects resolved to their targets
+    prop=pageimages|categories    by pageids or titles
+    prop=revisions                wikitext of pages by pageids
+    prop=info                     latest revision ids by pageids
+    list=recentchanges            the first --changes pages and a tenth as
+                                  many redirects, edited just now
+    list=search                   title substring search with snippets
+    meta=siteinfo                 general (logo) and statistics
+    /img/...                      a small PNG for thumbnails and logos
+    /stats                        request counts, ?reset=1 clears them
+
+Usage:
+    python bench/fakewiki.py --wikis 3 --pages 50000 --latency 0.02
+
+Prints one JSON line with the port of every wiki once it is serving.
+"""
+import argparse
+import gzip
+import json
+import random
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ALLPAGES_LIMIT = 500
+QUERY_LIMIT = 50
+SEARCH_LIMIT = 10
+RECENT_CHANGES_LIMIT = 500
+
+WORDS = (
+    "iron gold diamond stone wood crystal shadow fire ice storm ancient royal "
+    "dark light sword shield bow axe armor helmet boots ring amulet potion "
+    "dragon goblin knight wizard golem spider zombie skeleton wolf bear "
+    "village castle dungeon temple forest desert ocean mountain cave island "
+    "quest boss event update patch chapter season mode skill spell rune").split()
+
+LEXICON_SIZE = 20000
+BODY_WORDS = 200
+
+def _lexicon():
+    """
+    Article vocabulary: made-up words with Zipf frequencies, the WORDS of the
+    titles spread over moderately common ranks, so a word of a title shows up
+    in a few percent of the articles rather than in all of them.
+    """
+    rng = random.Random("lexicon")
+    syllables = "ka lo mi ne ra tu shi po ve da gu li on ar el is um ex".split()
+    words = []
+    while len(words) < LEXICON_SIZE - len(WORDS):
+        word = "".join(rng.choice(syllables) for _ in range(rng.choice((1, 2, 2, 3, 3, 4))))
+        if word not in WORDS:
+            words.append(word)
+    for i, word in enumerate(WORDS):
+        words.insert(200 + i * 50, word)
+    cumulative = []
+    total = 0.0
+    for rank in range(1, len(words) + 1):
+        total += 1.0 / rank
+        cumulative.append(total)
+    return words, cumulative
+
+LEXICON, LEXICON_WEIGHTS = _lexicon()
+
+def _png(width, height):
+    """Build a transparent RGBA PNG of *width* by *height* pixels"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    rows = b"".join(b"\0" + b"\0" * 4 * width for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+PNG = _png(50, 50)
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def count(self, key):
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def snapshot(self, reset=False):
+        with self._lock:
+            counts = dict(self._counts)
+            if reset:
+                self._counts.clear()
+        # Failures are counted under their request kind as well
+        counts['total'] = sum(count for key, count in counts.items() if key != "failure")
+        return counts
+
+class SyntheticWiki:
+    """Deterministic pages, thumbnails and categories for one wiki"""
+    def __init__(self, name, pages, changes, seed=0, redirects=0.0):
+        self.name = name
+        rng = random.Random(f"{seed}:{name}")
+        titles = set()
+        while len(titles) < pages:
+            words = rng.sample(WORDS, rng.choice((1, 2, 2, 3)))
+            title = " ".join(words).capitalize()
+            if rng.random() < 0.3 or title in titles:
+                title = f"{title} {rng.randrange(1, 100000)}"
+            titles.add(title)
+        # allpages lists titles in order, page ids follow creation order
+        self.titles = sorted(titles)
+        pageids = list(range(1, pages + 1))
+        rng.shuffle(pageids)
+        self.pageids = pageids
+        self.rows = {pageid: row for row, pageid in enumerate(pageids)}
+        self.by_title = {title: row for row, title in enumerate(self.titles)}
+        self.category_names = [f"{word.capitalize()} items" for word in WORDS]
+        self._seed = rng.randrange(1 << 30)
+
+        # Redirects from variants of the titles, numbered after the pages
+        targets = {}
+        while len(targets) < int(pages * redirects):
+            target = rng.choice(self.titles)
+            title = rng.choice((f"{target}s", f"The {target.lower()}", " ".join(reversed(target.split()))))
+            if title not in self.by_title:
+                targets[title] = target
+        self.redirects = sorted(targets)
+        self.redirect_targets = targets
+        self.redirect_ids = {title: pages + 1 + i for i, title in enumerate(self.redirects)}
+        self.changed = self.titles[:changes] + self.redirects[:changes // 10]
+
+    def listing(self, filter_redirects):
+        """``(pageid, title)`` of the pages allpages lists with *filter_redirects*"""
+        pages = []
+        if filter_redirects != 'redirects':
+            pages.extend((self.pageids[row], title) for row, title in enumerate(self.titles))
+        if filter_redirects != 'nonredirects':
+            pages.extend((self.redirect_ids[title], title) for title in self.redirects)
+        return sorted(pages, key=lambda page: page[1]) if filter_redirects == 'all' else pages
+
+    def page_text(self, row):
+        """A few paragraphs of wikitext about the title, with a template and links"""
+        rng = random.Random(self._seed + row)
+        words = rng.choices(LEXICON, cum_weights=LEXICON_WEIGHTS, k=BODY_WORDS)
+        # An article keeps coming back to its subject
+        for word in self.titles[row].lower().split():
+            for _ in range(3):
+                words[rng.randrange(len(words))] = word
+        sentences = [" ".join(words[i:i + 12]).capitalize() + "." for i in range(0, len(words), 12)]
+        categories = " ".join(f"[[Category:{category}]]" for category in self.page_categories(row))
+        return (f"{{{{Infobox|name={self.titles[row]}}}}}\n'''{self.titles[row]}''' is found in "
+                f"[[{rng.choice(self.titles)}|{rng.choice(WORDS)}]]. {' '.join(sentences)}\n{categories}")
+
+    def page_categories(self, row):
+        first = (row * 7 + self._seed) % len(self.category_names)
+        count = 1 + (row + self._seed) % 3
+        return [self.category_names[(first + i * 11) % len(self.category_names)] for i in range(count)]
+
+class FakeWikiServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, wiki, options, stats):
+        super().__init__(("127.0.0.1", 0), FakeApiHandler)
+        self.wiki = wiki
+        self.options = options
+        self.stats = stats
+        self.rng = random.Random(wiki.name)
+        self.rng_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        if url.path == "/stats":
+            self._send_json(self.server.stats.snapshot(reset=params.get('reset') == '1'))
+        elif url.path.startswith("/img/"):
+            self.server.stats.count("image")
+            if not self._inject_failure():
+                self._send(PNG, "image/png")
+        else:
+            self._api(params)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self._api(dict(urllib.parse.parse_qsl(self.rfile.read(length).decode())))
+
+    def _api(self, params):
+        self.server.stats.count(self._request_kind(params))
+        if self._inject_failure():
+            return
+        self._send_json(self._answer(self.server.wiki, params))
+
+    def _inject_failure(self):
+        options = self.server.options
+        with self.server.rng_lock:
+            delay = options.latency + self.server.rng.uniform(0, options.jitter)
+            failed = self.server.rng.random() < options.error_rate
+        if delay:
+            time.sleep(delay)
+        if not failed:
+            return False
+        self.server.stats.count("failure")
+        body = b"Service unavailable"
+        self.send_response(503)
+        self.send_header('Retry-After', '0')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+    @staticmethod
+    def _request_kind(params):
+        for key in ('list', 'prop', 'meta', 'generator'):
+            if key in params:
+                return params[key]
+        return params.get('action', 'unknown')
+
+    def _answer(self, wiki, params):
+        if params.get('list') == 'allpages':
+            return self._allpages(wiki, params)
+        if params.get('generator') == 'allpages':
+            return self._redirect_listing(wiki, params)
+        if params.get('prop') == 'pageimages|categories':
+            return self._page_info(wiki, params)
+        if params.get('prop') == 'revisions':
+            return self._revisions(wiki, params)
+        if params.get('prop') == 'info':
+            return self._info(wiki, params)
+        if params.get('list') == 'recentchanges':
+            return self._recent_changes(wiki, params)
+        if params.get('list') == 'search':
+            return self._search(wiki, params)
+        if params.get('meta') == 'siteinfo':
+            return {'query': {
+                'general': {'sitename': wiki.name, 'logo': f"{self.server.base_url}/img/logo.png"},
+                'statistics': {'pages': len(wiki.titles) + len(wiki.redirects), 'articles': len(wiki.titles),
+                               'edits': len(wiki.titles) * 5}}}
+        return {'error': {'code': 'badvalue', 'info': f"Unsupported request {params}"}}
+
+    def _allpages(self, wiki, params):
+        listing = wiki.listing(params.get('apfilterredir', 'all'))
+        start = int(params.get('apcontinue', 0))
+        end = min(len(listing), start + ALLPAGES_LIMIT)
+        data = {'query': {'allpages': [
+            {'pageid': pageid, 'ns': 0, 'title': title} for pageid, title in listing[start:end]]}}
+        if end < len(listing):
+            data['continue'] = {'apcontinue': str(end), 'continue': '-||'}
+        return data
+
+    def _redirect_listing(self, wiki, params):
+        # Only the form the crawler sends: redirects, resolved, with no props
+        if params.get('gapfilterredir') != 'redirects' or 'redirects' not in params:
+            return {'error': {'code': 'badvalue', 'info': f"Unsupported request {params}"}}
+        start = int(params.get('gapcontinue', 0))
+        end = min(len(wiki.redirects), start + ALLPAGES_LIMIT)
+        redirects = [{'from': title, 'to': wiki.redirect_targets[title]} for title in wiki.redirects[start:end]]
+        pages = {}
+        for redirect in redirects:
+            row = wiki.by_title[redirect['to']]
+            pages[str(wiki.pageids[row])] = {'pageid': wiki.pageids[row], 'ns': 0, 'title': redirect['to']}
+        data = {'batchcomplete': '', 'query': {'redirects': redirects, 'pages': pages}}
+        if end < len(wiki.redirects):
+            data['continue'] = {'gapcontinue': str(end), 'continue': 'gapcontinue||'}
+        return data
+
+    def _page_info(self, wiki, params):
+        pages = {}
+        redirects = None
+        if 'pageids' in params:
+            rows = [wiki.rows.get(int(pageid)) for pageid in params['pageids'].split('|')[:QUERY_LIMIT]]
+            missing = []
+        else:
+            titles = params['titles'].split('|')[:QUERY_LIMIT]
+            if 'redirects' in params:
+                followed = [title for title in titles if title in wiki.redirect_targets]
+                if followed:
+                    redirects = [{'from': title, 'to': wiki.redirect_targets[title]} for title in followed]
+                titles = [wiki.redirect_targets.get(title, title) for title in titles]
+            rows = [wiki.by_title.get(title) for title in titles]
+            missing = [title for title, row in zip(titles, rows) if row is None]
+        for row in rows:
+            if row is None:
+                continue
+            pageid = wiki.pageids[row]
+            info = {'pageid': pageid, 'ns': 0, 'title': wiki.titles[row],
+                    'categories': [{'ns': 14, 'title': f"Category:{category}"}
+                                   for category in wiki.page_categories(row)]}
+            # Roughly two pages in three have an image
+            if row % 3:
+                info['thumbnail'] = {
+                    'source': f"{self.server.base_url}/img/{pageid}.png/revision/latest/"
+                              f"scale-to-width-down/{params.get('pithumbsize', 50)}",
+                    'width': 50, 'height': 50}
+            pages[str(pageid)] = info
+        for index, title in enumerate(missing):
+            pages[str(-1 - index)] = {'ns': 0, 'title': title, 'missing': ''}
+        data = {'batchcomplete': '', 'query': {'pages': pages}}
+        if redirects:
+            data['query']['redirects'] = redirects
+        return data
+
+    def _revisions(self, wiki, params):
+        pages = {}
+        for pageid in params['pageids'].split('|')[:QUERY_LIMIT]:
+            row = wiki.rows.get(int(pageid))
+            if row is None:
+                pages[pageid] = {'pageid': int(pageid), 'missing': ''}
+                continue
+            revision = {'revid': int(pageid) * 10,
+                        'slots': {'main': {'contentmodel': 'wikitext', '*': wiki.page_text(row)}}}
+            pages[pageid] = {'pageid': int(pageid), 'ns': 0, 'title': wiki.titles[row], 'revisions': [revision]}
+        return {'batchcomplete': '', 'query': {'pages': pages}}
+
+    def _info(self, wiki, params):
+        pages = {}
+        for pageid in params['pageids'].split('|')[:QUERY_LIMIT]:
+            row = wiki.rows.get(int(pageid))
+            if row is None:
+                pages[pageid] = {'pageid': int(pageid), 'missing': ''}
+            else:
+                pages[pageid] = {'pageid': int(pageid), 'ns': 0, 'title': wiki.titles[row],
+                                 'lastrevid': int(pageid) * 10}
+        return {'batchcomplete': '', 'query': {'pages': pages}}
+
+    def _recent_changes(self, wiki, params):
+        start = int(params.get('rccontinue', 0))
+        end = min(len(wiki.changed), start + RECENT_CHANGES_LIMIT)
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        data = {'query': {'recentchanges': [
+            {'type': 'edit', 'ns': 0, 'title': title, 'timestamp': timestamp}
+            for title in wiki.changed[start:end]]}}
+        if end < len(wiki.changed):
+            data['continue'] = {'rccontinue': str(end), 'continue': '-||'}
+        return data
+
+    def _search(self, wiki, params):
+        term = params.get('srsearch', '').lower()
+        limit = min(int(params.get('srlimit', SEARCH_LIMIT)), SEARCH_LIMIT)
+        results = []
+        for row, title in enumerate(wiki.titles):
+            if term and term in title.lower():
+                results.append({'ns': 0, 'pageid': wiki.pageids[row], 'title': title,
+                                'snippet': f"The <span class=\"searchmatch\">{term}</span> "
+                                           f"is found in {title}, see also &quot;{wiki.name}&quot;"})
+                if len(results) == limit:
+                    break
+        return {'query': {'searchinfo': {'totalhits': len(results)}, 'search': results}}
+
+    def _send_json(self, data):
+        self._send(json.dumps(data).encode(), "application/json")
+
+    def _send(self, body, content_type):
+        gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+        if gzipped:
+            body = gzip.compress(body, compresslevel=1)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_servers(names, options):
+    """Start one server per wiki, return ``(servers, stats)``"""
+    stats = Stats()
+    servers = []
+    for name in names:
+        wiki = SyntheticWiki(name, options.pages, options.changes, options.seed, options.redirects)
+        server = FakeWikiServer(wiki, options, stats)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers, stats
+
+def wiki_names(count):
+    return [f"wiki{i + 1}" for i in range(count)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic wikis through a fake MediaWiki API.")
+    parser.add_argument('--wikis', type=int, default=3, help="number of wikis (default: %(default)s)")
+    parser.add_argument('--pages', type=int, default=1000, help="pages per wiki (default: %(default)s)")
+    parser.add_argument('--changes', type=int, default=100,
+                        help="pages listed as recently changed (default: %(default)s)")
+    parser.add_argument('--redirects', type=float, default=0.3,
+                        help="redirects per page, to variants of the titles (default: %(default)s)")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random extra latency, up to seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="share of requests answered with HTTP 503 (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    servers, _ = start_servers(wiki_names(options.wikis), options)
+    print(json.dumps({server.wiki.name: server.base_url for server in servers}), flush=True)
+    try:
+        # Serves until stdin closes or the process is stopped
+        sys.stdin.read()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
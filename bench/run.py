@@ -0,0 +1,364 @@
+"""
+Benchmarks of the FandomWiki plugin against local fake wikis.
+
+For every size, fake wikis are served by bench/fakewiki.py in a separate
+process and the plugin runs in a fresh process of its own, with the stub
+keypirinha modules of bench/stubs, so memory figures are not mixed up. Each
+run measures:
+
+    cold_start     on_start with an empty cache, until indexing is done
+    warm_start     on_start from the cache written by the cold start
+    refresh        _refresh_pages, applying the recent changes
+    catalog        on_catalog rebuilds with global_results on
+    suggest        _suggest_pages for every keystroke of sample queries
+    text_search    _suggest_text_search for every keystroke of sample queries,
+                   answered by the full-text index with --text-index
+    serving        a warm start and the page suggestions again, in a fresh
+                   process: the memory needed to serve the cache, crawl
+                   left out; with --low-memory, the cache is memory-mapped
+    sync           a warm start then _refresh_pages, in a fresh process: the
+                   memory an incremental sync adds to a serving process, at
+                   its peak and once done; meant for --low-memory
+
+with the API requests, the wall time, per-keystroke latency percentiles and
+the peak memory. Results are written as JSON; pass an earlier result file as
+--baseline to print the changes against it.
+
+Usage:
+    python bench/run.py --sizes 1000 50000 500000 --output bench-results.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.request
+
+BENCH_PATH = os.path.dirname(os.path.abspath(__file__))
+SRC_PATH = os.path.join(os.path.dirname(BENCH_PATH), "src")
+
+DEFAULT_SIZES = (1000, 50000, 500000)
+# Typed one keystroke at a time; chosen from the words the fake wikis use
+PAGE_QUERIES = ("dragon", "iron sword", "cave items", "amulet 100", "ancient golem boots", "zzz")
+TEXT_QUERIES = ("dragon", "iron sw", "knight")
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def percentiles(samples):
+    """Return the usual latency figures of *samples*, in milliseconds"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(share):
+        return round(ordered[min(len(ordered) - 1, int(share * len(ordered)))] * 1000, 3)
+
+    return {'count': len(ordered), 'p50_ms': pick(0.5), 'p90_ms': pick(0.9),
+            'p99_ms': pick(0.99), 'max_ms': round(ordered[-1] * 1000, 3),
+            'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3)}
+
+def keystrokes(queries):
+    return [query[:length] for query in queries for length in range(1, len(query) + 1)]
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def rss_mb():
+    """Return the memory resident right now, on Linux only"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(resident * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+
+class Measurement:
+    """Runs the plugin against already running fake wikis, in this process"""
+    def __init__(self, config):
+        self.config = config
+        self.urls = config['urls']
+        self.stats_url = next(iter(self.urls.values())) + "/stats?reset=1"
+        self.plugin_class = self._load_plugin_class()
+
+    def _load_plugin_class(self):
+        sys.path.insert(0, os.path.join(BENCH_PATH, "stubs"))
+        import keypirinha
+        keypirinha.cache_path = self.config['cache_path']
+        keypirinha.verbose = self.config['verbose']
+        keypirinha.settings = self.config['settings']
+
+        # The plugin imports its helpers relatively, as Keypirinha loads it
+        # as the Fandom package
+        package = types.ModuleType("Fandom")
+        package.__path__ = [SRC_PATH]
+        sys.modules["Fandom"] = package
+        from Fandom import fandom
+
+        urls = self.urls
+
+        class BenchPlugin(fandom.FandomWiki):
+            def _load_wikis(self):
+                super()._load_wikis()
+                for wiki in self._wikis:
+                    wiki['url'] = urls[wiki['name']]
+
+        return BenchPlugin
+
+    def requests(self):
+        """Return and reset the request counts of the fake wikis"""
+        with urllib.request.urlopen(self.stats_url) as response:
+            return json.loads(response.read())
+
+    @staticmethod
+    def wait_indexed():
+        for thread in threading.enumerate():
+            if thread.name == "FandomWiki indexer":
+                thread.join()
+
+    def timed(self, action):
+        self.requests()
+        start = time.perf_counter()
+        action()
+        self.wait_indexed()
+        return {'wall_s': round(time.perf_counter() - start, 3), 'requests': self.requests()}
+
+    def run(self):
+        results = {}
+        plugin = self.plugin_class()
+        results['cold_start'] = self.timed(plugin.on_start)
+        results['cold_start']['pages'] = len(plugin._wiki_pages)
+        results['rss_after_start_mb'] = peak_rss_mb()
+
+        plugin = self.plugin_class()
+        results['warm_start'] = self.timed(plugin.on_start)
+        results['refresh'] = self.timed(plugin._refresh_pages)
+
+        catalog = []
+        for _ in range(3):
+            start = time.perf_counter()
+            plugin.on_catalog()
+            catalog.append(time.perf_counter() - start)
+        results['catalog'] = percentiles(catalog)
+        results['catalog']['items'] = len(plugin.catalog)
+        results['catalog']['first_ms'] = round(catalog[0] * 1000, 3)
+
+        samples = []
+        for text in keystrokes(PAGE_QUERIES):
+            start = time.perf_counter()
+            plugin._suggest_pages(text)
+            samples.append(time.perf_counter() - start)
+        results['suggest'] = percentiles(samples)
+
+        wiki = next(iter(self.urls))
+        self.requests()
+        samples = []
+        for text in keystrokes(TEXT_QUERIES):
+            start = time.perf_counter()
+            plugin._suggest_text_search(f"{wiki} {text}")
+            samples.append(time.perf_counter() - start)
+        results['text_search'] = percentiles(samples)
+        results['text_search']['requests'] = self.requests()
+
+        results['peak_rss_mb'] = peak_rss_mb()
+        # The plugin's own instrumentation of the last instance
+        results['plugin_metrics'] = plugin._metrics.snapshot()
+        return results
+
+    def serve(self):
+        """Start from the cache left by run() and suggest pages, nothing else"""
+        plugin = self.plugin_class()
+        results = {'warm_start': self.timed(plugin.on_start)}
+        samples = []
+        for text in keystrokes(PAGE_QUERIES):
+            start = time.perf_counter()
+            plugin._suggest_pages(text)
+            samples.append(time.perf_counter() - start)
+        results['suggest'] = percentiles(samples)
+        results['rss_mb'] = peak_rss_mb()
+        return results
+
+    def sync(self):
+        """Start from the cache left by run() and apply the recent changes once"""
+        plugin = self.plugin_class()
+        results = {'warm_start': self.timed(plugin.on_start)}
+        # Both figures, as the peak only grows
+        results['serving_rss_mb'] = peak_rss_mb()
+        results['refresh'] = self.timed(plugin._refresh_pages)
+        results['peak_rss_mb'] = peak_rss_mb()
+        results['rss_after_mb'] = rss_mb()
+        return results
+
+def measure(mode, config):
+    """Run Measurement.run, .serve or .sync in a fresh process and return its results"""
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), mode, json.dumps(config)],
+        stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+def run_size(size, args):
+    """Benchmark *size* pages spread over the wikis, return its results"""
+    pages = max(1, size // args.wikis)
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_PATH, "fakewiki.py"),
+         "--wikis", str(args.wikis), "--pages", str(pages), "--changes", str(args.changes),
+         "--latency", str(args.latency), "--jitter", str(args.jitter),
+         "--error-rate", str(args.error_rate), "--redirects", str(args.redirects)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+    cache_path = tempfile.mkdtemp(prefix="fandom-bench-")
+    try:
+        urls = json.loads(server.stdout.readline())
+        config = {
+            'urls': urls,
+            'cache_path': cache_path,
+            'verbose': args.verbose,
+            'settings': {
+                'wikis': ",".join(urls),
+                'global_results': "yes",
+                'download_icons': "yes" if args.icons else "no",
+                'max_connections': args.connections,
+                'max_connections_per_host': args.connections_per_host,
+                'text_search_delay': args.text_search_delay,
+                'text_index': "yes" if args.text_index else "no",
+                'low_memory': "yes" if args.low_memory else "no",
+            },
+        }
+        results = measure("--measure", config)
+        results['serving'] = measure("--serve", config)
+        results['sync'] = measure("--sync", config)
+    finally:
+        server.stdin.close()
+        server.terminate()
+        server.wait()
+        shutil.rmtree(cache_path, ignore_errors=True)
+    return dict({'size': size, 'wikis': args.wikis, 'pages_per_wiki': pages}, **results)
+
+def summary_rows(result):
+    return [
+        ("cold start", f"{result['cold_start']['wall_s']:.2f} s, "
+                       f"{result['cold_start']['requests'].get('total', 0)} requests"),
+        ("warm start", f"{result['warm_start']['wall_s']:.2f} s, "
+                       f"{result['warm_start']['requests'].get('total', 0)} requests"),
+        ("refresh", f"{result['refresh']['wall_s']:.2f} s, "
+                    f"{result['refresh']['requests'].get('total', 0)} requests"),
+        ("catalog", f"p50 {result['catalog']['p50_ms']} ms, first {result['catalog']['first_ms']} ms"),
+        ("suggest", f"p50 {result['suggest']['p50_ms']} ms, p99 {result['suggest']['p99_ms']} ms"),
+        ("text search", f"p50 {result['text_search']['p50_ms']} ms, "
+                        f"p99 {result['text_search']['p99_ms']} ms, "
+                        f"{result['text_search']['requests'].get('total', 0)} requests"),
+        ("peak memory", f"{result['peak_rss_mb']} MB"),
+        ("serving", f"{result['serving']['rss_mb']} MB, suggest p50 {result['serving']['suggest']['p50_ms']} ms, "
+                    f"p99 {result['serving']['suggest']['p99_ms']} ms"),
+        ("sync", f"{result['sync']['refresh']['wall_s']:.2f} s, peak {result['sync']['peak_rss_mb']} MB "
+                 f"from {result['sync']['serving_rss_mb']} MB, {result['sync']['rss_after_mb']} MB after"),
+    ]
+
+# (path in a result, label); lower is better for all of them
+COMPARED = (
+    (('cold_start', 'wall_s'), "cold start s"),
+    (('cold_start', 'requests', 'total'), "cold start requests"),
+    (('warm_start', 'wall_s'), "warm start s"),
+    (('refresh', 'wall_s'), "refresh s"),
+    (('refresh', 'requests', 'total'), "refresh requests"),
+    (('catalog', 'p50_ms'), "catalog p50 ms"),
+    (('suggest', 'p50_ms'), "suggest p50 ms"),
+    (('suggest', 'p99_ms'), "suggest p99 ms"),
+    (('text_search', 'p50_ms'), "text search p50 ms"),
+    (('peak_rss_mb',), "peak memory MB"),
+    (('serving', 'rss_mb'), "serving memory MB"),
+    (('sync', 'peak_rss_mb'), "sync peak memory MB"),
+    (('sync', 'rss_after_mb'), "memory after sync MB"),
+)
+
+def lookup(result, path):
+    for key in path:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+def compare(results, baseline):
+    previous = {result['size']: result for result in baseline['results']}
+    for result in results:
+        before = previous.get(result['size'])
+        if before is None:
+            continue
+        print(f"\n{result['size']} pages against the baseline:")
+        for path, label in COMPARED:
+            old, new = lookup(before, path), lookup(result, path)
+            if old is None or new is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"  {label:<22} {old:>10} -> {new:<10} {change}")
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] in ("--measure", "--serve", "--sync"):
+        measurement = Measurement(json.loads(sys.argv[2]))
+        action = {"--measure": measurement.run, "--serve": measurement.serve, "--sync": measurement.sync}
+        print(json.dumps(action[sys.argv[1]]()))
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark the FandomWiki plugin against local fake wikis.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="total pages over all wikis, one run each (default: %(default)s)")
+    parser.add_argument('--wikis', type=int, default=3, help="number of wikis (default: %(default)s)")
+    parser.add_argument('--changes', type=int, default=100,
+                        help="recently changed pages per wiki for the refresh (default: %(default)s)")
+    parser.add_argument('--redirects', type=float, default=0.3,
+                        help="redirects per page (default: %(default)s)")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every API response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random extra latency, up to seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="share of requests failing with HTTP 503 (default: %(default)s)")
+    parser.add_argument('--connections', type=int, default=8, help="max_connections (default: %(default)s)")
+    parser.add_argument('--connections-per-host', type=int, default=2,
+                        help="max_connections_per_host (default: %(default)s)")
+    parser.add_argument('--text-search-delay', type=float, default=0.0,
+                        help="text_search_delay, the debounce included in the latency (default: %(default)s)")
+    parser.add_argument('--icons', action='store_true', help="download icons during the starts")
+    parser.add_argument('--low-memory', action='store_true',
+                        help="serve the pages from memory-mapped title files (low_memory)")
+    parser.add_argument('--text-index', action='store_true',
+                        help="build the full-text index during the starts and search it offline")
+    parser.add_argument('-o', '--output', default="bench-results.json", help="result file (default: %(default)s)")
+    parser.add_argument('--baseline', help="earlier result file to compare with")
+    parser.add_argument('-v', '--verbose', action='store_true', help="show the plugin's debug log")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        print(f"Benchmarking {size} pages over {args.wikis} wikis...", flush=True)
+        result = run_size(size, args)
+        results.append(result)
+        for label, value in summary_rows(result):
+            print(f"  {label:<12} {value}")
+
+    report = {
+        'created': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
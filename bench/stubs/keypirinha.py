@@ -0,0 +1,153 @@
+"""
+Minimal stand-in for Keypirinha's embedded ``keypirinha`` module, enough to
+run the FandomWiki plugin outside the launcher for the benchmarks.
+"""
+import os
+import sys
+import time
+
+class ItemCategory:
+    ERROR = 1
+    KEYWORD = 2
+    FILE = 3
+    URL = 5
+    USER_BASE = 1000
+
+class ItemArgsHint:
+    FORBIDDEN = 0
+    ACCEPTED = 1
+    REQUIRED = 2
+
+class ItemHitHint:
+    IGNORE = 0
+    NOARGS = 1
+    KEEPALL = 2
+
+class Match:
+    ANY = 0
+    FUZZY = 1
+    DEFAULT = ANY
+
+class Sort:
+    NONE = 0
+    SCORE_DESC = 1
+    DEFAULT = NONE
+
+class Events:
+    APPCONFIG = 0x1
+    PACKCONFIG = 0x2
+    NETOPTIONS = 0x4
+
+# Set by the benchmark before the plugin is created
+settings = {}
+cache_path = None
+verbose = False
+
+def should_terminate(wait=None):
+    if wait:
+        time.sleep(wait)
+    return False
+
+class CatalogItem:
+    def __init__(self, **kwargs):
+        self._fields = kwargs
+
+    def category(self):
+        return self._fields.get('category')
+
+    def label(self):
+        return self._fields.get('label', "")
+
+    def short_desc(self):
+        return self._fields.get('short_desc', "")
+
+    def target(self):
+        return self._fields.get('target', "")
+
+    def data_bag(self):
+        return self._fields.get('data_bag', "")
+
+    def __repr__(self):
+        return f"CatalogItem({self.label()!r})"
+
+class Settings:
+    def __init__(self, values):
+        self._values = values
+
+    def get(self, key, section=None, fallback=None, unquote=True):
+        return self._values.get(key, fallback)
+
+    def get_bool(self, key, section=None, fallback=None):
+        value = self._values.get(key)
+        if value is None:
+            return fallback
+        return str(value).lower() in ("1", "yes", "true", "on")
+
+    def get_int(self, key, section=None, fallback=None, min=None, max=None):
+        value = self._values.get(key)
+        return fallback if value is None else int(value)
+
+    def get_float(self, key, section=None, fallback=None, min=None, max=None):
+        value = self._values.get(key)
+        return fallback if value is None else float(value)
+
+    def get_enum(self, key, section=None, fallback=None, enum=(), case_sensitive=False, unquote=True):
+        value = self._values.get(key)
+        return value if value in enum else fallback
+
+class Plugin:
+    def __init__(self):
+        self.catalog = []
+        self.suggestions = []
+
+    def _log(self, level, *args):
+        if verbose or level != "DBG":
+            print(level, *args, file=sys.stderr)
+
+    def dbg(self, *args):
+        if verbose:
+            self._log("DBG", *args)
+
+    def info(self, *args):
+        self._log("INFO", *args)
+
+    def warn(self, *args):
+        self._log("WARN", *args)
+
+    def err(self, *args):
+        self._log("ERR", *args)
+
+    def get_package_cache_path(self, create=False):
+        if create:
+            os.makedirs(cache_path, exist_ok=True)
+        return cache_path
+
+    def load_settings(self):
+        return Settings(settings)
+
+    def should_terminate(self, wait=None):
+        return should_terminate(wait)
+
+    def create_item(self, **kwargs):
+        return CatalogItem(**kwargs)
+
+    def create_error_item(self, **kwargs):
+        return CatalogItem(category=ItemCategory.ERROR, **kwargs)
+
+    def create_action(self, **kwargs):
+        return kwargs
+
+    def set_actions(self, category, actions):
+        pass
+
+    def set_catalog(self, catalog):
+        self.catalog = catalog
+
+    def set_suggestions(self, suggestions, match=Match.DEFAULT, sort=Sort.DEFAULT):
+        self.suggestions = suggestions
+
+    def load_icon(self, source):
+        return source
+
+    def set_default_icon(self, handle):
+        pass
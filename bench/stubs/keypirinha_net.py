@@ -0,0 +1,5 @@
+"""Stand-in for ``keypirinha_net``, without any proxy configured"""
+import urllib.request
+
+def build_urllib_opener(proxies=None, ssl_check=True, extra_handlers=[]):
+    return urllib.request.build_opener(*extra_handlers)
@@ -0,0 +1,7 @@
+"""Stand-in for ``keypirinha_util``; the benchmarks never open anything"""
+
+def web_browser_command(private_mode=None, new_window=None, url=None, execute=True):
+    pass
+
+def set_clipboard(text):
+    pass
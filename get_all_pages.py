@@ -1,177 +1,265 @@
+"""
+Offline index builder for the FandomWiki Keypirinha package.
+
+Crawls the given wikis and writes the page cache and the processed icons in
+the exact layout the plugin loads from its package cache folder:
+
+    <output>/pages/<wiki>.pages
+    <output>/pages/text.sqlite        with --text or --dump
+    <output>/icons/<wiki>-<pageid>.png
+    <output>/icons/manifest.json
+
+Runs are resumable: wikis already in the output are only updated with their
+recent changes, interrupted crawls continue from their last checkpoint, and
+icons already listed in the manifest are skipped. The full-text index only
+fetches the content of pages changed since its last run; --dump loads a
+wiki's content from its XML dump instead, and --text then catches up with
+the changes made since the dump.
+
+Usage:
+    python get_all_pages.py minecraft terraria --output path/to/cache
+"""
+import argparse
 import os
-import requests
-import json
-from PIL import Image, ImageDraw, ImageOps
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from io import BytesIO
 
-# Function to get all pages
-def get_all_pages(wiki_name):
-    url = f'https://{wiki_name}.fandom.com/api.php'
-    
-    params = {
-        'action': 'query',
-        'list': 'allpages',
-        'aplimit': 'max',
-        'format': 'json'
-    }
+from PIL import Image, ImageDraw, ImageOps
 
-    all_pages = []
-    continue_token = None
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
 
-    while True:
-        if continue_token:
-            params['apcontinue'] = continue_token
+from lib import pagecache, textindex
+from lib.crawler import WikiCrawler
+from lib.icons import IconManifest
+from lib.pagestore import PageStore
+from lib.transport import ApiTransport
 
-        response = requests.get(url, params=params)
-        data = response.json()
+MANIFEST_SAVE_INTERVAL = 200  # icons between manifest saves
 
-        all_pages.extend(data['query']['allpages'])
+class ConsoleLogger:
+    def __init__(self, verbose=False):
+        self._verbose = verbose
 
-        if 'continue' in data:
-            continue_token = data['continue']['apcontinue']
-        else:
-            break
+    def dbg(self, message):
+        if self._verbose:
+            print(message)
 
-    return all_pages
+    def info(self, message):
+        print(message)
 
-# Function to fetch thumbnail and categories for a specific page
-def get_page_info(wiki_name, pageid):
-    url = f'https://{wiki_name}.fandom.com/api.php'
-    
-    params = {
-        'action': 'query',
-        'pageids': pageid,
-        'prop': 'pageimages|categories',  # Fetch page images and categories
-        'pithumbsize': 500,  # Fetch thumbnail at this size
-        'format': 'json'
-    }
-
-    response = requests.get(url, params=params)
-    data = response.json()
-
-    page_data = data.get('query', {}).get('pages', {}).get(str(pageid), {})
-    
-    # Extract thumbnail URL if it exists
-    thumbnail_url = page_data.get('thumbnail', {}).get('source')
-
-    # Extract categories
-    categories = [cat['title'] for cat in page_data.get('categories', [])]
-
-    return thumbnail_url, categories
-
-# Function to download an image, resize, crop to 256x256, and make it a squircle PNG
-def download_and_process_image(image_url, filename, folder, wiki_name):  # Add wiki_name parameter
-    base_filename, _ = os.path.splitext(filename) # Get filename without extension
-    filename = f"{wiki_name}-{base_filename}.png"  # Include wiki name in filename
-    file_path = os.path.join(folder, filename)
-    
-    # Check if the file already exists
-    if os.path.exists(file_path):
-        print(f"File {filename} already exists, skipping download.")
-        return
+    def warn(self, message):
+        print(f"Warning: {message}", file=sys.stderr)
+
+    def err(self, message):
+        print(f"Error: {message}", file=sys.stderr)
 
-    # Download the image
-    response = requests.get(image_url)
-    if response.status_code == 200:
-        image = Image.open(BytesIO(response.content))
-
-        # Resize and crop to 256x256
-        image = resize_and_crop_image(image, (256, 256))
-
-        # Convert the image to a squircle PNG
-        squircled_image = make_squircle(image)
-
-        # Save the processed image as PNG with transparency
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        squircled_image.save(file_path, format='PNG')
-        print(f"Downloaded and processed: {filename}")
-    else:
-        print(f"Failed to download image: {filename}")
-
-# Function to resize and crop image to square (256x256)
-def resize_and_crop_image(image, size):
-    width, height = image.size
-    aspect_ratio = width / height
-
-    if aspect_ratio > 1:
-        new_width = int(aspect_ratio * size[1])
-        image = image.resize((new_width, size[1]), Image.Resampling.LANCZOS)
-        left = (new_width - size[0]) / 2
-        right = left + size[0]
-        image = image.crop((left, 0, right, size[1]))
-    else:
-        new_height = int(size[0] / aspect_ratio)
-        image = image.resize((size[0], new_height), Image.Resampling.LANCZOS)
-        top = (new_height - size[1]) / 2
-        bottom = top + size[1]
-        image = image.crop((0, top, size[0], bottom))
-
-    image = image.resize(size, Image.Resampling.LANCZOS)
-    return image
-
-# Function to make the image into a squircle with transparent background (radius: 30 pixels)
+# Runs in the worker processes: decode, crop to a square and round the corners
+def process_image(data, size):
+    image = Image.open(BytesIO(data)).convert("RGBA")
+    # A single resampling pass straight to the target size
+    image = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+    squircled_image = make_squircle(image)
+    output = BytesIO()
+    squircled_image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+# Function to make the image into a squircle with transparent background
 def make_squircle(image):
-    size = image.size  # Assumes image is already 256x256 or the desired size
+    size = image.size
 
-    # Create a mask for the squircle
+    # Create a mask for the squircle, 30 pixels of radius at 256 pixels
     mask = Image.new('L', size, 0)
     draw = ImageDraw.Draw(mask)
-    
-    # Create a rounded square (squircle) shape in the mask with a 30-pixel radius
-    radius = 30  # Fixed radius of 30 pixels for the rounded corners
+    radius = max(1, round(size[0] * 30 / 256))
     draw.rounded_rectangle((0, 0, size[0], size[1]), radius, fill=255)
 
     # Apply the mask to the image to get a squircle
     squircled_image = Image.new("RGBA", size)
     squircled_image.paste(image, (0, 0), mask)
-
     return squircled_image
 
-# Function to save pages data to JSON
-def save_to_json(data, filename):
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+def crawl_pages(wikis, pages_folder, transport, logger, args):
+    os.makedirs(pages_folder, exist_ok=True)
+    synced = {}
+    resume = {}
+    for wiki in wikis:
+        path = pagecache.cache_file(pages_folder, wiki['name'])
+        if os.path.exists(path):
+            try:
+                synced[wiki['name']] = pagecache.read_store(path, wiki['name'], wiki['url'])
+            except Exception as e:
+                logger.warn(f"Ignoring cached pages of {wiki['name']}: {str(e)}")
+        try:
+            checkpoint = pagecache.read_checkpoint(pages_folder, wiki['name'], wiki['url'])
+        except Exception as e:
+            logger.warn(f"Ignoring the crawl checkpoint of {wiki['name']}: {str(e)}")
+            checkpoint = None
+        if checkpoint:
+            store, continue_params = checkpoint
+            resume[wiki['name']] = (store.synced, store.to_pages(), continue_params)
+
+    def save_checkpoint(wiki, started, pages, continue_params):
+        pagecache.write_checkpoint(
+            pages_folder, wiki['name'], PageStore.from_pages(wiki['name'], wiki['url'], pages, started),
+            continue_params)
+
+    crawler = WikiCrawler(
+        transport.request_json, logger,
+        max_connections=args.connections,
+        max_connections_per_host=args.connections_per_host,
+        thumbnail_size=args.size,
+        checkpoint=save_checkpoint)
+    results = crawler.crawl(wikis, synced=synced, resume=resume)
+    for name, store in results.items():
+        pagecache.write_store(pagecache.cache_file(pages_folder, name), store)
+        pagecache.remove_checkpoint(pages_folder, name)
+    if crawler.failed:
+        logger.err(f"Could not crawl {', '.join(crawler.failed)}, run again to resume")
+    return results
+
+def build_text_index(wikis, stores, pages_folder, transport, logger, args):
+    if not textindex.available():
+        logger.err("This Python's SQLite has no FTS5, cannot build the full-text index")
+        return
+    text_index = textindex.TextIndex(os.path.join(pages_folder, "text.sqlite"))
+    try:
+        for dump in args.dump:
+            name, _, path = dump.partition('=')
+            start_time = time.time()
+            loaded = textindex.load_dump(text_index, name, path)
+            logger.info(f"Loaded {loaded} pages of {name} from {path} in {time.time() - start_time:.2f} seconds")
+
+        if args.text:
+            start_time = time.time()
+            crawler = WikiCrawler(
+                transport.request_json, logger,
+                max_connections=args.connections,
+                max_connections_per_host=args.connections_per_host)
+            fetched = textindex.sync_wikis(text_index, crawler, wikis, stores, logger)
+            logger.info(f"Fetched the content of {fetched} pages in {time.time() - start_time:.2f} seconds")
+            if crawler.failed:
+                logger.err(f"Could not fetch the content of {', '.join(crawler.failed)}, run again to resume")
+    finally:
+        text_index.close()
+
+def fetch_logo_url(wiki, transport):
+    data = transport.request_json(f"{wiki['url']}/api.php", {
+        'action': 'query',
+        'meta': 'siteinfo',
+        'siprop': 'general',
+        'format': 'json'
+    })
+    url = data['query']['general'].get('logo')
+    if url and url.startswith('//'):
+        url = 'https:' + url
+    return url
+
+def build_icons(wikis, stores, icons_folder, transport, logger, args):
+    os.makedirs(icons_folder, exist_ok=True)
+    manifest = IconManifest(icons_folder)
+    manifest.load()
+
+    # (wiki name, pageid or None for the logo, url); done work is in the manifest
+    jobs = []
+    for wiki in wikis:
+        store = stores.get(wiki['name'])
+        if store is None:
+            continue
+        if not manifest.has_logo(wiki['name']):
+            url = fetch_logo_url(wiki, transport)
+            if url:
+                jobs.append((wiki['name'], None, url))
+        for pageid, thumbnail in zip(store.pageids, store.thumbnails):
+            if thumbnail and not manifest.has_page(wiki['name'], pageid):
+                jobs.append((wiki['name'], pageid, thumbnail))
+    logger.info(f"{len(jobs)} icons to build")
+    if not jobs:
+        return
+
+    done = 0
+    start_time = time.time()
+    # Threads wait on the network, processes do the image work on every core
+    with ThreadPoolExecutor(max_workers=args.connections) as downloads, \
+            ProcessPoolExecutor(max_workers=args.processes) as processing:
+        fetching = {downloads.submit(transport.request, url): (name, pageid) for name, pageid, url in jobs}
+        converting = {}
+        pending = set(fetching)
+        try:
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    if future in fetching:
+                        name, pageid = fetching.pop(future)
+                        try:
+                            conversion = processing.submit(process_image, future.result(), args.size)
+                        except Exception as e:
+                            logger.warn(f"Failed to download icon {pageid or 'logo'} of {name}: {str(e)}")
+                            continue
+                        converting[conversion] = (name, pageid)
+                        pending.add(conversion)
+                        continue
+
+                    name, pageid = converting.pop(future)
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        logger.warn(f"Failed to process icon {pageid or 'logo'} of {name}: {str(e)}")
+                        continue
+
+                    file_name = f"{name}-{'logo' if pageid is None else pageid}.png"
+                    with open(os.path.join(icons_folder, file_name), 'wb') as f:
+                        f.write(data)
+                    if pageid is None:
+                        manifest.set_logo(name, file_name)
+                    else:
+                        manifest.set_page(name, pageid, file_name)
+
+                    done += 1
+                    if done % MANIFEST_SAVE_INTERVAL == 0:
+                        manifest.save()
+                        logger.info(f"{done} of {len(jobs)} icons built")
+        finally:
+            # Whatever was written so far is kept for the next run
+            manifest.save()
+    logger.info(f"Built {done} of {len(jobs)} icons in {time.time() - start_time:.2f} seconds")
 
-# Main logic
 def main():
-    wiki_name = 'wiki1'  # Replace with the actual name of the fandom wiki
-    folder_name = f'icons'  # Folder where thumbnails will be saved
-    json_filename = f'{wiki_name}_pages.json'  # JSON file to save detailed page info
-
-    # Step 1: Fetch all pages
-    pages = get_all_pages(wiki_name)
-
-    # Create a list to store detailed page information
-    detailed_pages_info = []
-
-    # Step 2: Download and process thumbnails, and gather categories for each page
-    for page in pages:
-        pageid = page['pageid']
-        title = page['title']
-        
-        # Fetch thumbnail URL and categories
-        thumbnail_url, categories = get_page_info(wiki_name, pageid)
-        
-        # Download the image if a thumbnail exists
-        if thumbnail_url:
-            filename = f"{pageid}.png" # Generate base filename from id
-            download_and_process_image(thumbnail_url, filename, folder_name, wiki_name) # Pass filename, folder, and wiki_name
-        else:
-            print(f"No thumbnail for pageid: {pageid}")
-
-        # Save the detailed info (page title, pageid, categories) in the list
-        detailed_pages_info.append({
-            'pageid': pageid,
-            'title': title,
-            'categories': categories,
-            'thumbnail': f"{filename}" if thumbnail_url else None
-        })
-
-    # Step 3: Save all the detailed page info to a JSON file
-    save_to_json(detailed_pages_info, json_filename)
-
-    print(f"Finished processing {len(pages)} pages.")
+    parser = argparse.ArgumentParser(description="Build the FandomWiki page cache and icons offline.")
+    parser.add_argument('wikis', nargs='+', help="wiki names, as in the wikis setting of fandom.ini")
+    parser.add_argument('-o', '--output', required=True,
+                        help="output folder, normally the package cache folder of the plugin")
+    parser.add_argument('--url-template', default='https://{}.fandom.com',
+                        help="base URL of a wiki, {} is replaced by its name (default: %(default)s)")
+    parser.add_argument('--size', type=int, default=256, help="icon size in pixels (default: %(default)s)")
+    parser.add_argument('--connections', type=int, default=8,
+                        help="maximum requests in flight (default: %(default)s)")
+    parser.add_argument('--connections-per-host', type=int, default=2,
+                        help="maximum requests in flight to a single wiki (default: %(default)s)")
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help="image processing workers (default: one per core)")
+    parser.add_argument('--timeout', type=float, default=15, help="request timeout in seconds")
+    parser.add_argument('--no-icons', action='store_true', help="only build the page cache")
+    parser.add_argument('--text', action='store_true',
+                        help="build the full-text index of page content, for offline text search")
+    parser.add_argument('--dump', action='append', default=[], metavar='WIKI=PATH',
+                        help="load the full-text index of a wiki from its XML dump (.xml, .xml.gz or .xml.bz2)")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logger = ConsoleLogger(args.verbose)
+    transport = ApiTransport(timeout=args.timeout)
+    wikis = [{'name': name, 'url': args.url_template.format(name)} for name in args.wikis]
+
+    stores = crawl_pages(wikis, os.path.join(args.output, "pages"), transport, logger, args)
+    if args.text or args.dump:
+        build_text_index(wikis, stores, os.path.join(args.output, "pages"), transport, logger, args)
+    if not args.no_icons:
+        build_icons(wikis, stores, os.path.join(args.output, "icons"), transport, logger, args)
+    transport.close()
+
+    print(f"Finished processing {sum(len(store) for store in stores.values())} pages.")
 
 # Run the script
 if __name__ == "__main__":
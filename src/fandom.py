@@ -1,5 +1,9 @@
 import os
+import re
+import html
 import json
+import concurrent.futures
+import threading
 import time
 import urllib.request
 
@@ -7,24 +11,79 @@ import keypirinha as kp
 import keypirinha_util as kpu
 import keypirinha_net as kpnet
 
+from .lib.crawler import CrawlCancelled, WikiCrawler, site_statistics
+from .lib import diskindex, pagecache, textindex
+from .lib.diskindex import DiskPageIndex, DiskPageSet
+from .lib.icons import IconManifest, icon_file_name, sized_thumbnail_url
+from .lib.lru import LruCache
+from .lib.metrics import Metrics
+from .lib.pageindex import PageIndex
+from .lib.pagestore import PageSet, PageStore
+from .lib.textindex import TextIndex
+from .lib.transport import ApiTransport
+from .lib.usage import UsageHistory
+
+class _CatalogEntry:
+    """Catalog items built for one PageStore, with the memo they came from"""
+    __slots__ = ('store', 'icons_version', 'items', 'memo')
+
+    def __init__(self, store, icons_version):
+        self.store = store
+        self.icons_version = icons_version
+        self.items = []
+        self.memo = {}  # pageid -> ((title, short_desc, icon file), item)
+
 class FandomWiki(kp.Plugin):
     ITEMCAT_RESULT = kp.ItemCategory.USER_BASE + 1
     ITEMCAT_RELOAD = kp.ItemCategory.USER_BASE + 2
     ITEMCAT_SEARCH = kp.ItemCategory.USER_BASE + 3
+    ITEMCAT_CANCEL = kp.ItemCategory.USER_BASE + 4
+    ITEMCAT_STATS = kp.ItemCategory.USER_BASE + 5
 
     ACTION_OPEN_BROWSER = "open_browser"
     ACTION_COPY_URL = "copy_url"
 
     DEFAULT_ICON = "res://Fandom/img/fandom_logo.png"
     ICONS_FOLDER_NAME = "icons"
+    PAGES_FOLDER_NAME = "pages"
+    PROGRESS_INTERVAL = 5  # seconds between catalog updates while indexing
+    TEXT_SEARCH_CACHE_SIZE = 128
+    TEXT_SEARCH_WORKERS = 16
+    TEXT_SEARCH_LIMIT = 10  # results per wiki, as many as list=search returns
+    TEXT_INDEX_FILE_NAME = "text.sqlite"
+    ICON_SIZE = 64  # pixels, width of the thumbnails requested for icons
+    ICON_HANDLE_CACHE_SIZE = 512
+    ICON_MANIFEST_SAVE_INTERVAL = 200  # downloads between manifest saves
+    METRICS_FILE_NAME = "metrics.json"
 
     def __init__(self):
         super().__init__()
         self.dbg("FandomWiki plugin initialized")
         self._debug = False  # Set this to True to enable detailed debug logging
-        self._wiki_pages = []
+        self._wiki_pages = PageSet()
+        self._page_index = PageIndex(self._wiki_pages)
+        self._wiki_cache = {}
         self._wikis = []
+        self._transport = None
+        self._index_lock = threading.Lock()
+        self._index_cancel = None
+        self._index_progress = None
+        self._index_progress_time = 0
+        self._text_search_cache = LruCache(self.TEXT_SEARCH_CACHE_SIZE)
+        self._search_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.TEXT_SEARCH_WORKERS, thread_name_prefix="FandomWiki search")
         self._IMAGES_PATH = os.path.join(self.get_package_cache_path(), self.ICONS_FOLDER_NAME)
+        self._PAGES_PATH = os.path.join(self.get_package_cache_path(), self.PAGES_FOLDER_NAME)
+        self._icon_manifest = IconManifest(self._IMAGES_PATH)
+        self._icon_handles = LruCache(self.ICON_HANDLE_CACHE_SIZE)
+        self._catalog_items = {}  # wiki name -> _CatalogEntry
+        self._store_changes = {}  # wiki name -> (store, page ids refetched since the catalog's store)
+        self._catalog_lock = threading.Lock()
+        self._metrics = Metrics()
+        self._probe_stop = None
+        self._probe_failing = set()  # wikis the last probe could not reach
+        self._text_index = None
+        self._usage = UsageHistory(self.get_package_cache_path(), logger=self)
         self.logger = getattr(self, "info", print)
 
     def on_start(self):
@@ -34,17 +93,36 @@ class FandomWiki(kp.Plugin):
         self.dbg(f"Configured wikis: {self._wikis}")
         if self._DOWNLOAD_ICONS:
             os.makedirs(self._IMAGES_PATH, exist_ok=True)
+            try:
+                self._icon_manifest.load()
+            except Exception as e:
+                self.err(f"Error loading icon manifest: {str(e)}")
+        try:
+            self._usage.load()
+        except Exception as e:
+            self.err(f"Error loading the usage history: {str(e)}")
         self._load_wikis()
         self.dbg("Wikis loaded")
-        self._refresh_pages()
-        self.dbg("Pages refreshed")
+        self._setup_transport()
+        self._open_text_index()
+        self._load_pages()
+        self.dbg("Cached pages loaded")
+        self._refresh_pages(sync=False)
+        self._start_probe()
         self.set_default_icon(self.load_icon(self.DEFAULT_ICON))
         self.dbg("Default icon set")
 
     def on_catalog(self):
+        with self._metrics.timer("catalog.build"):
+            catalog = self._build_catalog()
+        self._metrics.observe("catalog.items", len(catalog))
+        self.set_catalog(catalog)
+
+    def _build_catalog(self):
         catalog = []
 
-        if self._SEARCH_MODE:
+        # In low_memory mode pages are only suggested, never all in the catalog
+        if self._SEARCH_MODE and not self._LOW_MEMORY:
             catalog.extend(self._generate_suggestions())
         else:
             catalog.append(self.create_item(
@@ -56,14 +134,26 @@ class FandomWiki(kp.Plugin):
                 hit_hint=kp.ItemHitHint.KEEPALL
             ))
 
-        catalog.append(self.create_item(
-            category=self.ITEMCAT_RELOAD,
-            label="FandomWiki: Reload pages",
-            short_desc="Reload list of pages from all wikis",
-            target="reload_pages",
-            args_hint=kp.ItemArgsHint.FORBIDDEN,
-            hit_hint=kp.ItemHitHint.NOARGS
-        ))
+        progress = self._index_progress
+        if progress:
+            pages_done, wikis_done, wikis_total = progress
+            catalog.append(self.create_item(
+                category=self.ITEMCAT_CANCEL,
+                label="FandomWiki: Cancel indexing",
+                short_desc=f"Indexing: {wikis_done} of {wikis_total} wikis, {pages_done} pages done",
+                target="cancel_indexing",
+                args_hint=kp.ItemArgsHint.FORBIDDEN,
+                hit_hint=kp.ItemHitHint.NOARGS
+            ))
+        else:
+            catalog.append(self.create_item(
+                category=self.ITEMCAT_RELOAD,
+                label="FandomWiki: Reload pages",
+                short_desc="Reload list of pages from all wikis",
+                target="reload_pages",
+                args_hint=kp.ItemArgsHint.FORBIDDEN,
+                hit_hint=kp.ItemHitHint.NOARGS
+            ))
 
         catalog.append(self.create_item(
             category=self.ITEMCAT_SEARCH,
@@ -74,7 +164,15 @@ class FandomWiki(kp.Plugin):
             hit_hint=kp.ItemHitHint.NOARGS
         ))
 
-        self.set_catalog(catalog)
+        catalog.append(self.create_item(
+            category=self.ITEMCAT_STATS,
+            label="FandomWiki: Stats",
+            short_desc="Requests, crawl, cache, suggestion and catalog timings",
+            target="stats",
+            args_hint=kp.ItemArgsHint.ACCEPTED,
+            hit_hint=kp.ItemHitHint.IGNORE
+        ))
+        return catalog
 
     def on_suggest(self, user_input, items_chain):
         if not items_chain:
@@ -90,28 +188,46 @@ class FandomWiki(kp.Plugin):
         if item.category() == self.ITEMCAT_RELOAD:
             self._refresh_pages()
             return
+        if item.category() == self.ITEMCAT_CANCEL:
+            self._cancel_indexing()
+            return
+        if item.category() == self.ITEMCAT_STATS:
+            # The whole summary, for sharing in a bug report
+            kpu.set_clipboard("\n".join(f"{label}: {desc}" for label, desc in self._stats_lines()))
+            self._save_metrics()
+            return
 
         if item.category() not in (self.ITEMCAT_RESULT, self.ITEMCAT_SEARCH):
             return
 
+        self._record_usage(item)
         if not action or action.name() == self.ACTION_OPEN_BROWSER:
             kpu.web_browser_command(url=item.target(), execute=True)
         elif action.name() == self.ACTION_COPY_URL:
             kpu.set_clipboard(item.target())
 
-    def on_events(self, flags):
-        self.dbg(f"on_events called with flags: {flags}")
-        if flags & kp.Events.PACKCONFIG:
-            self._read_config()
-            self._load_wikis()
-            self._refresh_pages()
-
     def _read_config(self):
         self.dbg("Reading configuration")
         settings = self.load_settings()
         self._SEARCH_MODE = settings.get_bool("global_results", "main", False)
         self._SHOW_WIKI_NAME = settings.get_bool("show_wiki_name", "main", True)
         self._DOWNLOAD_ICONS = settings.get_bool("download_icons", "main", True)
+        self._MAX_CONNECTIONS = settings.get_int("max_connections", "main", 8, min=1)
+        self._MAX_CONNECTIONS_PER_HOST = settings.get_int("max_connections_per_host", "main", 2, min=1)
+        self._TIMEOUT = settings.get_float("timeout", "main", 15.0, min=1.0)
+        self._MAX_RESULTS = settings.get_int("max_results", "main", 100, min=1)
+        self._METRICS_FILE = settings.get_bool("metrics_file", "main", False)
+        self._TEXT_INDEX = settings.get_bool("text_index", "main", False)
+        self._USAGE_BOOST = settings.get_bool("usage_boost", "main", True)
+        self._LOW_MEMORY = settings.get_bool("low_memory", "main", False)
+        self._AUTO_REFRESH_INTERVAL = settings.get_float("auto_refresh_interval", "main", 30.0, min=0.0)
+        self._CATALOG_LIMIT = settings.get_int("catalog_limit", "main", 0, min=0)
+        self._CATALOG_PRIORITY = settings.get_enum(
+            "catalog_priority", "main", "order", ["order", "balanced"])
+        self._TEXT_SEARCH_DELAY = settings.get_float("text_search_delay", "main", 0.25, min=0.0)
+        self._TEXT_SEARCH_DEADLINE = settings.get_float("text_search_deadline", "main", 3.0, min=0.1)
+        self._text_search_cache = LruCache(
+            self.TEXT_SEARCH_CACHE_SIZE, settings.get_float("text_search_cache_ttl", "main", 300.0, min=0.0))
         self._wikis = settings.get("wikis", "main", "").split(',')
         self._wikis = [wiki.strip() for wiki in self._wikis if wiki.strip()]
         self.dbg(f"Configuration read: Search mode: {self._SEARCH_MODE}, Show wiki name: {self._SHOW_WIKI_NAME}, Download icons: {self._DOWNLOAD_ICONS}")
@@ -122,112 +238,133 @@ class FandomWiki(kp.Plugin):
         self._wikis = [{'name': wiki, 'url': f'https://{wiki}.fandom.com'} for wiki in self._wikis]
         self.dbg(f"Wikis loaded: {self._wikis}")
 
-    def _refresh_pages(self):
-        self.dbg("Refreshing pages")
-        self._wiki_pages = self._load_cached_pages() or []
-        if not self._wiki_pages:
-            self.dbg("No cached pages found, fetching from wikis")
-            for wiki in self._wikis:
-                self.dbg(f"Fetching pages for wiki: {wiki['name']}")
-                start_time = time.time()
-                pages = self._get_all_pages(wiki)
-                self._wiki_pages.extend(pages)
-                self.dbg(f"Fetched {len(pages)} pages for {wiki['name']} in {time.time() - start_time:.2f} seconds")
-            self._save_cached_pages()
-            self.dbg("Pages saved to cache")
+    def _setup_transport(self):
+        # keypirinha_net resolves the proxies from Keypirinha's network
+        # settings; the pooled transport reuses them for its own connections
+        proxies = {}
+        opener = kpnet.build_urllib_opener()
+        for handler in opener.handlers:
+            if isinstance(handler, urllib.request.ProxyHandler):
+                proxies.update(handler.proxies)
+        if self._transport:
+            self._transport.close()
+        self._transport = ApiTransport(timeout=self._TIMEOUT, proxies=proxies, metrics=self._metrics)
+        self.dbg(f"Transport ready. Timeout: {self._TIMEOUT}s, proxies: {list(proxies)}")
 
-        if self._DOWNLOAD_ICONS:
-            self.dbg("Downloading icons")
-            self._download_icons()
-        
-        self.dbg(f"Total pages loaded: {len(self._wiki_pages)}")
-        self.info("All pages downloaded and ready to use.")
+    def _api_request(self, url, params):
+        return self._transport.request_json(url, params)
 
-    def _get_all_pages(self, wiki):
-        self.dbg(f"Fetching all pages for wiki: {wiki['name']}")
-        url = f"{wiki['url']}/api.php"
+    def _get_icon_handle(self, page):
+        # None leaves the item with the plugin's default icon
+        if not self._DOWNLOAD_ICONS:
+            return None
+        file_name = self._icon_manifest.page_icon(page['wiki_name'], page['pageid'])
+        if file_name is None:
+            return None
+        handle = self._icon_handles.get(file_name)
+        if handle is None:
+            handle = self.load_icon(os.path.join(self._IMAGES_PATH, file_name))
+            self._icon_handles.put(file_name, handle)
+        return handle
 
-        all_pages = []
-        continue_token = None
+    def _generate_suggestions(self):
+        """
+        Return the catalog items of the indexed pages, within catalog_limit.
 
-        while True:
-            params = {
-                'action': 'query',
-                'list': 'allpages',
-                'aplimit': 'max',
-                'format': 'json'
-            }
-            if continue_token:
-                params['apcontinue'] = continue_token
+        Items are memoized per wiki: a wiki whose pages and icons did not
+        change hands back its previous item list, and a changed wiki only
+        creates items for the pages whose title, description or icon differ.
+        """
+        with self._catalog_lock:
+            previous = self._catalog_items
+            self._catalog_items = {}
+            for store in self._wiki_pages.stores:
+                self._catalog_items[store.name] = self._catalog_entry(store, previous.get(store.name))
+            wiki_items = [entry.items for entry in self._catalog_items.values()]
 
-            try:
-                req = urllib.request.Request(url, data=urllib.parse.urlencode(params).encode())
-                with urllib.request.urlopen(req) as response:
-                    data = json.loads(response.read())
-
-                for page in data['query']['allpages']:
-                    page_info = self._get_page_info(wiki, page['pageid'])
-                    all_pages.append({
-                        'pageid': page['pageid'],
-                        'title': page['title'],
-                        'url': f"{wiki['url']}/wiki/{page['title'].replace(' ', '_')}",
-                        'wiki_name': wiki['name'],
-                        'thumbnail': page_info['thumbnail'],
-                        'categories': page_info['categories']
-                    })
-
-                if 'continue' in data:
-                    continue_token = data['continue']['apcontinue']
-                else:
-                    break
-            except Exception as e:
-                self.err(f"Error fetching pages from {wiki['name']}: {str(e)}")
-                break
+        if not self._CATALOG_LIMIT:
+            return [item for items in wiki_items for item in items]
+        if self._CATALOG_PRIORITY == "balanced":
+            counts = self._balanced_shares([len(items) for items in wiki_items], self._CATALOG_LIMIT)
+        else:
+            # Wikis listed first fill the catalog first
+            counts, remaining = [], self._CATALOG_LIMIT
+            for items in wiki_items:
+                counts.append(min(len(items), remaining))
+                remaining -= counts[-1]
+        return [item for items, count in zip(wiki_items, counts) for item in items[:count]]
 
-        return all_pages
+    def _catalog_entry(self, store, previous):
+        icons_version = self._icon_manifest.version(store.name) if self._DOWNLOAD_ICONS else None
+        if previous is not None and previous.store is store and previous.icons_version == icons_version:
+            return previous
 
-    def _get_page_info(self, wiki, pageid):
-        url = f"{wiki['url']}/api.php"
-        params = {
-            'action': 'query',
-            'pageids': pageid,
-            'prop': 'pageimages|categories',
-            'pithumbsize': 500,
-            'format': 'json'
-        }
+        memo = previous.memo if previous is not None else {}
+        entry = _CatalogEntry(store, icons_version)
+        # Left for a newer store the catalog has not seen yet; the changes
+        # were noted against the store of *previous*
+        changes = self._store_changes.get(store.name)
+        if changes is None or changes[0] is not store:
+            changes = None
+        else:
+            del self._store_changes[store.name]
+        if changes is not None and previous is not None and previous.icons_version == icons_version:
+            # Only the pages fetched again can have changed
+            refetched = changes[1]
+            for row, pageid in enumerate(store.pageids):
+                cached = memo.get(pageid)
+                if cached is None or pageid in refetched:
+                    cached = self._catalog_memo(store, store[row], cached)
+                entry.memo[pageid] = cached
+                entry.items.append(cached[1])
+            return entry
 
-        try:
-            req = urllib.request.Request(url, data=urllib.parse.urlencode(params).encode())
-            with urllib.request.urlopen(req) as response:
-                data = json.loads(response.read())
-
-            page_data = data['query']['pages'][str(pageid)]
-            thumbnail_url = page_data.get('thumbnail', {}).get('source')
-            categories = [cat['title'].split(':')[-1] for cat in page_data.get('categories', [])]
-
-            return {
-                'thumbnail': thumbnail_url,
-                'categories': categories
-            }
-        except Exception as e:
-            self.err(f"Error fetching page info for pageid {pageid} from {wiki['name']}: {str(e)}")
-            return {'thumbnail': None, 'categories': []}
+        for page in store:
+            cached = self._catalog_memo(store, page, memo.get(page.pageid))
+            entry.memo[page.pageid] = cached
+            entry.items.append(cached[1])
+        return entry
 
-    def _get_icon_handle(self, page):
-        return self.load_icon(self.DEFAULT_ICON)  
-        #icon_path = os.path.join(self._IMAGES_PATH, f"{page['wiki_name']}-{page['pageid']}.png") # Include wiki name
-        #self.dbg(f"Trying to load icon from: {icon_path}")  
-        #if os.path.exists(icon_path):
-        #    self.dbg(f"Icon file exists: {icon_path}")  
-        #    return self.load_icon(icon_path)  # Load the pre-downloaded image
-        #elif os.path.exists(os.path.join(self._IMAGES_PATH, f"{page['wiki_name']}_logo.png")):
-        #    return self.load_icon(os.path.join(self._IMAGES_PATH, f"{page['wiki_name']}_logo.png"))
-        #else:
-        #    return self.load_icon(self.DEFAULT_ICON) 
+    def _catalog_memo(self, store, page, cached):
+        """
+        Return the ``(signature, item)`` memo of a catalog page, reusing the
+        item of *cached* when its signature still matches
+        """
+        short_desc = f"[{store.name}] {', '.join(page.categories)}"
+        icon = self._icon_manifest.page_icon(store.name, page.pageid) if self._DOWNLOAD_ICONS else None
+        signature = (page.title, short_desc, icon)
+        if cached is not None and cached[0] == signature:
+            return cached
+        return signature, self.create_item(
+            category=self.ITEMCAT_RESULT,
+            label=page.title,
+            short_desc=short_desc,
+            target=page.url,
+            args_hint=kp.ItemArgsHint.FORBIDDEN,
+            hit_hint=kp.ItemHitHint.NOARGS,
+            icon_handle=self._get_icon_handle(page),
+            data_bag=self._page_key(store.name, page.pageid)
+        )
 
-    def _generate_suggestions(self):
+    @staticmethod
+    def _balanced_shares(sizes, limit):
+        """Split *limit* evenly over wikis of *sizes*, passing unused shares on"""
+        counts = [0] * len(sizes)
+        remaining = limit
+        order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+        for position, i in enumerate(order):
+            counts[i] = min(sizes[i], remaining // (len(sizes) - position))
+            remaining -= counts[i]
+        return counts
+
+    def _suggest_pages(self, user_input):
+        start_time = time.perf_counter()
         suggestions = []
-        for page in self._wiki_pages:
+        index = self._page_index
+
+        # Only the best matches get an item, in rank order
+        for pageid in index.top(user_input, self._MAX_RESULTS):
+            page = index.pages[pageid]
             suggestions.append(self.create_item(
                 category=self.ITEMCAT_RESULT,
                 label=page['title'],
@@ -235,79 +372,186 @@ class FandomWiki(kp.Plugin):
                 target=page['url'],
                 args_hint=kp.ItemArgsHint.FORBIDDEN,
                 hit_hint=kp.ItemHitHint.NOARGS,
-                icon_handle=self._get_icon_handle(page)
+                icon_handle=self._get_icon_handle(page),
+                data_bag=self._page_key(page['wiki_name'], page['pageid'])
             ))
-        return suggestions
-
-    def _suggest_pages(self, user_input):
-        suggestions = []
-        user_input = user_input.lower()
-
-        for page in self._wiki_pages:
-            if (user_input in page['title'].lower() or
-                any(user_input in cat.lower() for cat in page['categories']) or
-                user_input in page['wiki_name'].lower()):
-                
-                suggestions.append(self.create_item(
-                    category=self.ITEMCAT_RESULT,
-                    label=page['title'],
-                    short_desc=f"[{page['wiki_name']}] {', '.join(page['categories'])}",
-                    target=page['url'],
-                    args_hint=kp.ItemArgsHint.FORBIDDEN,
-                    hit_hint=kp.ItemHitHint.NOARGS,
-                    icon_handle=self._get_icon_handle(page)
-                ))
 
         self.set_suggestions(suggestions, kp.Match.ANY, kp.Sort.NONE)
+        self._metrics.observe_time("suggest.latency", time.perf_counter() - start_time)
+        self._metrics.observe("suggest.matches", len(suggestions))
 
     def _suggest_text_search(self, user_input):
+        user_input = user_input.strip()
+        if not user_input:
+            return
+
+        # "<wiki> <term>" searches that one wiki, anything else every wiki;
+        # only a whole wiki name counts, any short word would match a part
         parts = user_input.split(' ', 1)
-        if len(parts) < 2:
+        wiki = None
+        if len(parts) == 2 and parts[1].strip():
+            wiki = next((w for w in self._wikis if parts[0].lower() == w['name'].lower()), None)
+        if wiki is None:
+            self._suggest_text_search_all(user_input)
             return
+        search_term = parts[1].strip()
 
-        wiki_name, search_term = parts
-        wiki = next((w for w in self._wikis if wiki_name.lower() in w['name'].lower()), None)
+        # Wikis in the full-text index answer locally, without any delay
+        results = self._local_text_search([wiki], search_term).get(wiki['name'])
+        if results is None:
+            results = self._text_search_cache.get((wiki['name'], search_term.lower()))
+        if results is None:
+            # Narrow down the results of a shorter query right away, the
+            # request for the full query refines them below
+            narrowed = self._narrow_text_search(wiki, search_term)
+            if narrowed is not None:
+                self.set_suggestions(self._text_search_items([(wiki, result) for result in narrowed]),
+                                     kp.Match.ANY, kp.Sort.NONE)
 
-        if not wiki:
-            self.set_suggestions([self.create_error_item(
-                label="Invalid wiki",
-                short_desc="Please enter a valid wiki name followed by your search term"
-            )])
-            return
+            # Wait for typing to pause before hitting the API; a new
+            # keystroke terminates this call
+            if self.should_terminate(self._TEXT_SEARCH_DELAY):
+                return
+
+            future = self._search_pool.submit(self._fetch_text_search, wiki, search_term)
+            while True:
+                try:
+                    results = future.result(timeout=0.05)
+                    break
+                except concurrent.futures.TimeoutError:
+                    # The request is left to finish on its own; its response
+                    # still lands in the cache
+                    if self.should_terminate():
+                        return
+                except Exception as e:
+                    self.err(f"Error performing text search on {wiki['name']}: {str(e)}")
+                    self.set_suggestions([self.create_error_item(
+                        label="Search error",
+                        short_desc=f"An error occurred while searching {wiki['name']}: {str(e)}"
+                    )])
+                    return
+
+        if not self.should_terminate():
+            self.set_suggestions(self._text_search_items([(wiki, result) for result in results]),
+                                 kp.Match.ANY, kp.Sort.NONE)
+
+    def _suggest_text_search_all(self, search_term):
+        """
+        Search every configured wiki at once. Wikis in the full-text index
+        answer locally, the others through the API. Responses arriving after
+        the deadline are dropped; the results of the others are interleaved
+        by rank, in wiki order.
+        """
+        results = self._local_text_search(self._wikis, search_term)
+        pending = []
+        for wiki in self._wikis:
+            if wiki['name'] in results:
+                continue
+            cached = self._text_search_cache.get((wiki['name'], search_term.lower()))
+            if cached is None:
+                pending.append(wiki)
+            else:
+                results[wiki['name']] = cached
+
+        if pending:
+            if self.should_terminate(self._TEXT_SEARCH_DELAY):
+                return
+            deadline = time.monotonic() + self._TEXT_SEARCH_DEADLINE
+            futures = {self._search_pool.submit(self._fetch_text_search, wiki, search_term): wiki
+                       for wiki in pending}
+            while futures:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.dbg(f"Text search deadline passed, dropped: {[wiki['name'] for wiki in futures.values()]}")
+                    break
+                done, _ = concurrent.futures.wait(
+                    futures, timeout=min(remaining, 0.05),
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                if self.should_terminate():
+                    return
+                for future in done:
+                    wiki = futures.pop(future)
+                    try:
+                        results[wiki['name']] = future.result()
+                    except Exception as e:
+                        self.warn(f"Error performing text search on {wiki['name']}: {str(e)}")
+                if done and futures:
+                    # Show what arrived so far while the slower wikis answer
+                    self.set_suggestions(self._merge_text_search(results), kp.Match.ANY, kp.Sort.NONE)
+
+        if not self.should_terminate():
+            self.set_suggestions(self._merge_text_search(results), kp.Match.ANY, kp.Sort.NONE)
+
+    def _local_text_search(self, wikis, search_term):
+        """
+        Return a dict of wiki name to the results of the full-text index, for
+        the wikis of *wikis* it holds completely.
+        """
+        text_index = self._text_index
+        if text_index is None:
+            return {}
+        names = [wiki['name'] for wiki in wikis if text_index.is_complete(wiki['name'])]
+        if not names:
+            return {}
+        try:
+            with self._metrics.timer("text_search.local"):
+                return text_index.search(search_term, names, self.TEXT_SEARCH_LIMIT)
+        except Exception as e:
+            # The API answers instead
+            self.err(f"Error searching the full-text index: {str(e)}")
+            return {}
 
+    def _merge_text_search(self, results):
+        ranked = [(wiki, results[wiki['name']]) for wiki in self._wikis if wiki['name'] in results]
+        merged = []
+        for rank in range(max((len(wiki_results) for _, wiki_results in ranked), default=0)):
+            for wiki, wiki_results in ranked:
+                if rank < len(wiki_results):
+                    merged.append((wiki, wiki_results[rank]))
+        return self._text_search_items(merged)
+
+    def _fetch_text_search(self, wiki, search_term):
         url = f"{wiki['url']}/api.php"
         params = {
             'action': 'query',
             'list': 'search',
             'srsearch': search_term,
+            'srprop': 'snippet',
             'format': 'json'
         }
+        data = self._api_request(url, params)
+        results = [{'pageid': result['pageid'], 'title': result['title'], 'snippet': result['snippet']}
+                   for result in data['query']['search']]
+        self._text_search_cache.put((wiki['name'], search_term.lower()), results)
+        return results
 
-        try:
-            req = urllib.request.Request(url, data=urllib.parse.urlencode(params).encode())
-            with urllib.request.urlopen(req) as response:
-                data = json.loads(response.read())
-            search_results = data['query']['search']
-
-            suggestions = []
-            for result in search_results:
-                suggestions.append(self.create_item(
+    def _narrow_text_search(self, wiki, search_term):
+        """
+        Return the cached results of the longest cached query *search_term*
+        extends, filtered down to the ones still mentioning it, or None
+        """
+        term = search_term.lower()
+        best_query, best_results = "", None
+        for (name, query), results in self._text_search_cache.items():
+            if name == wiki['name'] and term.startswith(query) and len(query) > len(best_query):
+                best_query, best_results = query, results
+        if best_results is None:
+            return None
+        return [result for result in best_results
+                if term in result['title'].lower() or term in result['snippet'].lower()]
+
+    def _text_search_items(self, results):
+        """Create the items for a list of ``(wiki, result)`` pairs"""
+        return [self.create_item(
                     category=self.ITEMCAT_RESULT,
                     label=result['title'],
-                    short_desc=f"[{wiki['name']}] {result['snippet']}",
+                    short_desc=f"[{wiki['name']}] {self._clean_snippet(result['snippet'])}",
                     target=f"{wiki['url']}/wiki/{result['title'].replace(' ', '_')}",
                     args_hint=kp.ItemArgsHint.FORBIDDEN,
                     hit_hint=kp.ItemHitHint.NOARGS,
-                    icon_handle=self._get_icon_handle({'wiki_name': wiki['name'], 'pageid': result['pageid']})
-                ))
-
-            self.set_suggestions(suggestions)
-        except Exception as e:
-            self.err(f"Error performing text search on {wiki['name']}: {str(e)}")
-            self.set_suggestions([self.create_error_item(
-                label="Search error",
-                short_desc=f"An error occurred while searching {wiki['name']}: {str(e)}"
-            )])
+                    icon_handle=self._get_icon_handle({'wiki_name': wiki['name'], 'pageid': result['pageid']}),
+                    data_bag=self._page_key(wiki['name'], result['pageid'])
+                ) for wiki, result in results]
 
     def _create_error_item(self, label, short_desc):
         return self.create_item(
@@ -323,20 +567,18 @@ class FandomWiki(kp.Plugin):
         # Remove HTML tags from the snippet
         clean_text = re.sub('<[^<]+?>', '', snippet)
         # Replace multiple spaces with a single space
-        clean_text = re.sub('\s+', ' ', clean_text).strip()
-        return clean_text
+        clean_text = re.sub(r'\s+', ' ', clean_text).strip()
+        # Decode entities such as &quot; left in the snippet text
+        return html.unescape(clean_text)
 
     def on_activated(self):
         pass
 
     def on_deactivated(self):
-        pass
-
-    def on_events(self, flags):
-        if flags & kp.Events.PACKCONFIG:
-            self._read_config()
-            self._load_wikis()
-            self._refresh_pages()
+        # The launcher window closed, a good time to write the metrics and
+        # the launches not saved yet, which a scheduled save may never reach
+        self._save_metrics()
+        self._save_usage()
 
     def _create_actions(self):
         actions = [
@@ -363,11 +605,21 @@ class FandomWiki(kp.Plugin):
         return False
 
     def on_events(self, flags):
+        self.dbg(f"on_events called with flags: {flags}")
         if flags & kp.Events.PACKCONFIG:
+            low_memory = self._LOW_MEMORY
             self._read_config()
             self._load_wikis()
+            self._setup_transport()
+            self._open_text_index()
+            if self._LOW_MEMORY != low_memory:
+                self._load_pages()
+            else:
+                self._set_pages(self._wiki_cache)
             self._refresh_pages()
+            self._start_probe()
         elif flags & kp.Events.NETOPTIONS:
+            self._setup_transport()
             self._refresh_pages()
 
     def on_executed(self, item):
@@ -382,53 +634,594 @@ class FandomWiki(kp.Plugin):
                 hit_hint=kp.ItemHitHint.IGNORE
             )])
 
-    def _load_cached_pages(self):
-        cache_path = os.path.join(self.get_package_cache_path(), "pages_cache.json")
-        if os.path.exists(cache_path):
+    def _load_cached_pages(self, wikis=None):
+        """
+        Return a dict of wiki name to PageStore for the configured wikis, or
+        *wikis*; in low_memory mode, to the TitleFile mapping their pages
+        """
+        self._migrate_json_cache()
+        wiki_cache = {}
+        for wiki in self._wikis if wikis is None else wikis:
+            cache_path = pagecache.cache_file(self._PAGES_PATH, wiki['name'])
+            if not os.path.exists(cache_path):
+                continue
+            if self._LOW_MEMORY:
+                title_file = self._load_title_file(wiki, cache_path)
+                if title_file is not None:
+                    wiki_cache[wiki['name']] = title_file
+                continue
+            try:
+                with self._metrics.timer("cache.load", wiki['name']):
+                    wiki_cache[wiki['name']] = pagecache.read_store(cache_path, wiki['name'], wiki['url'])
+            except Exception as e:
+                # Left out of the cache, the wiki gets crawled again
+                self.err(f"Error loading cached pages of {wiki['name']}: {str(e)}")
+        return wiki_cache
+
+    def _save_cached_pages(self, wikis):
+        os.makedirs(self._PAGES_PATH, exist_ok=True)
+        for name, store in wikis.items():
+            try:
+                cache_path = pagecache.cache_file(self._PAGES_PATH, name)
+                with self._metrics.timer("cache.save", name):
+                    pagecache.write_store(cache_path, store)
+                if self._LOW_MEMORY:
+                    # The mapped title file of the last sync lends the sorted
+                    # strings of the pages left unchanged
+                    previous = self._wiki_cache.get(name)
+                    if not isinstance(previous, diskindex.TitleFile):
+                        previous = None
+                    with self._metrics.timer("index.build", name):
+                        diskindex.write_title_file(self._PAGES_PATH, store, diskindex.source_stamp(cache_path),
+                                                   previous)
+            except Exception as e:
+                self.err(f"Error saving cached pages of {name}: {str(e)}")
+
+    def _load_title_file(self, wiki, cache_path):
+        """
+        Map the title file of a wiki, first building it from its page cache
+        when missing or outdated. Return None if neither works.
+        """
+        source = diskindex.source_stamp(cache_path)
+        try:
+            with self._metrics.timer("cache.load", wiki['name']):
+                title_file = diskindex.open_title_file(self._PAGES_PATH, wiki['name'], wiki['url'], source)
+            if title_file is not None:
+                return title_file
+        except Exception as e:
+            self.err(f"Error loading the title file of {wiki['name']}: {str(e)}")
+        try:
+            with self._metrics.timer("index.build", wiki['name']):
+                store = pagecache.read_store(cache_path, wiki['name'], wiki['url'])
+                path = diskindex.write_title_file(self._PAGES_PATH, store, source)
+            del store
+            return diskindex.TitleFile(path, wiki['url'])
+        except Exception as e:
+            # Left out of the cache, the wiki gets crawled again
+            self.err(f"Error building the title file of {wiki['name']}: {str(e)}")
+            return None
+
+    def _migrate_json_cache(self):
+        # pages_cache.json held every wiki in a single file up to now
+        json_path = os.path.join(self.get_package_cache_path(), "pages_cache.json")
+        if not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, 'r') as cache_file:
+                cached = json.load(cache_file)
+            if isinstance(cached, list):
+                # Plain page list written by older versions, never synced
+                wikis = {}
+                for page in cached:
+                    wikis.setdefault(page['wiki_name'], {'synced': None, 'pages': []})['pages'].append(page)
+            else:
+                wikis = cached['wikis']
+            urls = {wiki['name']: wiki['url'] for wiki in self._wikis}
+            self._save_cached_pages({
+                name: PageStore.from_pages(
+                    name, urls.get(name, f'https://{name}.fandom.com'), wiki['pages'], wiki['synced'])
+                for name, wiki in wikis.items()})
+            os.remove(json_path)
+            self.info(f"Migrated {len(wikis)} wikis from pages_cache.json")
+        except Exception as e:
+            self.err(f"Error migrating cached pages: {str(e)}")
+
+    def _load_crawl_checkpoints(self, wikis):
+        """Return the checkpoints of interrupted crawls of *wikis*, for WikiCrawler.crawl"""
+        checkpoints = {}
+        for wiki in wikis:
             try:
-                with open(cache_path, 'r') as cache_file:
-                    return json.load(cache_file)
+                checkpoint = pagecache.read_checkpoint(self._PAGES_PATH, wiki['name'], wiki['url'])
             except Exception as e:
-                self.err(f"Error loading cached pages: {str(e)}")
-        return None
+                self.err(f"Error loading the crawl checkpoint of {wiki['name']}: {str(e)}")
+                self._remove_crawl_checkpoint(wiki['name'])
+                continue
+            if checkpoint:
+                store, continue_params = checkpoint
+                checkpoints[wiki['name']] = (store.synced, store.to_pages(), continue_params)
+        return checkpoints
 
-    def _save_cached_pages(self):
-        cache_path = os.path.join(self.get_package_cache_path(), "pages_cache.json")
+    def _save_crawl_checkpoint(self, wiki, started, pages, continue_params):
+        os.makedirs(self._PAGES_PATH, exist_ok=True)
+        pagecache.write_checkpoint(
+            self._PAGES_PATH, wiki['name'], PageStore.from_pages(wiki['name'], wiki['url'], pages, started),
+            continue_params)
+
+    def _remove_crawl_checkpoint(self, wiki_name):
         try:
-            with open(cache_path, 'w') as cache_file:
-                json.dump(self._wiki_pages, cache_file)
+            pagecache.remove_checkpoint(self._PAGES_PATH, wiki_name)
         except Exception as e:
-            self.err(f"Error saving cached pages: {str(e)}")
+            self.err(f"Error removing the crawl checkpoint of {wiki_name}: {str(e)}")
+
+    def _load_pages(self):
+        """Serve the cached pages of the configured wikis, without any network access"""
+        self._set_pages(self._load_cached_pages())
+        self.dbg(f"Total pages loaded: {len(self._wiki_pages)}")
+
+    def _set_pages(self, wiki_cache):
+        stores = [wiki_cache[wiki['name']] for wiki in self._wikis if wiki['name'] in wiki_cache]
+        with self._metrics.timer("index.build"):
+            if self._LOW_MEMORY:
+                pages = DiskPageSet(stores)
+                index = DiskPageIndex(pages, self._usage_boosts(pages))
+            else:
+                pages = PageSet(stores)
+                index = PageIndex(pages, self._usage_boosts(pages))
+        # The index holds its own page list; swapping it with a single
+        # assignment means suggestions running on another thread never see
+        # a half-built snapshot
+        self._page_index = index
+        self._wiki_pages = pages
+        self._wiki_cache = wiki_cache
+
+    @staticmethod
+    def _page_key(wiki_name, pageid):
+        """The data bag of a page item, naming the page for the usage history"""
+        return f"{wiki_name}:{pageid}"
+
+    def _usage_boosts(self, pages):
+        """Return the usage scores of *pages* by position, for a PageIndex"""
+        if not self._USAGE_BOOST:
+            return None
+        boosts = {}
+        for offset, store in pages.segments():
+            scores = self._usage.scores(store.name)
+            if scores:
+                for row, pageid in enumerate(store.pageids):
+                    if pageid in scores:
+                        boosts[offset + row] = scores[pageid]
+        return boosts
+
+    def _record_usage(self, item):
+        """Count a launch of a page item and rank the page up right away"""
+        if not self._USAGE_BOOST or not item.data_bag():
+            return
+        wiki_name, _, pageid = item.data_bag().rpartition(':')
+        try:
+            pageid = int(pageid)
+            score = self._usage.record(wiki_name, pageid)
+        except Exception as e:
+            self.err(f"Error recording the use of {item.label()}: {str(e)}")
+            return
+        index = self._page_index
+        for offset, store in index.pages.segments():
+            if store.name == wiki_name:
+                row = store.row(pageid)
+                # None for a text search result not indexed (yet)
+                if row is not None:
+                    index.boost(offset + row, score)
+                break
+
+    def _refresh_pages(self, sync=True, wikis=None):
+        """
+        Start indexing in the background. Wikis missing from the cache are
+        crawled; with *sync*, cached wikis are also brought up to date with
+        their recent changes. *wikis* limits the run to some of the wikis.
+        The current pages stay in use until it is done.
+        """
+        self._cancel_indexing()
+        cancel = threading.Event()
+        self._index_cancel = cancel
+        threading.Thread(
+            target=self._index_pages, args=(sync, cancel, wikis),
+            name="FandomWiki indexer", daemon=True).start()
+
+    def _start_probe(self):
+        """(Re)start the periodic staleness probe, see _probe_wikis"""
+        if self._probe_stop:
+            self._probe_stop.set()
+            self._probe_stop = None
+        if not self._AUTO_REFRESH_INTERVAL:
+            return
+        stop = threading.Event()
+        self._probe_stop = stop
+        threading.Thread(
+            target=self._probe_loop, args=(stop, self._AUTO_REFRESH_INTERVAL * 60),
+            name="FandomWiki probe", daemon=True).start()
+
+    def _probe_loop(self, stop, interval):
+        while not stop.wait(interval):
+            if self.should_terminate():
+                return
+            try:
+                self._probe_wikis()
+            except Exception as e:
+                self.err(f"Error checking wikis for changes: {str(e)}")
+
+    def _probe_wikis(self):
+        """
+        Sync the wikis whose page or edit count moved since they were
+        indexed, at the cost of one siteinfo request per wiki.
+        """
+        if self._index_lock.locked():
+            return  # indexing already, check again next time
+        wikis = list(self._wikis)
+        wiki_cache = self._wiki_cache
+        if not wikis:
+            return
+        with self._metrics.timer("probe.total"):
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=min(len(wikis), self._MAX_CONNECTIONS),
+                    thread_name_prefix="FandomWiki probe") as pool:
+                infos = list(pool.map(lambda wiki: self._get_wiki_info(wiki, log_errors=False), wikis))
+        self._report_probe_failures(wikis, infos)
+
+        changed = []
+        for wiki, info in zip(wikis, infos):
+            if info is None:
+                continue  # unreachable, check again next time
+            store = wiki_cache.get(wiki['name'])
+            if store is None:
+                changed.append(wiki)  # never indexed successfully
+                continue
+            try:
+                statistics = site_statistics(info)
+            except (KeyError, TypeError, ValueError):
+                continue
+            if statistics != store.statistics:
+                changed.append(wiki)
+        if changed:
+            self.info(f"Wikis changed since indexed: {[wiki['name'] for wiki in changed]}")
+            self._refresh_pages(wikis=changed)
+        else:
+            self.dbg("No wiki changed since indexed")
+
+    def _cancel_indexing(self):
+        if self._index_cancel:
+            self._index_cancel.set()
+
+    def _index_pages(self, sync, cancel, wikis=None):
+        # A cancelled run may still be waiting on its last requests
+        with self._index_lock:
+            if cancel.is_set():
+                return
+            outdated = [wiki for wiki in (wikis or self._wikis)
+                        if sync or wiki['name'] not in self._wiki_cache]
+            texts = []
+            if outdated:
+                self._crawl_pages(outdated, cancel)
+            if self._text_index and not cancel.is_set():
+                # Besides the wikis just crawled, finish the ones an earlier
+                # run left incomplete
+                texts = outdated + [wiki for wiki in self._wikis if wiki not in outdated
+                                    and not self._text_index.is_complete(wiki['name'])]
+                if texts:
+                    with self._metrics.timer("text.index"):
+                        self._index_texts(texts, cancel)
+            icons = 0
+            if self._DOWNLOAD_ICONS and not cancel.is_set():
+                with self._metrics.timer("icons.download"):
+                    icons = self._download_icons(cancel)
 
-    def _refresh_pages(self):
-        self._wiki_pages = self._load_cached_pages() or []
-        if not self._wiki_pages:
-            for wiki in self._wikis:
-                self._wiki_pages.extend(self._get_all_pages(wiki))
-            self._save_cached_pages()
+        # Crawls and text indexing show the cancel item, which the rebuild removes
+        if (outdated or texts or icons) and not self.should_terminate():
+            self.on_catalog()
+        self._save_metrics()
 
-    def _get_wiki_info(self, wiki):
+    def _crawl_pages(self, wikis, cancel):
+        self.dbg(f"Fetching pages from wikis: {[wiki['name'] for wiki in wikis]}")
+        self._on_index_progress(0, 0, len(wikis))
+        start_time = time.time()
+        try:
+            crawler = self._new_crawler(cancel)
+            wiki_cache = dict(self._wiki_cache)
+            with self._metrics.timer("crawl.total"):
+                # In low_memory mode, syncs read the unchanged pages from
+                # the mapped title files
+                crawled = crawler.crawl(
+                    wikis, synced=self._wiki_cache, resume=self._load_crawl_checkpoints(wikis))
+            if self._LOW_MEMORY:
+                # Served from disk: saved first, then mapped back
+                self._save_cached_pages(crawled)
+                crawled = self._load_cached_pages([wiki for wiki in wikis if wiki['name'] in crawled])
+            self._note_store_changes(wiki_cache, crawled, crawler.refetched)
+            # Failed wikis keep their previous pages, if any
+            wiki_cache.update(crawled)
+            self._set_pages(wiki_cache)
+            self.info(f"Indexed {len(crawled)} of {len(wikis)} wikis in {time.time() - start_time:.2f} seconds, "
+                      f"{len(self._wiki_pages)} pages ready to use")
+            if crawler.failed:
+                self.warn(f"Could not index {', '.join(crawler.failed)}, will retry on the next reload")
+            if not self._LOW_MEMORY:
+                self._save_cached_pages(crawled)
+            for name in crawled:
+                self._remove_crawl_checkpoint(name)
+            self.dbg("Pages saved to cache")
+        except CrawlCancelled:
+            self.info("Indexing cancelled, keeping the previous pages")
+        except Exception as e:
+            self.err(f"Error indexing pages: {str(e)}")
+        finally:
+            self._index_progress = None
+
+    def _note_store_changes(self, previous, crawled, refetched):
+        """
+        Remember which pages of the incrementally synced stores were fetched
+        again, so the global catalog only rebuilds their items. Syncs the
+        catalog has not seen yet add up. Without page items in the catalog,
+        nothing is kept.
+        """
+        with self._catalog_lock:
+            if not self._SEARCH_MODE or self._LOW_MEMORY:
+                self._store_changes.clear()
+                return
+            for name, store in crawled.items():
+                pageids = refetched.get(name)
+                earlier = self._store_changes.pop(name, None)
+                entry = self._catalog_items.get(name)
+                if pageids is None or entry is None:
+                    continue
+                base = previous.get(name)
+                if earlier is not None and earlier[0] is base:
+                    self._store_changes[name] = (store, earlier[1] | pageids)
+                elif entry.store is base:
+                    self._store_changes[name] = (store, pageids)
+
+    def _new_crawler(self, cancel):
+        return WikiCrawler(
+            self._api_request, self,
+            max_connections=self._MAX_CONNECTIONS,
+            max_connections_per_host=self._MAX_CONNECTIONS_PER_HOST,
+            cancelled=lambda: cancel.is_set() or self.should_terminate(),
+            progress=self._on_index_progress,
+            checkpoint=self._save_crawl_checkpoint,
+            metrics=self._metrics)
+
+    def _open_text_index(self):
+        """Open or close the full-text index, following the text_index setting"""
+        if not self._TEXT_INDEX:
+            if self._text_index:
+                self._text_index.close()
+                self._text_index = None
+            return
+        if self._text_index:
+            return
+        if not textindex.available():
+            self.warn("text_index is on but this Python's SQLite has no FTS5, text search stays online")
+            return
+        try:
+            os.makedirs(self._PAGES_PATH, exist_ok=True)
+            self._text_index = TextIndex(os.path.join(self._PAGES_PATH, self.TEXT_INDEX_FILE_NAME))
+        except Exception as e:
+            self.err(f"Error opening the full-text index: {str(e)}")
+
+    def _index_texts(self, wikis, cancel):
+        """Bring the full-text index of *wikis* up to date, see textindex.sync_wikis"""
+        self._on_index_progress(0, 0, len(wikis))
+        start_time = time.time()
+        try:
+            self._text_index.prune({wiki['name'] for wiki in self._wikis})
+            crawler = self._new_crawler(cancel)
+            fetched = textindex.sync_wikis(self._text_index, crawler, wikis, self._wiki_cache, self)
+            self.info(f"Full-text index updated with {fetched} pages in {time.time() - start_time:.2f} seconds")
+            if crawler.failed:
+                self.warn(f"Could not index the content of {', '.join(crawler.failed)}, will retry on the next reload")
+        except CrawlCancelled:
+            self.info("Full-text indexing cancelled, it resumes on the next reload")
+        except Exception as e:
+            self.err(f"Error updating the full-text index: {str(e)}")
+        finally:
+            self._index_progress = None
+
+    def _download_icons(self, cancel):
+        """
+        Download the wiki logos and page thumbnails missing from the icon
+        manifest. Return the number of icons added.
+        """
+        manifest = self._icon_manifest
+        jobs = []
+        for wiki in self._wikis:
+            if not manifest.has_logo(wiki['name']):
+                jobs.append((wiki, None, None))
+            store = self._wiki_cache.get(wiki['name'])
+            if store is None:
+                continue
+            # Title files decode a row for its thumbnail, so the pages
+            # already downloaded are skipped by id first
+            for row, pageid in enumerate(store.pageids):
+                if not manifest.has_page(wiki['name'], pageid):
+                    thumbnail = store[row]['thumbnail']
+                    if thumbnail:
+                        jobs.append((wiki, pageid, thumbnail))
+        if not jobs:
+            return 0
+
+        self.dbg(f"Downloading {len(jobs)} icons")
+        os.makedirs(self._IMAGES_PATH, exist_ok=True)
+        added = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._MAX_CONNECTIONS) as pool:
+            futures = [pool.submit(self._download_icon, wiki, pageid, url, cancel)
+                       for wiki, pageid, url in jobs]
+            for future in concurrent.futures.as_completed(futures):
+                if future.result():
+                    added += 1
+                    if added % self.ICON_MANIFEST_SAVE_INTERVAL == 0:
+                        self._save_icon_manifest()
+        self._save_icon_manifest()
+        self.info(f"Downloaded {added} of {len(jobs)} missing icons")
+        return added
+
+    def _download_icon(self, wiki, pageid, url, cancel):
+        if cancel.is_set() or self.should_terminate():
+            return False
+        try:
+            if pageid is None:
+                info = self._get_wiki_info(wiki)
+                url = info['general'].get('logo') if info else None
+                if not url:
+                    return False
+                if url.startswith('//'):
+                    url = 'https:' + url
+            url = sized_thumbnail_url(url, self.ICON_SIZE)
+            file_name = icon_file_name(wiki['name'], 'logo' if pageid is None else pageid, url)
+            data = self._transport.request(url)
+            with open(os.path.join(self._IMAGES_PATH, file_name), 'wb') as icon_file:
+                icon_file.write(data)
+        except Exception as e:
+            self.warn(f"Error downloading icon {url} for {wiki['name']}: {str(e)}")
+            return False
+
+        # Listed only once complete, a partial file is never loaded
+        if pageid is None:
+            self._icon_manifest.set_logo(wiki['name'], file_name)
+        else:
+            self._icon_manifest.set_page(wiki['name'], pageid, file_name)
+        return True
+
+    def _save_icon_manifest(self):
+        try:
+            self._icon_manifest.save()
+        except Exception as e:
+            self.err(f"Error saving icon manifest: {str(e)}")
+
+    def _on_index_progress(self, pages_done, wikis_done, wikis_total):
+        self._index_progress = (pages_done, wikis_done, wikis_total)
+        now = time.time()
+        if now - self._index_progress_time >= self.PROGRESS_INTERVAL:
+            self._index_progress_time = now
+            self.info(f"Indexing: {wikis_done} of {wikis_total} wikis, {pages_done} pages done")
+            self.on_catalog()
+
+    def _suggest_stats(self):
+        self.set_suggestions([self.create_item(
+            category=self.ITEMCAT_STATS,
+            label=label,
+            short_desc=desc,
+            target=label,
+            args_hint=kp.ItemArgsHint.FORBIDDEN,
+            hit_hint=kp.ItemHitHint.IGNORE
+        ) for label, desc in self._stats_lines()], kp.Match.ANY, kp.Sort.NONE)
+        self._save_metrics()
+
+    def _stats_lines(self):
+        """Return ``(label, description)`` pairs summarizing the metrics"""
+        metrics = self._metrics
+        lines = [("Pages", f"{len(self._wiki_pages)} indexed from {len(self._wiki_pages.stores)} wikis"
+                           f"{', mapped from disk' if self._LOW_MEMORY else ''}")]
+        if self._USAGE_BOOST:
+            lines.append(("Usage history", f"{len(self._usage)} pages launched"))
+        if self._text_index:
+            try:
+                complete = [wiki['name'] for wiki in self._wikis if self._text_index.is_complete(wiki['name'])]
+                lines.append(("Full-text index", f"{self._text_index.count()} pages, "
+                                                 f"searched offline: {', '.join(complete) or 'none yet'}"))
+            except Exception as e:
+                self.err(f"Error reading the full-text index: {str(e)}")
+
+        for host in metrics.labels("http.requests"):
+            latency = metrics.histogram("http.latency", host)
+            lines.append((f"HTTP {host}",
+                          f"{metrics.counter('http.requests', host)} requests, "
+                          f"{metrics.counter('http.bytes', host) / 1e6:.2f} MB, "
+                          f"{metrics.counter('http.errors', host)} errors, "
+                          f"p50 {latency['p50']} ms, p99 {latency['p99']} ms"))
+
+        for wiki in self._wikis:
+            retries = metrics.counter("crawl.retries", wiki['name'])
+            throttled = metrics.counter("crawl.throttled", wiki['name'])
+            if retries or throttled:
+                lines.append((f"Retries {wiki['name']}", f"{retries} retries, throttled {throttled} times"))
+
+        timings = (
+            ("crawl.total", "Crawl"),
+            ("crawl.list", "Crawl listing"),
+            ("crawl.page_info", "Crawl page info"),
+            ("crawl.recent_changes", "Crawl recent changes"),
+            ("crawl.texts", "Crawl page content"),
+            ("text.index", "Full-text indexing"),
+            ("icons.download", "Icon downloads"),
+            ("probe.total", "Staleness checks"),
+            ("cache.load", "Cache load"),
+            ("cache.save", "Cache save"),
+            ("index.build", "Index build"),
+            ("suggest.latency", "Suggest"),
+            ("text_search.latency", "Text search"),
+            ("text_search.local", "Offline text search"),
+            ("catalog.build", "Catalog build"),
+        )
+        for name, title in timings:
+            for label in metrics.labels(name):
+                timing = metrics.histogram(name, label)
+                desc = (f"{timing['count']} times, p50 {timing['p50']} ms, "
+                        f"p99 {timing['p99']} ms, max {timing['max']} ms")
+                if name == "suggest.latency":
+                    desc += f", {metrics.histogram('suggest.matches')['mean']:.0f} matches on average"
+                elif name == "catalog.build":
+                    desc += f", {metrics.histogram('catalog.items')['max']:.0f} items at most"
+                lines.append((f"{title} {label}" if label else title, desc))
+        return lines
+
+    def _save_metrics(self):
+        if not self._METRICS_FILE:
+            return
+        try:
+            self._metrics.write(os.path.join(self.get_package_cache_path(), self.METRICS_FILE_NAME))
+        except Exception as e:
+            self.err(f"Error saving metrics: {str(e)}")
+
+    def _save_usage(self):
+        try:
+            self._usage.save()
+        except Exception as e:
+            self.err(f"Error saving the usage history: {str(e)}")
+
+    def _report_probe_failures(self, wikis, infos):
+        # Offline, every probe fails: said once, and once more on recovery
+        for wiki, info in zip(wikis, infos):
+            if info is None and wiki['name'] not in self._probe_failing:
+                self._probe_failing.add(wiki['name'])
+                self.warn(f"Cannot reach {wiki['name']} to check it for changes, will keep trying")
+            elif info is not None and wiki['name'] in self._probe_failing:
+                self._probe_failing.discard(wiki['name'])
+                self.info(f"{wiki['name']} is reachable again")
+
+    def _get_wiki_info(self, wiki, log_errors=True):
+        """Return the ``general`` and ``statistics`` siteinfo of *wiki*, or None"""
         url = f"{wiki['url']}/api.php"
         params = {
             'action': 'query',
             'meta': 'siteinfo',
-            'siprop': 'general',
+            'siprop': 'statistics|general',
             'format': 'json'
         }
 
         try:
-            req = urllib.request.Request(url, data=urllib.parse.urlencode(params).encode())
-            with urllib.request.urlopen(req) as response:
-                data = json.loads(response.read())
-            return data['query']['general']
+            data = self._api_request(url, params)
+            return data['query']
         except Exception as e:
-            self.err(f"Error fetching wiki info for {wiki['name']}: {str(e)}")
+            if log_errors:
+                self.err(f"Error fetching wiki info for {wiki['name']}: {str(e)}")
+            else:
+                self.dbg(f"Error fetching wiki info for {wiki['name']}: {str(e)}")
             return None
 
     def on_suggest(self, user_input, items_chain):
         self.dbg(f"on_suggest called with input: {user_input}")
-        if items_chain and items_chain[-1].category() == self.ITEMCAT_SEARCH:
-            self._suggest_text_search(user_input)
+        if items_chain and items_chain[-1].category() == self.ITEMCAT_STATS:
+            self._suggest_stats()
+        elif items_chain and items_chain[-1].category() == self.ITEMCAT_SEARCH:
+            with self._metrics.timer("text_search.latency"):
+                self._suggest_text_search(user_input)
         elif self._SEARCH_MODE or (items_chain and items_chain[-1].category() == self.ITEMCAT_RESULT):
             self._suggest_pages(user_input)
 
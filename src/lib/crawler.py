@@ -0,0 +1,802 @@
+import calendar
+import heapq
+import http.client
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import chain, zip_longest
+
+from .metrics import Metrics
+from .pagestore import PageStore
+from .transport import HttpError
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+class CrawlCancelled(Exception):
+    """Raised out of WikiCrawler.crawl when the crawl was cancelled"""
+
+class CrawlError(Exception):
+    """Raised when a request to a wiki keeps failing"""
+
+class _Throttled(Exception):
+    """The server turned a request down to slow us down for *delay* seconds"""
+    def __init__(self, reason, delay):
+        super().__init__(reason)
+        self.delay = delay
+
+def site_statistics(query):
+    """Return the ``{'pages', 'edits'}`` counts of a siteinfo statistics query"""
+    statistics = query['statistics']
+    return {'pages': int(statistics['pages']), 'edits': int(statistics['edits'])}
+
+def format_timestamp(seconds):
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(seconds))
+
+def parse_timestamp(timestamp):
+    return calendar.timegm(time.strptime(timestamp, TIMESTAMP_FORMAT))
+
+class HostLimiter:
+    """
+    Adaptive cap on the requests in flight to one host.
+
+    The cap starts at the configured maximum, is halved whenever the server
+    asks to slow down and grows back by one after a run of successful
+    requests. A requested delay pauses the host entirely until it is over.
+    """
+    RECOVERY_RUN = 10  # successes needed per extra slot, times the current cap
+
+    def __init__(self, max_concurrency):
+        self._max = max_concurrency
+        self._limit = max_concurrency
+        self._active = 0
+        self._successes = 0
+        self._resume_at = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, cancelled):
+        with self._condition:
+            while True:
+                pause = self._resume_at - time.monotonic()
+                if pause <= 0 and self._active < self._limit:
+                    self._active += 1
+                    return
+                if cancelled():
+                    raise CrawlCancelled()
+                self._condition.wait(min(pause, 0.5) if pause > 0 else 0.5)
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def succeeded(self):
+        with self._condition:
+            self._successes += 1
+            if self._limit < self._max and self._successes >= self._limit * self.RECOVERY_RUN:
+                self._limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    def throttled(self, delay):
+        with self._condition:
+            self._limit = max(1, self._limit // 2)
+            self._successes = 0
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+class _FullCrawl:
+    """
+    State of the full crawl of one wiki.
+
+    Each allpages response becomes a chunk of page batches. Chunks are
+    settled in listing order, so the pages of the settled chunks and the
+    continue block that follows them always form a valid resume point.
+    """
+    def __init__(self, wiki, started, pages=(), continue_params=None):
+        self.wiki = wiki
+        self.started = started
+        # Left unknown for resumed crawls: changes from before the resume
+        # must still show up as changes
+        self.resumed = bool(pages)
+        self.statistics = None
+        self.pages = list(pages)
+        self.continue_params = continue_params or {}
+        self.redirects = None  # future of the redirect listing
+        self.chunks = []  # (batch futures, continue block after them)
+        self.error = None  # first failed batch
+        self.list_error = None
+        self.lock = threading.Lock()
+        self.checkpoint_lock = threading.Lock()
+        self.last_checkpoint = time.monotonic()
+
+class WikiCrawler:
+    """
+    Crawls the page lists of several wikis at once.
+
+    Every wiki gets a listing task walking list=allpages; each batch of page
+    ids it yields is handed straight to the pool to fetch thumbnails and
+    categories, so metadata requests run while the listing continues.
+    Redirects are left out of the listing. They are listed on their own,
+    500 per request along with their targets, and kept as aliases of the
+    page they lead to.
+    Concurrency is capped overall and per host; the per-host cap backs off
+    when the server rate limits us.
+
+    Wikis that were synced before are brought up to date from
+    list=recentchanges instead, as long as the change window still covers
+    their last sync.
+
+    Transient failures are retried with exponential backoff. A wiki that
+    still fails is left out of the results, with the error in ``failed``,
+    rather than returned truncated. Full crawls hand their progress to the
+    *checkpoint* callback from time to time so a later crawl can resume.
+
+    With *metrics*, the duration of each phase is recorded under ``crawl.*``
+    along with the retries and throttles of every wiki.
+    """
+    BATCH_SIZE = 50  # pilimit caps pageimages at 50 pages per request
+    MAX_REDIRECT_HOPS = 5  # double redirects followed to the page they end on
+    TEXT_BATCH_SIZE = 50  # rvprop=content is capped at 50 pages per request
+    REVISION_BATCH_SIZE = 50  # pageids are capped at 50 per request without apihighlimits
+    THUMBNAIL_SIZE = 500
+    RECENT_CHANGES_MAX_AGE = 30 * 24 * 3600  # below MediaWiki's default $wgRCMaxAge
+    SYNC_OVERLAP = 300  # replayed seconds, covers clock skew with the server
+    MAX_LAG = 5  # seconds of replication lag before the server turns requests down
+    MAX_RETRIES = 6
+    BACKOFF_BASE = 1.0  # seconds, doubled on every retry
+    BACKOFF_MAX = 60.0
+    CHECKPOINT_INTERVAL = 10  # seconds between checkpoints of one wiki
+
+    # Network failures and truncated or garbled responses
+    TRANSIENT_ERRORS = (OSError, http.client.HTTPException, ValueError)
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    THROTTLE_STATUSES = (429, 503)
+
+    def __init__(self, request, logger, max_connections=8, max_connections_per_host=2,
+                 cancelled=None, progress=None, thumbnail_size=None, checkpoint=None, metrics=None):
+        self._request = request  # callable(url, params) -> decoded JSON
+        self._logger = logger
+        self._thumbnail_size = thumbnail_size or self.THUMBNAIL_SIZE
+        self._cancelled = cancelled or (lambda: False)
+        self._progress = progress  # callable(pages_done, wikis_done, wikis_total)
+        self._checkpoint = checkpoint  # callable(wiki, started, pages, continue_params)
+        self._metrics = metrics or Metrics()
+        self._pages_done = 0
+        self._wikis_done = 0
+        self._wikis_total = 0
+        self._max_connections = max(1, max_connections)
+        self._max_connections_per_host = max(1, max_connections_per_host)
+        self._global_slots = threading.BoundedSemaphore(self._max_connections)
+        self._host_limiters = {}
+        self._lock = threading.Lock()
+        self._request_counts = {}
+        self._retry_counts = {}
+        self.failed = {}
+        self.refetched = {}
+
+    def crawl(self, wikis, synced=None, resume=None):
+        """
+        Return a dict of wiki name to a PageStore holding its pages in title
+        order. Wikis that could not be crawled are left out; their errors are
+        in ``failed``.
+
+        *synced* optionally maps wiki names to the PageStore, or the
+        diskindex.TitleFile, of an earlier crawl; those wikis are updated
+        incrementally when possible. *resume* optionally maps wiki names to
+        the ``(started, pages, continue_params)`` checkpoint of an
+        interrupted full crawl.
+
+        ``refetched`` then maps the wikis updated incrementally to the set of
+        page ids fetched again; their other pages kept their title, thumbnail
+        and categories.
+        """
+        synced = synced or {}
+        resume = resume or {}
+        self._request_counts = {wiki['name']: 0 for wiki in wikis}
+        self._retry_counts = {wiki['name']: 0 for wiki in wikis}
+        self._pages_done = 0
+        self._wikis_done = 0
+        self._wikis_total = len(wikis)
+        self.failed = {}
+        self.refetched = {}
+
+        full_crawls = []
+        with ThreadPoolExecutor(max_workers=self._max_connections) as pool:
+            tasks = []
+            for wiki in wikis:
+                previous = synced.get(wiki['name'])
+                checkpoint = resume.get(wiki['name'])
+                if checkpoint:
+                    started, pages, continue_params = checkpoint
+                    self._logger.info(f"Resuming the crawl of {wiki['name']} after {len(pages)} pages")
+                    self._report_progress(len(pages))
+                    crawl = _FullCrawl(wiki, started, pages, continue_params)
+                elif previous and self._can_update(previous):
+                    tasks.append((wiki, pool.submit(self._update_pages, wiki, previous)))
+                    continue
+                else:
+                    crawl = _FullCrawl(wiki, format_timestamp(time.time() - self.SYNC_OVERLAP))
+                # Listed again on resume, it takes a request per 500 redirects
+                crawl.redirects = pool.submit(self._list_redirects, wiki)
+                full_crawls.append(crawl)
+                tasks.append((wiki, pool.submit(self._list_pages, pool, crawl)))
+
+            results = {}
+            try:
+                # Wikis are collected in order, and batches in submission
+                # order, so the result does not depend on request timing
+                for wiki, task in tasks:
+                    try:
+                        store = self._collect(task.result())
+                    except CrawlCancelled:
+                        raise
+                    except Exception as e:
+                        self.failed[wiki['name']] = e
+                        self._logger.err(f"Error fetching pages from {wiki['name']}: {str(e)}")
+                    else:
+                        results[wiki['name']] = store
+                        self._metrics.count("crawl.pages", len(store), label=wiki['name'])
+                        self._logger.info(
+                            f"Fetched {len(store)} pages from {wiki['name']} in "
+                            f"{self._request_counts[wiki['name']]} requests, "
+                            f"{self._retry_counts[wiki['name']]} of them retries")
+                    with self._lock:
+                        self._wikis_done += 1
+                    self._report_progress()
+            except CrawlCancelled:
+                # Whatever was settled so far is kept for the next crawl
+                for crawl in full_crawls:
+                    self._advance(crawl)
+                    self._save_checkpoint(crawl, force=True)
+                raise
+        return results
+
+    def changed_titles(self, wiki, since):
+        """
+        Return the set of titles changed on *wiki* since the *since*
+        timestamp, or None when the change window no longer covers it.
+        """
+        if not self._is_recent(since):
+            return None
+        with self._metrics.timer("crawl.recent_changes", wiki['name']):
+            return self._get_changed_titles(wiki, since)
+
+    def outdated_pages(self, wiki, revids):
+        """
+        Return the ids of the pages of *wiki* whose latest revision differs
+        from the one in *revids*, a dict of page id to revision id. Pages
+        gone from the wiki are left out. For syncs the change window no
+        longer covers: ``prop=info`` is compared in batches instead.
+        """
+        pageids = sorted(revids)
+        batches = [pageids[i:i + self.REVISION_BATCH_SIZE]
+                   for i in range(0, len(pageids), self.REVISION_BATCH_SIZE)]
+        outdated = set()
+        with self._metrics.timer("crawl.revisions", wiki['name']):
+            with ThreadPoolExecutor(max_workers=self._max_connections) as pool:
+                for latest in pool.map(lambda batch: self._get_latest_revisions(wiki, batch), batches):
+                    outdated.update(pageid for pageid, revid in latest.items() if revid != revids[pageid])
+        return outdated
+
+    def fetch_texts(self, jobs):
+        """
+        Fetch the current wikitext of pages. *jobs* is a list of ``(wiki,
+        pageids)``; yield ``(wiki, [(pageid, revid, title, wikitext)])`` a
+        batch at a time, in completion order.
+
+        Batches of the wikis are interleaved and only a few are in flight
+        per connection, so abandoning the generator leaves little work
+        behind. A wiki whose batch fails is given up, with the error in
+        ``failed``.
+        """
+        self.failed = {}
+        self._pages_done = 0
+        self._wikis_done = 0
+        self._wikis_total = len(jobs)
+        batches = chain.from_iterable(zip_longest(*(
+            [(wiki, pageids[i:i + self.TEXT_BATCH_SIZE]) for i in range(0, len(pageids), self.TEXT_BATCH_SIZE)]
+            for wiki, pageids in jobs)))
+        with ThreadPoolExecutor(max_workers=self._max_connections) as pool:
+            pending = {}
+            try:
+                while True:
+                    while len(pending) < self._max_connections * 2:
+                        batch = next(batches, None)
+                        if batch is None:
+                            break
+                        wiki, pageids = batch
+                        if wiki['name'] not in self.failed:
+                            pending[pool.submit(self._get_text_batch, wiki, pageids)] = wiki
+                    if not pending:
+                        return
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        wiki = pending.pop(future)
+                        try:
+                            texts = future.result()
+                        except CrawlCancelled:
+                            raise
+                        except Exception as e:
+                            if wiki['name'] not in self.failed:
+                                self.failed[wiki['name']] = e
+                                self._logger.err(f"Error fetching page content from {wiki['name']}: {str(e)}")
+                            continue
+                        self._metrics.count("text.pages", len(texts), label=wiki['name'])
+                        yield wiki, texts
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _collect(self, result):
+        if isinstance(result, PageStore):
+            return result
+
+        crawl = result
+        wait([future for futures, _ in crawl.chunks for future in futures])
+        # Done callbacks may still be running once the waiters wake up
+        self._advance(crawl)
+        error = crawl.error or crawl.list_error or crawl.redirects.exception()
+        if error is not None:
+            self._save_checkpoint(crawl, force=True)
+            raise error
+        wiki = crawl.wiki
+        self._attach_aliases(crawl.pages, crawl.redirects.result())
+        return PageStore.from_pages(wiki['name'], wiki['url'], crawl.pages, crawl.started, crawl.statistics)
+
+    def _report_progress(self, pages=0):
+        with self._lock:
+            self._pages_done += pages
+            progress = (self._pages_done, self._wikis_done, self._wikis_total)
+        if self._progress:
+            self._progress(*progress)
+
+    def _api(self, wiki, params):
+        host = urllib.parse.urlsplit(wiki['url']).netloc
+        with self._lock:
+            limiter = self._host_limiters.get(host)
+            if limiter is None:
+                limiter = self._host_limiters[host] = HostLimiter(self._max_connections_per_host)
+        params = dict(params, maxlag=self.MAX_LAG)
+
+        attempt = 0
+        while True:
+            if self._cancelled():
+                raise CrawlCancelled()
+            limiter.acquire(self._cancelled)
+            delay = 0
+            try:
+                with self._global_slots:
+                    if self._cancelled():
+                        raise CrawlCancelled()
+                    with self._lock:
+                        self._request_counts[wiki['name']] = self._request_counts.get(wiki['name'], 0) + 1
+                    data = self._request(f"{wiki['url']}/api.php", params)
+                self._check_response(data)
+                limiter.succeeded()
+                return data
+            except _Throttled as e:
+                # The whole host slows down, this request included
+                limiter.throttled(e.delay)
+                self._metrics.count("crawl.throttled", label=wiki['name'])
+                error = e
+            except HttpError as e:
+                if e.status not in self.RETRY_STATUSES:
+                    raise
+                delay = self._retry_after(e.headers) or self._backoff(attempt)
+                if e.status in self.THROTTLE_STATUSES:
+                    limiter.throttled(delay)
+                    self._metrics.count("crawl.throttled", label=wiki['name'])
+                    delay = 0
+                error = e
+            except self.TRANSIENT_ERRORS as e:
+                delay = self._backoff(attempt)
+                error = e
+            finally:
+                limiter.release()
+
+            attempt += 1
+            if attempt > self.MAX_RETRIES:
+                raise CrawlError(f"Giving up after {self.MAX_RETRIES} retries: {str(error)}")
+            with self._lock:
+                self._retry_counts[wiki['name']] = self._retry_counts.get(wiki['name'], 0) + 1
+            self._metrics.count("crawl.retries", label=wiki['name'])
+            self._logger.dbg(f"Retrying a request to {wiki['name']}: {str(error)}")
+            self._sleep(delay)
+
+    def _check_response(self, data):
+        error = data.get('error')
+        if not error:
+            return
+        if error.get('code') in ('maxlag', 'ratelimited'):
+            lag = error.get('lag') or 0
+            raise _Throttled(error.get('info', error['code']), max(float(lag), self.MAX_LAG))
+        raise CrawlError(f"API error {error.get('code')}: {error.get('info', '')}")
+
+    def _backoff(self, attempt):
+        delay = min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** attempt)
+        # Jitter keeps the retries of parallel requests apart
+        return delay * random.uniform(0.5, 1.0)
+
+    @staticmethod
+    def _retry_after(headers):
+        try:
+            return max(0.0, float(headers.get('Retry-After')))
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+    def _sleep(self, delay):
+        deadline = time.monotonic() + delay
+        while True:
+            if self._cancelled():
+                raise CrawlCancelled()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 0.5))
+
+    def _list_pages(self, pool, crawl):
+        wiki = crawl.wiki
+        self._logger.dbg(f"Listing pages for wiki: {wiki['name']}")
+        continue_params = crawl.continue_params
+        if not crawl.resumed:
+            crawl.statistics = self._get_statistics(wiki)
+
+        # A failed batch fails the wiki, no point in listing further
+        while crawl.error is None:
+            params = {
+                'action': 'query',
+                'list': 'allpages',
+                'apfilterredir': 'nonredirects',
+                'aplimit': 'max',
+                'format': 'json'
+            }
+            params.update(continue_params)
+
+            try:
+                with self._metrics.timer("crawl.list", wiki['name']):
+                    data = self._api(wiki, params)
+            except CrawlCancelled:
+                raise
+            except Exception as e:
+                crawl.list_error = e
+                break
+
+            listed = data.get('query', {}).get('allpages', [])
+            continue_params = data.get('continue')
+            batches = [pool.submit(self._get_page_batch, wiki, listed[i:i + self.BATCH_SIZE])
+                       for i in range(0, len(listed), self.BATCH_SIZE)]
+            with crawl.lock:
+                crawl.chunks.append((batches, continue_params))
+            for batch in batches:
+                batch.add_done_callback(lambda _, crawl=crawl: self._advance(crawl))
+
+            if continue_params is None:
+                break
+
+        return crawl
+
+    def _list_redirects(self, wiki):
+        """Return a dict of the redirect titles of *wiki* to their target titles"""
+        redirects = {}
+        continue_params = {}
+        with self._metrics.timer("crawl.redirects", wiki['name']):
+            while True:
+                # Resolving the listed redirects returns their targets, 500
+                # redirects per request
+                params = {
+                    'action': 'query',
+                    'generator': 'allpages',
+                    'gapnamespace': 0,
+                    'gapfilterredir': 'redirects',
+                    'gaplimit': 'max',
+                    'redirects': 1,
+                    'format': 'json'
+                }
+                params.update(continue_params)
+                data = self._api(wiki, params)
+                for redirect in data.get('query', {}).get('redirects', []):
+                    redirects[redirect['from']] = redirect['to']
+
+                if 'continue' in data:
+                    continue_params = data['continue']
+                else:
+                    return redirects
+
+    def _attach_aliases(self, pages, redirects):
+        """
+        Add the titles of *redirects* (redirect title to target title) to the
+        aliases of the *pages* they lead to. Redirects to other namespaces or
+        to missing pages are dropped.
+        """
+        targets = self._redirect_targets(redirects)
+        for page in pages:
+            for title in targets.get(page['title'], ()):
+                if title not in page['aliases']:
+                    page['aliases'].append(title)
+
+    def _redirect_targets(self, redirects):
+        """Return a dict of target title to the titles of the *redirects* ending on it"""
+        targets = {}
+        for title, target in redirects.items():
+            for _ in range(self.MAX_REDIRECT_HOPS):
+                if target not in redirects:
+                    break
+                target = redirects[target]
+            if title != target:
+                targets.setdefault(target, []).append(title)
+        return targets
+
+    def _advance(self, crawl):
+        """Move the pages of the leading finished chunks of *crawl* into its pages"""
+        advanced = False
+        with crawl.lock:
+            while crawl.chunks and crawl.error is None:
+                batches, continue_params = crawl.chunks[0]
+                if not all(batch.done() for batch in batches):
+                    break
+                errors = [batch.exception() for batch in batches if batch.exception() is not None]
+                if errors:
+                    crawl.error = errors[0]
+                    break
+                crawl.chunks.pop(0)
+                for batch in batches:
+                    crawl.pages.extend(batch.result())
+                crawl.continue_params = continue_params or {}
+                advanced = True
+        if advanced:
+            self._save_checkpoint(crawl)
+
+    def _save_checkpoint(self, crawl, force=False):
+        if self._checkpoint is None:
+            return
+        with crawl.checkpoint_lock:
+            with crawl.lock:
+                # Nothing settled yet, or nothing left to resume
+                if not crawl.pages or not crawl.continue_params:
+                    return
+                now = time.monotonic()
+                if not force and now - crawl.last_checkpoint < self.CHECKPOINT_INTERVAL:
+                    return
+                crawl.last_checkpoint = now
+                pages = list(crawl.pages)
+                continue_params = dict(crawl.continue_params)
+            try:
+                self._checkpoint(crawl.wiki, crawl.started, pages, continue_params)
+            except Exception as e:
+                self._logger.err(f"Error saving the crawl checkpoint of {crawl.wiki['name']}: {str(e)}")
+
+    def _get_page_batch(self, wiki, listed):
+        pages = {}
+        for page in listed:
+            pages[page['pageid']] = self._new_page(wiki, page)
+        with self._metrics.timer("crawl.page_info", wiki['name']):
+            self._query_page_info(wiki, {'pageids': '|'.join(str(pageid) for pageid in pages)}, pages)
+        self._report_progress(len(pages))
+        return list(pages.values())
+
+    def _get_pages_by_title(self, wiki, titles, redirects):
+        """
+        Return the pages that currently exist under *titles*. Titles that
+        are redirects return the page they lead to instead, and are added to
+        the *redirects* dict, redirect title to target title.
+        """
+        pages = {}
+        self._query_page_info(wiki, {'titles': '|'.join(titles), 'redirects': 1}, pages, redirects)
+        return list(pages.values())
+
+    def _query_page_info(self, wiki, selector, pages, redirects=None):
+        """
+        Fill thumbnails and categories of *pages* (keyed by page id) for the
+        pages matched by *selector*. Pages not in *pages* yet are added.
+        Redirects the selector resolved are added to *redirects*.
+        """
+        continue_params = {}
+        while True:
+            params = {
+                'action': 'query',
+                'prop': 'pageimages|categories',
+                'piprop': 'thumbnail',
+                'pithumbsize': self._thumbnail_size,
+                'pilimit': self.BATCH_SIZE,
+                'cllimit': 'max',
+                'format': 'json'
+            }
+            params.update(selector)
+            # The continue block may hold clcontinue and picontinue at once;
+            # it has to be sent back as a whole
+            params.update(continue_params)
+            data = self._api(wiki, params)
+
+            if redirects is not None:
+                for redirect in data.get('query', {}).get('redirects', []):
+                    redirects[redirect['from']] = redirect['to']
+            for info in data.get('query', {}).get('pages', {}).values():
+                if 'missing' in info or 'invalid' in info or info.get('ns', 0) != 0:
+                    continue
+                entry = pages.get(info['pageid'])
+                if entry is None:
+                    entry = pages[info['pageid']] = self._new_page(wiki, info)
+                if not entry['thumbnail']:
+                    entry['thumbnail'] = info.get('thumbnail', {}).get('source')
+                entry['categories'].extend(
+                    cat['title'].split(':')[-1] for cat in info.get('categories', []))
+
+            if 'continue' in data:
+                continue_params = data['continue']
+            else:
+                break
+
+    def _new_page(self, wiki, page):
+        return {
+            'pageid': page['pageid'],
+            'title': page['title'],
+            'url': f"{wiki['url']}/wiki/{page['title'].replace(' ', '_')}",
+            'wiki_name': wiki['name'],
+            'thumbnail': None,
+            'categories': [],
+            'aliases': []
+        }
+
+    def _can_update(self, previous):
+        return self._is_recent(previous.synced)
+
+    def _is_recent(self, synced):
+        """Tell whether list=recentchanges still covers the *synced* timestamp"""
+        if not synced:
+            return False
+        try:
+            age = time.time() - parse_timestamp(synced)
+        except ValueError:
+            return False
+        return age < self.RECENT_CHANGES_MAX_AGE
+
+    def _update_pages(self, wiki, previous):
+        """
+        Return a new PageStore of *wiki* with the recent changes applied to
+        *previous*, a PageStore or a diskindex.TitleFile in title order.
+
+        Only the changed pages are fetched and held as dicts; the other rows
+        are read one at a time and copied into the new store, merged with
+        the fetched pages in title order.
+        """
+        self._logger.dbg(f"Updating pages for wiki: {wiki['name']} since {previous.synced}")
+        started = format_timestamp(time.time() - self.SYNC_OVERLAP)
+        statistics = self._get_statistics(wiki)
+        with self._metrics.timer("crawl.recent_changes", wiki['name']):
+            changed = self._get_changed_titles(wiki, previous.synced)
+
+        redirects = {}
+        fetched = {}
+        titles = sorted(changed)
+        for i in range(0, len(titles), self.BATCH_SIZE):
+            with self._metrics.timer("crawl.page_info", wiki['name']):
+                for page in self._get_pages_by_title(wiki, titles[i:i + self.BATCH_SIZE], redirects):
+                    fetched[page['pageid']] = page
+
+        # Pages fetched again, whether changed or the target of a changed
+        # redirect, keep the aliases they had
+        for row, pageid in enumerate(previous.pageids):
+            if pageid in fetched:
+                fetched[pageid]['aliases'] = list(previous[row]['aliases'])
+
+        def kept_rows():
+            for row, pageid in enumerate(previous.pageids):
+                if pageid not in fetched:
+                    page = previous[row]
+                    if page['title'] not in changed:
+                        yield page
+
+        store = PageStore(wiki['name'], wiki['url'], started, statistics)
+        targets = self._redirect_targets(redirects)
+        fetched_pages = sorted(fetched.values(), key=lambda page: page['title'])
+        for page in heapq.merge(kept_rows(), fetched_pages, key=lambda page: page['title']):
+            # A changed redirect may have been retargeted or deleted; it is
+            # attached again if it still exists
+            aliases = [alias for alias in page['aliases'] if alias not in changed]
+            aliases += [alias for alias in targets.get(page['title'], ()) if alias not in aliases]
+            store.add(page['pageid'], page['title'], page['thumbnail'], page['categories'], aliases)
+        self.refetched[wiki['name']] = set(fetched)
+
+        self._logger.dbg(f"Applied {len(changed)} changed titles to {wiki['name']}")
+        self._report_progress(len(store))
+        return store
+
+    def _get_text_batch(self, wiki, pageids):
+        texts = []
+        continue_params = {}
+        with self._metrics.timer("crawl.texts", wiki['name']):
+            while True:
+                params = {
+                    'action': 'query',
+                    'prop': 'revisions',
+                    'rvprop': 'ids|content',
+                    'rvslots': 'main',
+                    'pageids': '|'.join(str(pageid) for pageid in pageids),
+                    'format': 'json'
+                }
+                params.update(continue_params)
+                data = self._api(wiki, params)
+
+                for info in data.get('query', {}).get('pages', {}).values():
+                    # Large batches are split over continued responses; pages
+                    # without a revision yet come in a later one
+                    revisions = info.get('revisions')
+                    if not revisions or info.get('ns', 0) != 0:
+                        continue
+                    revision = revisions[0]
+                    content = revision.get('slots', {}).get('main', revision)
+                    texts.append((info['pageid'], revision.get('revid'), info['title'],
+                                  content.get('*', content.get('content', ''))))
+
+                if 'continue' in data:
+                    continue_params = data['continue']
+                else:
+                    break
+        self._report_progress(len(texts))
+        return texts
+
+    def _get_latest_revisions(self, wiki, pageids):
+        """Return a dict of page id to latest revision id for the *pageids* that exist"""
+        data = self._api(wiki, {
+            'action': 'query',
+            'prop': 'info',
+            'pageids': '|'.join(str(pageid) for pageid in pageids),
+            'format': 'json'
+        })
+        return {info['pageid']: info.get('lastrevid')
+                for info in data.get('query', {}).get('pages', {}).values()
+                if 'missing' not in info and 'pageid' in info}
+
+    def _get_statistics(self, wiki):
+        """
+        Return the page and edit counts of *wiki* before it is crawled, or
+        None when they are unavailable.
+        """
+        try:
+            data = self._api(wiki, {
+                'action': 'query',
+                'meta': 'siteinfo',
+                'siprop': 'statistics',
+                'format': 'json'
+            })
+            return site_statistics(data['query'])
+        except CrawlCancelled:
+            raise
+        except Exception as e:
+            self._logger.dbg(f"No statistics for {wiki['name']}: {str(e)}")
+            return None
+
+    def _get_changed_titles(self, wiki, since):
+        """
+        Return the set of main namespace titles created, edited, moved or
+        deleted since *since*.
+        """
+        titles = set()
+        continue_params = {}
+        while True:
+            params = {
+                'action': 'query',
+                'list': 'recentchanges',
+                'rcnamespace': 0,
+                'rctype': 'edit|new|log',
+                'rcprop': 'title|loginfo',
+                'rcdir': 'newer',
+                'rcstart': since,
+                'rclimit': 'max',
+                'format': 'json'
+            }
+            params.update(continue_params)
+            data = self._api(wiki, params)
+
+            for change in data.get('query', {}).get('recentchanges', []):
+                titles.add(change['title'])
+                # Moves leave the page under a new title
+                target = change.get('logparams', {}).get('target_title')
+                if target and change.get('logparams', {}).get('target_ns', 0) == 0:
+                    titles.add(target)
+
+            if 'continue' in data:
+                continue_params = data['continue']
+            else:
+                return titles
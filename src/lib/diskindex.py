@@ -0,0 +1,629 @@
+import bisect
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+from .files import atomic_write
+from .pagecache import CacheFormatError
+from .pageindex import (MATCH_CATEGORY, MATCH_EXACT, MATCH_PREFIX, MATCH_WIKI, MATCH_WORD,
+                        WORD_SEPARATORS, _contains, parse_query, ranked_tier, tier_function)
+
+MAGIC = b'FWTI'
+VERSION = 1
+FILE_EXTENSION = ".titles"
+
+_HEADER = struct.Struct('<4sHH')
+_LENGTH = struct.Struct('<I')
+
+# Sections of a title file, in file order
+_SECTIONS = (
+    'meta',
+    'keys', 'key_offsets', 'key_rows',
+    'words', 'word_offsets', 'word_rows',
+    'title_lengths',
+    'records', 'record_offsets',
+    'pageids', 'pageid_rows',
+    'categories', 'category_offsets', 'posting_starts', 'postings',
+)
+
+def source_stamp(path):
+    """Identify the page cache at *path*, whose title file is only used while this holds"""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def title_files(folder, wiki_name):
+    """Return the title files of a wiki in *folder*, newest first"""
+    prefix = wiki_name + "."
+    generations = []
+    for file_name in os.listdir(folder) if os.path.isdir(folder) else ():
+        generation = file_name[len(prefix):-len(FILE_EXTENSION)]
+        if file_name.startswith(prefix) and file_name.endswith(FILE_EXTENSION) and generation.isdigit():
+            generations.append((int(generation), os.path.join(folder, file_name)))
+    return [path for _, path in sorted(generations, reverse=True)]
+
+def write_title_file(folder, store, source, previous=None):
+    """
+    Write the title file of *store* to *folder* and return its path. *source*
+    is the source_stamp of the page cache the store was read from or saved
+    to.
+
+    *previous* is optionally a TitleFile of an earlier version of the wiki:
+    the sorted keys and words of the pages whose record did not change are
+    then read from it in order, and only those of the changed pages are
+    sorted in memory. The file written is the same.
+
+    Every write gets a file name of its own: a mapped file cannot be
+    replaced on Windows, so a new generation is written beside the one in
+    use, and the older ones are removed once nothing maps them.
+
+    Layout, little-endian: magic and version, then sections each prefixed
+    with its byte length and padded to 4 bytes. Integer sections are uint32
+    arrays. String sections are UTF-8 strings each followed by a newline,
+    with an offsets section giving the start of every string and the end of
+    the last one:
+
+        meta            JSON: name, synced, statistics, source, page count
+        keys            lowercased titles and aliases, sorted
+        key_rows        row of the page of each key
+        words           the same strings from each later word start on,
+                        sorted, with word_rows
+        title_lengths   title length of each row
+        records         JSON ``[pageid, title, thumbnail, categories,
+                        aliases]`` of each row, decoded on demand
+        pageids         page id of each row, and pageid_rows the rows in
+                        page id order
+        categories      lowercased category names, sorted, each with the
+                        sorted rows of its pages in postings
+    """
+    keys, words = [], []
+    lengths = array('I')
+    records, record_offsets = bytearray(), array('I', [0])
+    postings = {}
+    # Row in *store* of each row of *previous* whose record is unchanged, or -1
+    row_map = array('i', [-1]) * len(previous) if previous is not None else None
+    last_reused = -1
+    for row in range(len(store)):
+        page = store[row]
+        title = page.title
+        aliases = page.aliases
+        categories = page.categories
+        lengths.append(len(title))
+        for category in categories:
+            rows = postings.setdefault(category.lower(), array('I'))
+            if not rows or rows[-1] != row:
+                rows.append(row)
+        record = json.dumps([page.pageid, title, page.thumbnail, categories, aliases],
+                            ensure_ascii=False, separators=(',', ':')).encode()
+        records += record
+        records += b"\n"
+        record_offsets.append(len(records))
+        if previous is not None:
+            # Reused rows must keep their order for the strings to stay sorted
+            previous_row = previous.row(page.pageid)
+            if (previous_row is not None and previous_row > last_reused
+                    and previous.record(previous_row) == record):
+                row_map[previous_row] = row
+                last_reused = previous_row
+                continue
+        for string in [title] + aliases:
+            string = string.lower()
+            keys.append((string, row))
+            for position in range(1, len(string)):
+                if string[position - 1] in WORD_SEPARATORS and string[position] not in WORD_SEPARATORS:
+                    words.append((string[position:], row))
+    if len(records) >= 1 << 32:
+        raise ValueError("string section over 4 GB")
+    keys.sort()
+    words.sort()
+    if previous is not None:
+        keys = heapq.merge(keys, ((key, row_map[row]) for key, row in previous.sorted_strings()
+                                  if row_map[row] >= 0))
+        words = heapq.merge(words, ((word, row_map[row]) for word, row in previous.sorted_strings(True)
+                                    if row_map[row] >= 0))
+    category_names = sorted(postings)
+
+    sections = {
+        'meta': json.dumps({'name': store.name, 'synced': store.synced, 'statistics': store.statistics,
+                            'source': source, 'pages': len(store)}).encode(),
+        'title_lengths': lengths,
+        'pageids': store.pageids,
+        'pageid_rows': array('I', sorted(range(len(store)), key=store.pageids.__getitem__)),
+        'records': records,
+        'record_offsets': record_offsets,
+    }
+    sections['keys'], sections['key_offsets'], sections['key_rows'] = _string_rows_section(keys)
+    sections['words'], sections['word_offsets'], sections['word_rows'] = _string_rows_section(words)
+    sections['categories'], sections['category_offsets'] = _string_section(category_names)
+    starts = array('I', [0])
+    flat = array('I')
+    for name in category_names:
+        flat.extend(postings[name])
+        starts.append(len(flat))
+    sections['posting_starts'] = starts
+    sections['postings'] = flat
+    del keys, words, postings
+
+    if sys.byteorder != 'little':
+        raise CacheFormatError("Title files are only written on little-endian machines")
+    path = os.path.join(folder, f"{store.name}.{time.time_ns()}{FILE_EXTENSION}")
+    atomic_write(path, _file_chunks(sections))
+    remove_stale_title_files(folder, store.name, keep=path)
+    return path
+
+def remove_stale_title_files(folder, wiki_name, keep=None):
+    """Remove the title files of a wiki but *keep*, skipping the ones still mapped"""
+    for path in title_files(folder, wiki_name):
+        if path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Still mapped, removed next time
+
+def open_title_file(folder, wiki_name, url, source):
+    """
+    Map the newest title file of a wiki, or return None when there is none
+    or it was built from another page cache than *source*.
+    """
+    paths = title_files(folder, wiki_name)
+    if not paths:
+        return None
+    title_file = TitleFile(paths[0], url)
+    if title_file.name != wiki_name or title_file.source != source:
+        return None
+    return title_file
+
+def _file_chunks(sections):
+    # Each section is its length, its bytes, then padding to 4 bytes
+    yield _HEADER.pack(MAGIC, VERSION, 0)
+    for name in _SECTIONS:
+        data = sections[name]
+        data = data.tobytes() if isinstance(data, array) else data
+        yield _LENGTH.pack(len(data))
+        yield data
+        yield b"\0" * (-len(data) % 4)
+
+def _string_section(strings):
+    blob = bytearray()
+    offsets = array('I', [0])
+    for string in strings:
+        blob += string.encode()
+        blob += b"\n"
+        offsets.append(len(blob))
+    if len(blob) >= 1 << 32:
+        raise ValueError("string section over 4 GB")
+    return blob, offsets
+
+def _string_rows_section(pairs):
+    """Return the string section and the rows of ``(string, row)`` *pairs*, read once"""
+    rows = array('I')
+
+    def strings():
+        for string, row in pairs:
+            rows.append(row)
+            yield string
+
+    blob, offsets = _string_section(strings())
+    return blob, offsets, rows
+
+class TitleFile:
+    """
+    Read-only, memory-mapped title file of one wiki, see write_title_file.
+
+    Nothing is read up front: lookups bisect the sorted keys through the
+    fixed-width offsets and only touch the pages of the file they land on,
+    which the OS can drop again under memory pressure. As a PageStore, it
+    has the ``pageids`` column and gives the page of a row by index, decoded
+    on demand.
+    """
+    def __init__(self, path, url):
+        if sys.byteorder != 'little':
+            raise CacheFormatError("Title files are only mapped on little-endian machines")
+        self.path = path
+        self.url = url
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, _ = _HEADER.unpack_from(self._map, 0)
+        except struct.error:
+            raise CacheFormatError(f"Truncated title file {path}") from None
+        if magic != MAGIC or version != VERSION:
+            raise CacheFormatError(f"Unsupported title file {path}")
+
+        self._bounds = {}
+        position = _HEADER.size
+        view = memoryview(self._map)
+        for name in _SECTIONS:
+            try:
+                (length,) = _LENGTH.unpack_from(self._map, position)
+            except struct.error:
+                raise CacheFormatError(f"Truncated title file {path}") from None
+            start = position + _LENGTH.size
+            end = start + length
+            if end > len(self._map):
+                raise CacheFormatError(f"Truncated title file {path}")
+            self._bounds[name] = (start, end)
+            position = end + (-length % 4)
+        arrays = {name: view[start:end].cast('I') for name, (start, end) in self._bounds.items()
+                  if name not in ('meta', 'keys', 'words', 'records', 'categories')}
+
+        meta = json.loads(self._map[slice(*self._bounds['meta'])])
+        self.name = meta['name']
+        self.synced = meta['synced']
+        self.statistics = meta['statistics']
+        self.source = meta['source']
+        self._length = meta['pages']
+        self.pageids = arrays['pageids']
+        self.title_lengths = arrays['title_lengths']
+        self._pageid_rows = arrays['pageid_rows']
+        self._keys = (self._bounds['keys'][0], arrays['key_offsets'], arrays['key_rows'])
+        self._words = (self._bounds['words'][0], arrays['word_offsets'], arrays['word_rows'])
+        self._records = (self._bounds['records'][0], arrays['record_offsets'])
+        self._categories = (self._bounds['categories'][0], arrays['category_offsets'])
+        self._posting_starts = arrays['posting_starts']
+        self._postings = arrays['postings']
+        if (len(self.pageids) != self._length or len(self.title_lengths) != self._length
+                or len(arrays['record_offsets']) != self._length + 1):
+            raise CacheFormatError(f"Damaged title file {path}")
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, row):
+        return self.page(row)
+
+    def __iter__(self):
+        return (self.page(row) for row in range(self._length))
+
+    def record(self, row):
+        """Return the encoded record of *row*, see write_title_file"""
+        return self._string(self._records, row)
+
+    def sorted_strings(self, words=False):
+        """Yield ``(lowercased string, row)`` of the keys, or of the words, in sorted order"""
+        base, offsets, rows = self._words if words else self._keys
+        for index in range(len(rows)):
+            yield self._map[base + offsets[index]:base + offsets[index + 1] - 1].decode(), rows[index]
+
+    def page(self, row):
+        """Decode the record of *row* into a page dict, as PageStore's to_pages"""
+        pageid, title, thumbnail, categories, aliases = json.loads(self._string(self._records, row))
+        return {
+            'pageid': pageid,
+            'title': title,
+            'url': self.page_url(title),
+            'wiki_name': self.name,
+            'thumbnail': thumbnail,
+            'categories': categories,
+            'aliases': aliases
+        }
+
+    def page_url(self, title):
+        return f"{self.url}/wiki/{title.replace(' ', '_')}"
+
+    def row(self, pageid):
+        """Return the row of the page *pageid*, or None"""
+        rows, pageids = self._pageid_rows, self.pageids
+        low, high = 0, len(rows)
+        while low < high:
+            middle = (low + high) // 2
+            if pageids[rows[middle]] < pageid:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(rows) and pageids[rows[low]] == pageid:
+            return rows[low]
+        return None
+
+    def find(self, query, tier_of, limit, bound, candidates=None):
+        """
+        Return ``{row: tier}`` for pages whose title or an alias holds the
+        lowercased *query*, best tiers first: keys starting with it, then
+        words starting with it, then anywhere in a key, each step only
+        while fewer than *limit* pages were found. Each step stops after
+        *bound* pages. *tier_of* is tier_function(query); *candidates*
+        optionally restricts the rows.
+        """
+        needle = query.encode()
+        found = {}
+        self._scan_prefix(self._keys, needle, True, bound, candidates, found)
+        if len(found) < limit:
+            self._scan_prefix(self._words, needle, False, bound, candidates, found)
+        if len(found) < limit:
+            self._scan_substring(needle, tier_of, bound, candidates, found)
+        return found
+
+    def category_matches(self, value):
+        """
+        Return the sorted rows of the category named *value*, lowercased, as
+        a list of one postings view; without such a category, the postings
+        of every category holding it
+        """
+        needle = value.encode()
+        index = self._lower_bound(self._categories, len(self._posting_starts) - 1, needle)
+        if index < len(self._posting_starts) - 1 and self._string(self._categories, index) == needle:
+            return [self.category_postings(index)]
+        return [self.category_postings(index) for index in self.categories_holding(value)]
+
+    def categories_holding(self, text):
+        """Return the indexes of the categories whose name holds *text*"""
+        needle = text.encode()
+        base, offsets = self._categories
+        end = self._bounds['categories'][1]
+        indexes = []
+        position = self._map.find(needle, base, end)
+        while position >= 0:
+            index = bisect.bisect_right(offsets, position - base) - 1
+            indexes.append(index)
+            position = self._map.find(needle, base + offsets[index + 1], end)
+        return indexes
+
+    def category_postings(self, index):
+        """Return the sorted rows of the category at *index*"""
+        return self._postings[self._posting_starts[index]:self._posting_starts[index + 1]]
+
+    def _string(self, section, index):
+        base, offsets = section[0], section[1]
+        return self._map[base + offsets[index]:base + offsets[index + 1] - 1]
+
+    def _lower_bound(self, section, count, needle):
+        """Return the index of the first of *count* sorted strings not below *needle*"""
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self._string(section, middle) < needle:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _scan_prefix(self, section, needle, whole, bound, candidates, found):
+        rows = section[2]
+        index = self._lower_bound(section, len(rows), needle)
+        added = scanned = 0
+        # Rows filtered out still cost a read, so they count as well, a few
+        # times less than the pages found
+        while index < len(rows) and added < bound and scanned < bound * 8:
+            key = self._string(section, index)
+            if not key.startswith(needle):
+                break
+            row = rows[index]
+            if candidates is None or row in candidates:
+                if not whole:
+                    tier = MATCH_WORD
+                else:
+                    tier = MATCH_EXACT if len(key) == len(needle) else MATCH_PREFIX
+                if tier > found.get(row, -1):
+                    found[row] = tier
+                added += 1
+            index += 1
+            scanned += 1
+
+    def _scan_substring(self, needle, tier_of, bound, candidates, found):
+        base, offsets, rows = self._keys
+        end = self._bounds['keys'][1]
+        added = scanned = 0
+        position = self._map.find(needle, base, end)
+        # Bounded as _scan_prefix, filtered out rows included
+        while position >= 0 and added < bound and scanned < bound * 8:
+            index = bisect.bisect_right(offsets, position - base) - 1
+            row = rows[index]
+            if row not in found and (candidates is None or row in candidates):
+                found[row] = tier_of(self._string(self._keys, index).decode())
+                added += 1
+            scanned += 1
+            # The next key, keys are separated by newlines the query cannot hold
+            position = self._map.find(needle, base + offsets[index + 1], end)
+
+class DiskPageSet:
+    """Read-only sequence of the pages of several TitleFiles, in file order"""
+    def __init__(self, files=()):
+        self.stores = list(files)
+        self._offsets = []
+        total = 0
+        for title_file in self.stores:
+            self._offsets.append(total)
+            total += len(title_file)
+        self._length = total
+
+    def segments(self):
+        """Yield ``(offset, title file)`` for every file"""
+        return zip(self._offsets, self.stores)
+
+    def locate(self, index):
+        """Return ``(offset, title file)`` of the file holding *index*"""
+        segment = bisect.bisect_right(self._offsets, index) - 1
+        return self._offsets[segment], self.stores[segment]
+
+    def title_length(self, index):
+        offset, title_file = self.locate(index)
+        return title_file.title_lengths[index - offset]
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        offset, title_file = self.locate(index)
+        return title_file.page(index - offset)
+
+class _CategoryRows:
+    """
+    Rows passing category filters, read from the sorted postings of a title
+    file without copying them: every filter is a union of postings, and a
+    row passes when each filter holds it, found by bisection.
+    """
+    __slots__ = ('_filters',)
+
+    def __init__(self):
+        self._filters = []
+
+    def add(self, postings):
+        """Add a filter passing the rows of any of *postings*"""
+        # The largest categories first, they hold a passing row most often
+        self._filters.append(sorted(postings, key=len, reverse=True))
+
+    def __bool__(self):
+        # May still hold no row when several filters are combined
+        return all(any(len(rows) for rows in postings) for postings in self._filters)
+
+    def __contains__(self, row):
+        # Checked for every match scanned: loops rather than generators
+        for postings in self._filters:
+            for rows in postings:
+                position = bisect.bisect_left(rows, row)
+                if position < len(rows) and rows[position] == row:
+                    break
+            else:
+                return False
+        return True
+
+    def first(self, count):
+        """Return the *count* lowest passing rows, in order"""
+        found = []
+        first, others = self._filters[0], self._filters[1:]
+        last = -1
+        for row in heapq.merge(*first):
+            if row == last:
+                continue
+            last = row
+            if all(any(_contains(rows, row) for rows in postings) for postings in others):
+                found.append(row)
+                if len(found) == count:
+                    break
+        return found
+
+class DiskPageIndex:
+    """
+    PageIndex counterpart searching memory-mapped title files, for wikis
+    too large to keep in memory. Takes the same queries, facet filters
+    included, and ranks by the same tiers.
+
+    Only the titles and aliases starting with the query, or with a word
+    starting with it, are found by bisection; others are found by scanning
+    the keys. Every step stops after a bounded number of pages, so ties
+    within a tier are broken among the first matches in title order rather
+    than among all of them, and a query with no filter and no text lists
+    the first titles of each wiki. Pages with a usage score are always
+    ranked: their titles, aliases, categories and wiki name are kept in
+    memory.
+    """
+    SCAN_FACTOR = 10  # pages looked at per result wanted
+
+    def __init__(self, pages, boosts=None):
+        self.pages = pages  # a DiskPageSet
+        self._boosts = {}
+        self._boosted = {}  # page id -> lowercased (title and aliases, categories, wiki name)
+        for pageid, score in (boosts or {}).items():
+            self.boost(pageid, score)
+
+    def __len__(self):
+        return len(self.pages)
+
+    def boost(self, pageid, score):
+        """Set the usage score of a page, which ranks it above equal matches or a tier up"""
+        if pageid not in self._boosted:
+            page = self.pages[pageid]
+            self._boosted[pageid] = ([string.lower() for string in [page['title']] + page['aliases']],
+                                     [category.lower() for category in page['categories']],
+                                     page['wiki_name'].lower())
+        self._boosts[pageid] = score
+
+    def top(self, query, limit):
+        """Return the ids of the *limit* best matching pages, best first, see PageIndex.top"""
+        facets, query = parse_query(query)
+        if facets:
+            selected = self._select(facets)
+        else:
+            selected = [(offset, title_file, None) for offset, title_file in self.pages.segments()]
+        bound = limit * self.SCAN_FACTOR
+
+        found = {}
+        if query:
+            tier_of = tier_function(query)
+            for offset, title_file, rows in selected:
+                for row, tier in title_file.find(query, tier_of, limit, bound, rows).items():
+                    found[offset + row] = tier
+            for pageid, (strings, categories, wiki_name) in self._boosted.items():
+                tiers = [tier_of(string) for string in strings if query in string]
+                if not facets:
+                    # Lifted a tier, a page matched by category or wiki name
+                    # may rank within a full list
+                    if any(query in category for category in categories):
+                        tiers.append(MATCH_CATEGORY)
+                    elif query in wiki_name:
+                        tiers.append(MATCH_WIKI)
+                if tiers and max(tiers) > found.get(pageid, -1) and self._passes(pageid, selected):
+                    found[pageid] = max(tiers)
+        else:
+            for offset, title_file, rows in selected:
+                rows = rows.first(bound) if rows is not None else range(min(len(title_file), bound))
+                for row in rows:
+                    found[offset + row] = MATCH_PREFIX
+        best = heapq.nlargest(limit, self._ranked(found))
+        if facets or not query or len(best) == limit:
+            return [-ranked[-1] for ranked in best]
+
+        # Pages only matched through a category or the wiki name
+        extra = {}
+        for offset, title_file in self.pages.segments():
+            for index in title_file.categories_holding(query):
+                for row in title_file.category_postings(index)[:bound]:
+                    if offset + row not in found:
+                        extra[offset + row] = MATCH_CATEGORY
+            if query in title_file.name.lower():
+                for row in range(min(len(title_file), bound)):
+                    if offset + row not in found and offset + row not in extra:
+                        extra[offset + row] = MATCH_WIKI
+        best = heapq.nlargest(limit, best + self._ranked(extra))
+        return [-ranked[-1] for ranked in best]
+
+    def _ranked(self, found):
+        boosts = self._boosts
+        title_length = self.pages.title_length
+        ranked = []
+        for pageid, tier in found.items():
+            boost = boosts.get(pageid, 0)
+            ranked.append((ranked_tier(tier, boost), boost, -title_length(pageid), -pageid))
+        return ranked
+
+    def _select(self, facets):
+        """
+        Return ``(offset, title file, rows)`` of the files passing the wiki
+        filters, *rows* being the _CategoryRows passing the category
+        filters, or None without any
+        """
+        names = [title_file.name.lower() for title_file in self.pages.stores]
+        selected = []
+        for offset, title_file in self.pages.segments():
+            rows = None
+            passes = True
+            for kind, value in facets:
+                if kind == 'wiki':
+                    # An exact wiki name wins over the names merely holding it
+                    name = title_file.name.lower()
+                    passes = name == value if value in names else value in name
+                else:
+                    if rows is None:
+                        rows = _CategoryRows()
+                    rows.add(title_file.category_matches(value))
+                    passes = bool(rows)
+                if not passes:
+                    break
+            if passes:
+                selected.append((offset, title_file, rows))
+        return selected
+
+    @staticmethod
+    def _passes(pageid, selected):
+        for offset, title_file, rows in selected:
+            if offset <= pageid < offset + len(title_file):
+                return rows is None or pageid - offset in rows
+        return False
@@ -0,0 +1,31 @@
+import os
+import tempfile
+
+def atomic_write(path, data):
+    """
+    Write *data* to *path* through a temp file renamed over it, so a reader
+    or a crash midway only ever sees the previous content or the new one.
+    *data* is bytes, a str written as UTF-8, or an iterable of bytes chunks.
+
+    Every write has a temp file of its own, so writes of the same file from
+    several threads never trip over each other; the last rename wins.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = (data,)
+    folder, name = os.path.split(path)
+    fd, temp_path = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=folder or None)
+    try:
+        with open(fd, 'wb') as f:
+            for chunk in data:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
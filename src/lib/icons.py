@@ -0,0 +1,109 @@
+import json
+import os
+import re
+import threading
+import urllib.parse
+
+from .files import atomic_write
+
+MANIFEST_FILE_NAME = "manifest.json"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".ico", ".bmp")
+
+_SCALE_RE = re.compile(r'/scale-to-width-down/\d+')
+
+def sized_thumbnail_url(url, size):
+    """Ask Fandom's image server for a *size* pixels wide rendition of *url*"""
+    if _SCALE_RE.search(url):
+        return _SCALE_RE.sub(f'/scale-to-width-down/{size}', url, count=1)
+    return url
+
+def icon_file_name(wiki_name, key, url):
+    """
+    Name of the local icon file for *url*: ``<wiki>-<pageid>.<ext>`` for
+    page thumbnails, the layout get_all_pages.py writes as well
+    """
+    path = urllib.parse.urlsplit(url).path
+    # Fandom appends /revision/latest/... after the actual file name
+    path = path.split('/revision/', 1)[0]
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in IMAGE_EXTENSIONS:
+        extension = ".png"
+    return f"{wiki_name}-{key}{extension}"
+
+class IconManifest:
+    """
+    Index of the icon files downloaded for each wiki, kept in a single JSON
+    file next to the icons so no per-page filesystem probing is needed.
+
+    Layout: ``{wiki: {"logo": file, "pages": {pageid: file}}}``
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_FILE_NAME)
+        self._wikis = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._generation = 0  # bumped on load
+        self._versions = {}  # wiki -> number of changes
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        with self._lock:
+            self._wikis = {
+                wiki: {'logo': icons.get('logo'),
+                       'pages': {int(pageid): name for pageid, name in icons.get('pages', {}).items()}}
+                for wiki, icons in data.items()}
+            self._dirty = False
+            self._generation += 1
+
+    def save(self):
+        """Write the manifest if it changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(self._wikis)
+            self._dirty = False
+        os.makedirs(self.folder, exist_ok=True)
+        atomic_write(self.path, data)
+
+    def version(self, wiki_name):
+        """Return a value that changes whenever the icons of a wiki change"""
+        return self._generation, self._versions.get(wiki_name, 0)
+
+    def page_icon(self, wiki_name, pageid):
+        """Return the icon file of a page, falling back to the wiki logo"""
+        icons = self._wikis.get(wiki_name)
+        if icons is None:
+            return None
+        return icons['pages'].get(pageid) or icons['logo']
+
+    def has_page(self, wiki_name, pageid):
+        icons = self._wikis.get(wiki_name)
+        return icons is not None and pageid in icons['pages']
+
+    def has_logo(self, wiki_name):
+        icons = self._wikis.get(wiki_name)
+        return icons is not None and icons['logo'] is not None
+
+    def set_page(self, wiki_name, pageid, file_name):
+        with self._lock:
+            self._wiki(wiki_name)['pages'][pageid] = file_name
+            self._changed(wiki_name)
+
+    def set_logo(self, wiki_name, file_name):
+        with self._lock:
+            self._wiki(wiki_name)['logo'] = file_name
+            self._changed(wiki_name)
+
+    def _changed(self, wiki_name):
+        self._dirty = True
+        self._versions[wiki_name] = self._versions.get(wiki_name, 0) + 1
+
+    def _wiki(self, wiki_name):
+        icons = self._wikis.get(wiki_name)
+        if icons is None:
+            icons = self._wikis[wiki_name] = {'logo': None, 'pages': {}}
+        return icons
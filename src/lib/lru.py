@@ -0,0 +1,49 @@
+import threading
+import time
+from collections import OrderedDict
+
+class LruCache:
+    """
+    Thread-safe mapping that keeps at most *max_size* entries, evicting the
+    least recently used one first. With a *ttl* in seconds, entries older
+    than that are treated as missing.
+    """
+    def __init__(self, max_size, ttl=None):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if self._expired(entry):
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def items(self):
+        """Return the live ``(key, value)`` pairs, most recently used last"""
+        with self._lock:
+            return [(key, entry[1]) for key, entry in self._entries.items()
+                    if not self._expired(entry)]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expired(self, entry):
+        return self._ttl is not None and time.monotonic() - entry[0] > self._ttl
@@ -0,0 +1,139 @@
+import collections
+import json
+import threading
+import time
+
+from .files import atomic_write
+
+class Histogram:
+    """
+    Running count, sum and maximum of a measure, with percentiles computed
+    over its most recent *window* samples.
+    """
+    def __init__(self, window=1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+        self.recent = collections.deque(maxlen=window)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.recent.append(value)
+
+    def summary(self, scale=1.0):
+        ordered = sorted(self.recent)
+
+        def pick(share):
+            return round(ordered[min(len(ordered) - 1, int(share * len(ordered)))] * scale, 3)
+
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count * scale, 3) if self.count else None,
+            'p50': pick(0.5) if ordered else None,
+            'p90': pick(0.9) if ordered else None,
+            'p99': pick(0.99) if ordered else None,
+            'max': round(self.max * scale, 3) if self.max is not None else None,
+        }
+
+class Metrics:
+    """
+    Thread-safe counters and histograms, each keyed by a name and an
+    optional label such as a wiki or a host.
+
+    Durations are recorded in seconds and reported in milliseconds; other
+    histograms (match counts for instance) are reported as recorded.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # the last snapshot taken is the one kept
+        self._counters = {}
+        self._histograms = {}
+        self._timings = set()  # histogram names holding durations
+        self.started = time.time()
+
+    def count(self, name, amount=1, label=None):
+        with self._lock:
+            key = (name, label)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, label=None):
+        with self._lock:
+            self._histogram(name, label).add(value)
+
+    def observe_time(self, name, seconds, label=None):
+        with self._lock:
+            self._timings.add(name)
+            self._histogram(name, label).add(seconds)
+
+    def timer(self, name, label=None):
+        """Context manager recording the duration of its block"""
+        return _Timer(self, name, label)
+
+    def counter(self, name, label=None):
+        return self._counters.get((name, label), 0)
+
+    def histogram(self, name, label=None):
+        """Return the summary of a histogram, durations in milliseconds"""
+        with self._lock:
+            histogram = self._histograms.get((name, label))
+            if histogram is None:
+                return None
+            return histogram.summary(1000.0 if name in self._timings else 1.0)
+
+    def labels(self, name):
+        """Return the labels recorded under *name*, in first use order"""
+        with self._lock:
+            keys = list(self._counters) + list(self._histograms)
+        return list(dict.fromkeys(label for key, label in keys if key == name))
+
+    def snapshot(self):
+        """
+        Return every metric as ``{'counters': {name: {label: value}},
+        'histograms': {name: {label: summary}}}``; unlabelled metrics use the
+        label ``"all"``.
+        """
+        with self._lock:
+            counters = {}
+            for (name, label), value in self._counters.items():
+                counters.setdefault(name, {})[label or "all"] = value
+            histograms = {}
+            for (name, label), histogram in self._histograms.items():
+                unit = "ms" if name in self._timings else ""
+                histograms.setdefault(name, {})[label or "all"] = dict(
+                    histogram.summary(1000.0 if unit else 1.0), unit=unit)
+            return {
+                'started': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started)),
+                'updated': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                'counters': counters,
+                'histograms': histograms,
+            }
+
+    def write(self, path):
+        """Write the snapshot to *path* as JSON"""
+        with self._write_lock:
+            atomic_write(path, json.dumps(self.snapshot(), indent=1, sort_keys=True))
+
+    def _histogram(self, name, label):
+        histogram = self._histograms.get((name, label))
+        if histogram is None:
+            histogram = self._histograms[(name, label)] = Histogram()
+        return histogram
+
+class _Timer:
+    __slots__ = ('_metrics', '_name', '_label', '_start')
+
+    def __init__(self, metrics, name, label):
+        self._metrics = metrics
+        self._name = name
+        self._label = label
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._metrics.observe_time(self._name, time.perf_counter() - self._start, self._label)
+        return False
@@ -0,0 +1,155 @@
+import json
+import os
+import struct
+import sys
+from array import array
+
+from .files import atomic_write
+from .pagestore import PageStore
+
+MAGIC = b'FWPC'
+VERSION = 3
+FILE_EXTENSION = ".pages"
+CHECKPOINT_EXTENSION = ".partial"
+
+_HEADER = struct.Struct('<4sH')
+_LENGTH = struct.Struct('<I')
+
+class CacheFormatError(Exception):
+    """Raised when a cache file is from another version or is damaged"""
+
+def cache_file(folder, wiki_name):
+    return os.path.join(folder, wiki_name + FILE_EXTENSION)
+
+def checkpoint_file(folder, wiki_name):
+    return os.path.join(folder, wiki_name + CHECKPOINT_EXTENSION)
+
+def write_store(path, store):
+    """
+    Write *store* to *path*. The file is written next to its destination and
+    renamed over it, so an interrupted write never leaves a damaged cache.
+
+    Layout, little-endian: magic and version, the sync timestamp, the wiki
+    statistics as JSON, then each column in turn, aliases last. Integer
+    columns are raw uint32 arrays; string columns are one UTF-8 blob joined
+    by newlines, which none of the strings may contain.
+    """
+    chunks = [_HEADER.pack(MAGIC, VERSION)]
+    _put_blob(chunks, (store.synced or "").encode())
+    _put_blob(chunks, json.dumps(store.statistics).encode() if store.statistics else b"")
+    _put_array(chunks, store.pageids)
+    _put_strings(chunks, store.titles)
+    _put_strings(chunks, (thumbnail or "" for thumbnail in store.thumbnails))
+    _put_strings(chunks, store.category_names)
+    _put_array(chunks, store.category_refs)
+    _put_array(chunks, store.category_starts)
+    _put_strings(chunks, store.alias_titles)
+    _put_array(chunks, store.alias_starts)
+
+    atomic_write(path, chunks)
+
+def read_store(path, name, url):
+    """Return the PageStore saved at *path*, raise CacheFormatError if unusable"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    try:
+        magic, version = _HEADER.unpack_from(data, 0)
+    except struct.error:
+        raise CacheFormatError(f"Truncated cache file {path}") from None
+    if magic != MAGIC or version != VERSION:
+        raise CacheFormatError(f"Unsupported cache file {path}")
+
+    reader = _Reader(data, _HEADER.size)
+    try:
+        store = PageStore(name, url, reader.blob().decode() or None)
+        statistics = reader.blob()
+        store.statistics = json.loads(statistics) if statistics else None
+        store.pageids = reader.array()
+        store.titles = reader.strings(len(store.pageids))
+        store.thumbnails = [thumbnail or None for thumbnail in reader.strings(len(store.pageids))]
+        store.category_names = reader.strings()
+        store.category_refs = reader.array()
+        store.category_starts = reader.array()
+        store.alias_titles = reader.strings()
+        store.alias_starts = reader.array()
+    except (struct.error, ValueError, UnicodeDecodeError) as e:
+        raise CacheFormatError(f"Damaged cache file {path}: {str(e)}") from None
+    if len(store.category_starts) != len(store.pageids) + 1 or len(store.alias_starts) != len(store.pageids) + 1:
+        raise CacheFormatError(f"Damaged cache file {path}")
+    store.reindex_categories()
+    return store
+
+def write_checkpoint(folder, wiki_name, store, continue_params):
+    """
+    Save the pages of an interrupted crawl and the continue block to resume
+    listing from. The page count is recorded with the continue block, so a
+    store and a continue block from different saves are never paired.
+    """
+    path = checkpoint_file(folder, wiki_name)
+    write_store(path, store)
+    atomic_write(path + ".json", json.dumps({'pages': len(store), 'continue': continue_params}))
+
+def read_checkpoint(folder, wiki_name, url):
+    """Return the ``(store, continue_params)`` checkpoint of a wiki, or None"""
+    path = checkpoint_file(folder, wiki_name)
+    if not os.path.exists(path) or not os.path.exists(path + ".json"):
+        return None
+    with open(path + ".json", 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    store = read_store(path, wiki_name, url)
+    if len(store) != state.get('pages') or not state.get('continue'):
+        raise CacheFormatError(f"Mismatched crawl checkpoint {path}")
+    return store, state['continue']
+
+def remove_checkpoint(folder, wiki_name):
+    path = checkpoint_file(folder, wiki_name)
+    for file_path in (path, path + ".json"):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+def _put_blob(chunks, blob):
+    chunks.append(_LENGTH.pack(len(blob)))
+    chunks.append(blob)
+
+def _put_array(chunks, values):
+    values = array('I', values)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    _put_blob(chunks, values.tobytes())
+
+def _put_strings(chunks, strings):
+    strings = list(strings)
+    # A leading count tells an empty list from a list of one empty string
+    chunks.append(_LENGTH.pack(len(strings)))
+    _put_blob(chunks, "\n".join(strings).encode())
+
+class _Reader:
+    def __init__(self, data, position):
+        self._data = data
+        self._position = position
+
+    def blob(self):
+        (length,) = _LENGTH.unpack_from(self._data, self._position)
+        start = self._position + _LENGTH.size
+        end = start + length
+        if end > len(self._data):
+            raise ValueError("blob runs past the end of the file")
+        self._position = end
+        return self._data[start:end]
+
+    def array(self):
+        values = array('I')
+        values.frombytes(self.blob())
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values
+
+    def strings(self, expected=None):
+        (count,) = _LENGTH.unpack_from(self._data, self._position)
+        self._position += _LENGTH.size
+        blob = self.blob()
+        strings = blob.decode().split("\n") if count else []
+        if len(strings) != count or (expected is not None and count != expected):
+            raise ValueError("string count mismatch")
+        return strings
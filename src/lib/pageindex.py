@@ -0,0 +1,348 @@
+import bisect
+import heapq
+import re
+from array import array
+
+from .lru import LruCache
+
+# Match tiers used to rank results, best first
+MATCH_EXACT = 5
+MATCH_PREFIX = 4
+MATCH_WORD = 3
+MATCH_TITLE = 2
+MATCH_CATEGORY = 1
+MATCH_WIKI = 0
+
+WORD_SEPARATORS = " -_(/:"
+
+# Launches, decayed to now, that lift a page one match tier
+BOOST_LIFT = 3.0
+
+# Facet filters: cat:Weapons, category:"Melee weapons", wiki:minecraft
+FACET_PREFIXES = {'cat': 'category', 'category': 'category', 'wiki': 'wiki'}
+_FACET_RE = re.compile(r'(?:^|\s)(cat|category|wiki):(?:"([^"]*)"?|(\S*))', re.IGNORECASE)
+
+def parse_query(query):
+    """
+    Split *query* into its facet filters and the remaining text. Return
+    ``([(kind, value)], text)``, kind being ``'category'`` or ``'wiki'`` and
+    both values and text lowercased; underscores in a value stand for spaces.
+    """
+    facets = []
+
+    def take(match):
+        value = (match.group(2) if match.group(2) is not None else match.group(3)).replace('_', ' ').strip()
+        # A bare "cat:" is still being typed, it filters nothing yet
+        if value:
+            facets.append((FACET_PREFIXES[match.group(1).lower()], value.lower()))
+        return " "
+
+    text, replaced = _FACET_RE.subn(take, query)
+    if not replaced:
+        return facets, query.lower()
+    return facets, " ".join(text.split()).lower()
+
+def tier_function(query):
+    """Return a function giving the match tier of a string holding *query*"""
+    word_start = re.compile(f"[{re.escape(WORD_SEPARATORS)}]{re.escape(query)}").search
+
+    def tier(string):
+        if string == query:
+            return MATCH_EXACT
+        if string.startswith(query):
+            return MATCH_PREFIX
+        return MATCH_WORD if word_start(string) else MATCH_TITLE
+    return tier
+
+def ranked_tier(tier, boost):
+    """
+    Return the tier a page with usage score *boost* ranks in: one above its
+    match *tier* once launched often enough, short of passing exact matches
+    """
+    return tier + 1 if boost >= BOOST_LIFT and tier < MATCH_EXACT else tier
+
+class PageIndex:
+    """
+    Substring index over the title, aliases, categories and wiki name of a
+    page list.
+
+    A page matches a query when the lowercased query is a substring of its
+    lowercased title, of one of its aliases (the titles of the redirects to
+    it), of one of its categories or of its wiki name. A page matched several
+    ways is returned once.
+
+    Titles and aliases are indexed with trigram posting lists: a query of
+    three or more characters only verifies the strings holding its rarest
+    trigram. Shorter queries scan the pre-lowercased strings.
+    Categories and wiki names repeat across pages, so only their distinct
+    values are scanned and each maps to the sorted ids of its pages.
+
+    Queries may hold facet filters (see parse_query). Their page id sets are
+    intersected first, and only the pages left are matched against the
+    text; a wiki's pages are contiguous, so a wiki filter is a plain range.
+
+    The pages matched by the last few queries are kept. A query extending
+    one of them, as each keystroke does, only filters those pages instead
+    of searching the whole index again. An index is built for one page
+    list and replaced when the pages change, so the kept matches never go
+    stale.
+
+    *boosts* maps page ids to a usage score, see boost(); among pages
+    matching equally well, the higher score ranks first, and a score of
+    BOOST_LIFT or more ranks a page one tier up (see ranked_tier).
+    """
+    GRAM = 3
+    MATCH_CACHE_SIZE = 32
+
+    def __init__(self, pages, boosts=None):
+        self.pages = pages  # a PageSet
+        self._boosts = dict(boosts or {})
+        self._titles = []
+        self._grams = {}
+        self._aliases = []
+        self._alias_grams = {}
+        self._alias_pages = array('I')  # alias id -> page id
+        self._matches_cache = LruCache(self.MATCH_CACHE_SIZE)  # (facets, text) -> _matches()
+        self._categories = {}
+        self._wikis = {}
+
+        for offset, store in pages.segments():
+            # Category names are interned per store, lowercase each one once
+            categories = [category.lower() for category in store.category_names]
+            refs, starts = store.category_refs, store.category_starts
+            aliases, alias_starts = store.alias_titles, store.alias_starts
+            wiki_postings = self._wikis.get(store.name.lower())
+            if wiki_postings is None:
+                wiki_postings = self._wikis[store.name.lower()] = array('I')
+
+            for row, title in enumerate(store.titles):
+                pageid = offset + row
+                self._add_string(self._titles, self._grams, title.lower())
+                for alias in aliases[alias_starts[row]:alias_starts[row + 1]]:
+                    self._add_string(self._aliases, self._alias_grams, alias.lower())
+                    self._alias_pages.append(pageid)
+                for ref in refs[starts[row]:starts[row + 1]]:
+                    self._add(self._categories, categories[ref], pageid)
+                wiki_postings.append(pageid)
+
+    def __len__(self):
+        return len(self.pages)
+
+    def boost(self, pageid, score):
+        """Set the usage score of a page, which ranks it above equal matches or a tier up"""
+        self._boosts[pageid] = score
+
+    def top(self, query, limit):
+        """
+        Return the ids of the *limit* best matching pages, best first.
+
+        Title matches rank by tier: exact, prefix, word start, then anywhere
+        in the title; a page ranks by its title or its best matching alias,
+        whichever is better. Pages matched only through a category come next
+        and pages matched only through their wiki name last. Pages launched
+        often move up a tier. Ties go to the page with the higher usage
+        score, then to the shorter title, then to the page order. With facet
+        filters, only the titles and aliases of the pages passing every
+        filter are matched.
+        """
+        facets, query = parse_query(query)
+        if query:
+            title_ids, alias_ids = self._matches(facets, query)
+        else:
+            title_ids = self._facet_candidates(facets) if facets else range(len(self.pages))
+            alias_ids = ()
+        best = self._best(query, title_ids, alias_ids, limit)
+        if facets or not query:
+            return [-ranked[-1] for ranked in best]
+        titles = self._titles
+        boosts = self._boosts
+        lifted = None
+        if len(best) == limit:
+            # Title and alias tiers all beat the category tier, so a full
+            # list only leaves room for the pages lifted a tier
+            lifted = sorted(pageid for pageid, score in boosts.items() if score >= BOOST_LIFT)
+            if not lifted:
+                return [-ranked[-1] for ranked in best]
+
+        # Pages only matched through a category or the wiki name
+        matched = {-ranked[-1] for ranked in best}
+        extra = []
+        for tier, table in ((MATCH_CATEGORY, self._categories), (MATCH_WIKI, self._wikis)):
+            for value, postings in table.items():
+                if query in value:
+                    for pageid in postings if lifted is None else _intersect(lifted, postings):
+                        if pageid not in matched:
+                            matched.add(pageid)
+                            boost = boosts.get(pageid, 0)
+                            extra.append((ranked_tier(tier, boost), boost, -len(titles[pageid]), -pageid))
+        best = heapq.nlargest(limit, best + extra)
+        return [-ranked[-1] for ranked in best]
+
+    def _matches(self, facets, query):
+        """
+        Return ``(title ids, alias ids)``: the sorted ids of the titles and of
+        the aliases holding the non-empty *query*, among the pages passing
+        the *facets* filters. A title id is its page id.
+        """
+        key = (tuple(facets), query)
+        found = self._matches_cache.get(key)
+        if found is not None:
+            return found
+
+        # The longest earlier query this one extends holds all its matches
+        for end in range(len(query) - 1, 0, -1):
+            narrower = self._matches_cache.get((key[0], query[:end]))
+            if narrower is not None:
+                titles, aliases = self._titles, self._aliases
+                found = (array('I', [pageid for pageid in narrower[0] if query in titles[pageid]]),
+                         array('I', [alias_id for alias_id in narrower[1] if query in aliases[alias_id]]))
+                break
+        else:
+            candidates = self._facet_candidates(facets) if facets else None
+            alias_ids = self._find(self._aliases, self._alias_grams, query)
+            if candidates is not None:
+                alias_pages = self._alias_pages
+                alias_ids = [alias_id for alias_id in alias_ids if _contains(candidates, alias_pages[alias_id])]
+            found = (array('I', self._find(self._titles, self._grams, query, candidates)), array('I', alias_ids))
+        self._matches_cache.put(key, found)
+        return found
+
+    def _best(self, query, title_ids, alias_ids, limit):
+        """
+        Return ``(ranked tier, usage score, -title length, -pageid)`` of the
+        *limit* best pages matched by *title_ids* and *alias_ids*, best
+        first. A page ranks by its title or its best alias, whichever is
+        better.
+        """
+        titles = self._titles
+        boosts = self._boosts
+        tier_of = tier_function(query)
+        alias_tiers = {}
+        alias_pages = self._alias_pages
+        for alias_id in alias_ids:
+            pageid = alias_pages[alias_id]
+            tier = tier_of(self._aliases[alias_id])
+            if tier > alias_tiers.get(pageid, -1):
+                alias_tiers[pageid] = tier
+
+        # Short queries match most titles, but enough of them start with the
+        # query to fill the list; only the pages lifted a tier into the
+        # prefix tier can rank with those
+        prefixed = [pageid for pageid in title_ids if titles[pageid].startswith(query)]
+        if len(prefixed) >= limit:
+            ranked = set(prefixed)
+            ranked_ids = prefixed + [pageid for pageid, score in boosts.items()
+                                     if score >= BOOST_LIFT and pageid not in ranked
+                                     and _contains(title_ids, pageid)]
+            ranked.update(ranked_ids)
+            alias_tiers = {pageid: tier for pageid, tier in alias_tiers.items()
+                           if ranked_tier(tier, boosts.get(pageid, 0)) >= MATCH_PREFIX}
+        else:
+            ranked_ids = title_ids
+            ranked = None
+        keys = []
+        for pageid in ranked_ids:
+            boost = boosts.get(pageid, 0)
+            tier = max(tier_of(titles[pageid]), alias_tiers.get(pageid, -1))
+            keys.append((ranked_tier(tier, boost), boost, -len(titles[pageid]), -pageid))
+        for pageid, tier in alias_tiers.items():
+            if not (pageid in ranked if ranked is not None else _contains(title_ids, pageid)):
+                boost = boosts.get(pageid, 0)
+                keys.append((ranked_tier(tier, boost), boost, -len(titles[pageid]), -pageid))
+        return heapq.nlargest(limit, keys)
+
+    def _add_string(self, strings, grams, string):
+        string_id = len(strings)
+        strings.append(string)
+        for gram in {string[i:i + self.GRAM] for i in range(len(string) - self.GRAM + 1)}:
+            postings = grams.get(gram)
+            if postings is None:
+                postings = grams[gram] = array('I')
+            postings.append(string_id)
+
+    def _find(self, strings, grams, query, candidates=None):
+        """
+        Return the ids of the *strings* holding *query*, in order, among the
+        sorted *candidates* if given; *grams* are their trigram postings.
+        """
+        if len(query) >= self.GRAM:
+            rarest = None
+            for i in range(len(query) - self.GRAM + 1):
+                postings = grams.get(query[i:i + self.GRAM])
+                if postings is None:
+                    return []
+                if rarest is None or len(postings) < len(rarest):
+                    rarest = postings
+            if candidates is not None:
+                # Verify whichever of the two lists is shorter
+                rarest = _intersect(rarest, candidates)
+            return [string_id for string_id in rarest if query in strings[string_id]]
+
+        if candidates is not None:
+            return [string_id for string_id in candidates if query in strings[string_id]]
+        # Too short for a trigram; the lowercased strings are scanned as is,
+        # without allocating anything per string
+        return [string_id for string_id, string in enumerate(strings) if query in string]
+
+    def _facet_candidates(self, facets):
+        """Return the sorted ids of the pages passing every facet filter"""
+        candidates = None
+        for kind, value in facets:
+            ids = self._wiki_ids(value) if kind == 'wiki' else self._category_ids(value)
+            candidates = ids if candidates is None else _intersect(candidates, ids)
+            if not candidates:
+                return []
+        return candidates
+
+    def _wiki_ids(self, value):
+        segments = [(offset, store) for offset, store in self.pages.segments() if store.name.lower() == value]
+        if not segments:
+            segments = [(offset, store) for offset, store in self.pages.segments() if value in store.name.lower()]
+        ranges = [range(offset, offset + len(store)) for offset, store in segments]
+        if len(ranges) == 1:
+            return ranges[0]
+        return [pageid for pageid_range in ranges for pageid in pageid_range]
+
+    def _category_ids(self, value):
+        # An exact category name wins over the categories merely holding it
+        postings = self._categories.get(value)
+        if postings is not None:
+            return postings
+        matching = [postings for name, postings in self._categories.items() if value in name]
+        if len(matching) == 1:
+            return matching[0]
+        return sorted(set().union(*matching))
+
+    @staticmethod
+    def _add(table, value, pageid):
+        postings = table.get(value)
+        if postings is None:
+            postings = table[value] = array('I')
+        # Ids come in order; a page listing a category twice is kept once
+        if not postings or postings[-1] != pageid:
+            postings.append(pageid)
+
+def _contains(ids, pageid):
+    """Tell whether the sorted id sequence *ids* holds *pageid*"""
+    if isinstance(ids, range):
+        return pageid in ids
+    position = bisect.bisect_left(ids, pageid)
+    return position < len(ids) and ids[position] == pageid
+
+def _intersect(first, second):
+    """
+    Intersect two sorted id sequences: every id of the shorter one is looked
+    up in the longer one, in constant time for ranges and by bisection
+    otherwise.
+    """
+    if len(first) > len(second):
+        first, second = second, first
+    if isinstance(second, range):
+        return [pageid for pageid in first if pageid in second]
+    found = []
+    size = len(second)
+    for pageid in first:
+        position = bisect.bisect_left(second, pageid)
+        if position < size and second[position] == pageid:
+            found.append(pageid)
+    return found
@@ -0,0 +1,181 @@
+import bisect
+from array import array
+
+class PageStore:
+    """
+    Compact column store for the pages of one wiki.
+
+    Each page is a row: its id, title and thumbnail sit in parallel columns.
+    Categories are interned in a per-wiki string table and referenced by id
+    from one flat array, so a category shared by thousands of pages is
+    stored once. Page URLs are derived from the wiki URL on demand.
+
+    Redirects are not pages of their own: their titles are kept as aliases
+    of the page they lead to, in one flat list sliced per row.
+
+    *statistics* holds the wiki's ``{'pages', 'edits'}`` counts from just
+    before the crawl, which tell whether the wiki changed since.
+    """
+    def __init__(self, name, url, synced=None, statistics=None):
+        self.name = name
+        self.url = url
+        self.synced = synced
+        self.statistics = statistics
+        self.pageids = array('I')
+        self.titles = []
+        self.thumbnails = []
+        self.category_names = []
+        self._category_ids = {}
+        # Categories of row i are category_refs[category_starts[i]:category_starts[i + 1]]
+        self.category_refs = array('I')
+        self.category_starts = array('I', [0])
+        # Aliases of row i are alias_titles[alias_starts[i]:alias_starts[i + 1]]
+        self.alias_titles = []
+        self.alias_starts = array('I', [0])
+
+    @classmethod
+    def from_pages(cls, name, url, pages, synced=None, statistics=None):
+        """Build a store from page dicts as produced by the crawler"""
+        store = cls(name, url, synced, statistics)
+        for page in pages:
+            store.add(page['pageid'], page['title'], page['thumbnail'], page['categories'],
+                      page.get('aliases', ()))
+        return store
+
+    def add(self, pageid, title, thumbnail, categories, aliases=()):
+        self.pageids.append(pageid)
+        self.titles.append(title)
+        self.thumbnails.append(thumbnail)
+        for category in categories:
+            ref = self._category_ids.get(category)
+            if ref is None:
+                ref = self._category_ids[category] = len(self.category_names)
+                self.category_names.append(category)
+            self.category_refs.append(ref)
+        self.category_starts.append(len(self.category_refs))
+        self.alias_titles.extend(aliases)
+        self.alias_starts.append(len(self.alias_titles))
+
+    def reindex_categories(self):
+        """Rebuild the category lookup after category_names was replaced"""
+        self._category_ids = {category: ref for ref, category in enumerate(self.category_names)}
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __iter__(self):
+        return (Page(self, row) for row in range(len(self.titles)))
+
+    def __getitem__(self, row):
+        return Page(self, row)
+
+    def categories(self, row):
+        names = self.category_names
+        return [names[ref] for ref in
+                self.category_refs[self.category_starts[row]:self.category_starts[row + 1]]]
+
+    def row(self, pageid):
+        """Return the row of the page *pageid*, or None"""
+        try:
+            return self.pageids.index(pageid)
+        except ValueError:
+            return None
+
+    def aliases(self, row):
+        return self.alias_titles[self.alias_starts[row]:self.alias_starts[row + 1]]
+
+    def page_url(self, title):
+        return f"{self.url}/wiki/{title.replace(' ', '_')}"
+
+    def to_pages(self):
+        """Return the rows as page dicts, the inverse of from_pages"""
+        return [page.to_dict() for page in self]
+
+class Page:
+    """
+    Lightweight view on one row of a PageStore.
+
+    Supports both attribute access and the ``page['title']`` style used for
+    plain page dicts.
+    """
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    @property
+    def pageid(self):
+        return self.store.pageids[self.row]
+
+    @property
+    def title(self):
+        return self.store.titles[self.row]
+
+    @property
+    def wiki_name(self):
+        return self.store.name
+
+    @property
+    def url(self):
+        return self.store.page_url(self.store.titles[self.row])
+
+    @property
+    def thumbnail(self):
+        return self.store.thumbnails[self.row]
+
+    @property
+    def categories(self):
+        return self.store.categories(self.row)
+
+    @property
+    def aliases(self):
+        """Titles of the redirects to this page"""
+        return self.store.aliases(self.row)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def to_dict(self):
+        return {
+            'pageid': self.pageid,
+            'title': self.title,
+            'url': self.url,
+            'wiki_name': self.wiki_name,
+            'thumbnail': self.thumbnail,
+            'categories': self.categories,
+            'aliases': self.aliases
+        }
+
+class PageSet:
+    """Read-only sequence of the pages of several stores, in store order"""
+    def __init__(self, stores=()):
+        self.stores = list(stores)
+        self._offsets = []
+        total = 0
+        for store in self.stores:
+            self._offsets.append(total)
+            total += len(store)
+        self._length = total
+
+    def segments(self):
+        """Yield ``(offset, store)`` for every store"""
+        return zip(self._offsets, self.stores)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for store in self.stores:
+            yield from store
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        segment = bisect.bisect_right(self._offsets, index) - 1
+        return Page(self.stores[segment], index - self._offsets[segment])
@@ -0,0 +1,368 @@
+import bz2
+import gzip
+import html
+import re
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+
+from .crawler import CrawlCancelled, format_timestamp
+
+try:
+    import sqlite3
+except ImportError:  # Python builds without the sqlite3 module
+    sqlite3 = None
+
+SEARCH_MATCH_START = '<span class="searchmatch">'
+SEARCH_MATCH_END = '</span>'
+
+def available():
+    """Tell whether this Python's SQLite supports FTS5"""
+    if sqlite3 is None:
+        return False
+    try:
+        connection = sqlite3.connect(":memory:")
+        try:
+            connection.execute("CREATE VIRTUAL TABLE probe USING fts5(text)")
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        return False
+    return True
+
+# Markup dropped or unwrapped by plain_text, applied in order
+_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+_REF_RE = re.compile(r'<ref[^>]*/>|<ref[^>]*>.*?</ref>', re.DOTALL | re.IGNORECASE)
+_TEMPLATE_RE = re.compile(r'\{\{[^{}]*\}\}')
+_TABLE_RE = re.compile(r'\{\|.*?\|\}', re.DOTALL)
+_FILE_LINK_RE = re.compile(r'\[\[(?:file|image|category|media):[^\[\]]*(?:\[\[[^\[\]]*\]\][^\[\]]*)*\]\]', re.IGNORECASE)
+_LINK_RE = re.compile(r'\[\[(?:[^\[\]|]*\|)?([^\[\]]*)\]\]')
+_EXTERNAL_LINK_RE = re.compile(r'\[(?:https?:)?//[^\s\]]*\s*([^\]]*)\]')
+_TAG_RE = re.compile(r'<[^<>]+>')
+_FORMATTING_RE = re.compile(r"'{2,}|^[=*#:;]+|=+$|__[A-Z]+__", re.MULTILINE)
+_SPACE_RE = re.compile(r'\s+')
+
+def plain_text(wikitext, max_length=None):
+    """
+    Reduce *wikitext* to the text a reader sees, roughly: templates, tables,
+    references, files and categories go, links keep their label.
+    """
+    text = _COMMENT_RE.sub(' ', wikitext)
+    text = _REF_RE.sub(' ', text)
+    # Templates nest; strip them from the innermost out
+    while True:
+        text, count = _TEMPLATE_RE.subn(' ', text)
+        if not count:
+            break
+    text = _TABLE_RE.sub(' ', text)
+    text = _FILE_LINK_RE.sub(' ', text)
+    text = _LINK_RE.sub(r'\1', text)
+    text = _EXTERNAL_LINK_RE.sub(r'\1', text)
+    text = _TAG_RE.sub(' ', text)
+    text = _FORMATTING_RE.sub('', text)
+    text = _SPACE_RE.sub(' ', html.unescape(text)).strip()
+    return text[:max_length] if max_length else text
+
+def match_expression(query):
+    """
+    Turn what the user typed into an FTS5 query matching every word; the
+    last word is still being typed, so it matches as a prefix once it has
+    two characters. Return None when *query* holds no word.
+    """
+    words = re.findall(r'\w+', query.lower())
+    if not words:
+        return None
+    # Words hold no quotes, quoting them keeps FTS5 operators out
+    terms = [f'"{word}"' for word in words]
+    if not query[-1:].isspace() and len(words[-1]) >= 2:
+        terms[-1] += '*'
+    return " ".join(terms)
+
+def read_dump(path):
+    """
+    Yield ``(pageid, revid, title, wikitext, timestamp)`` for the main
+    namespace pages of a MediaWiki XML dump, plain or compressed with gzip
+    or bzip2.
+    """
+    if path.endswith(".gz"):
+        stream = gzip.open(path, 'rb')
+    elif path.endswith(".bz2"):
+        stream = bz2.open(path, 'rb')
+    else:
+        stream = open(path, 'rb')
+
+    with stream:
+        page = {}
+        revision = None
+        for event, element in ElementTree.iterparse(stream, events=('start', 'end')):
+            # Tags carry the namespace of the export schema version
+            tag = element.tag.rsplit('}', 1)[-1]
+            if event == 'start':
+                if tag == 'page':
+                    page = {}
+                elif tag == 'revision':
+                    revision = {}
+                continue
+            if revision is not None:
+                if tag == 'revision':
+                    page['revision'] = revision
+                    revision = None
+                elif tag in ('id', 'timestamp', 'text'):
+                    revision.setdefault(tag, element.text or '')
+            elif tag in ('title', 'ns', 'id'):
+                page[tag] = element.text or ''
+            elif tag == 'page':
+                revision_data = page.get('revision')
+                if page.get('ns') == '0' and revision_data and 'id' in page:
+                    yield (int(page['id']), int(revision_data.get('id') or 0), page.get('title', ''),
+                           revision_data.get('text', ''), revision_data.get('timestamp'))
+                element.clear()
+
+def sync_wikis(text_index, crawler, wikis, stores, logger):
+    """
+    Bring the full-text index of *wikis* up to date with their pages in
+    *stores* (wiki name to PageStore or diskindex.TitleFile), fetching
+    content through *crawler*. Pages changed since the last sync, and pages
+    never fetched, are fetched; pages gone are dropped. A sync too old for
+    the recent changes to cover compares revision ids instead, so only the
+    pages edited since are fetched again. Batches are written as they
+    arrive, so a cancelled sync resumes where it stopped. Return the number of pages
+    fetched; wikis that failed are in ``crawler.failed``.
+    """
+    jobs = []
+    started = {}
+    for wiki in wikis:
+        store = stores.get(wiki['name'])
+        if store is None:
+            continue
+        state = text_index.state(wiki['name'])
+        started[wiki['name']] = format_timestamp(time.time() - crawler.SYNC_OVERLAP)
+        if not state:
+            text_index.begin(wiki['name'], started[wiki['name']])
+        indexed = text_index.revisions(wiki['name'])
+        gone = set(indexed).difference(store.pageids)
+        text_index.remove(wiki['name'], gone)
+        for pageid in gone:
+            del indexed[pageid]
+
+        changed = set()
+        outdated = set()
+        if state and indexed:
+            try:
+                changed = crawler.changed_titles(wiki, state[0])
+                if changed is None:
+                    changed = set()
+                    outdated = crawler.outdated_pages(wiki, indexed)
+            except CrawlCancelled:
+                raise
+            except Exception as e:
+                logger.err(f"Error fetching the changes of {wiki['name']}: {str(e)}")
+                continue
+        pageids = [pageid for pageid in store.pageids if pageid not in indexed or pageid in outdated]
+        if changed:
+            # Titles are read, one row at a time, only when some changed
+            listed = set(pageids)
+            pageids += [page['pageid'] for page in store
+                        if page['title'] in changed and page['pageid'] not in listed]
+        jobs.append((wiki, pageids))
+
+    fetched = 0
+    for wiki, texts in crawler.fetch_texts(jobs):
+        text_index.update(wiki['name'], texts)
+        fetched += len(texts)
+    for wiki, _ in jobs:
+        if wiki['name'] not in crawler.failed:
+            text_index.finish(wiki['name'], started[wiki['name']])
+    return fetched
+
+def load_dump(text_index, wiki_name, path, batch_size=500):
+    """
+    Fill the full-text index of *wiki_name* from the XML dump at *path* and
+    return the number of pages loaded. The wiki counts as synced as of its
+    latest revision in the dump, so the next sync only fetches what changed
+    after it, along with the pages the dump lacks.
+    """
+    text_index.clear(wiki_name)
+    text_index.begin(wiki_name, None)
+    latest = None
+    batch = []
+    loaded = 0
+    for pageid, revid, title, wikitext, timestamp in read_dump(path):
+        batch.append((pageid, revid, title, wikitext))
+        if timestamp and (latest is None or timestamp > latest):
+            latest = timestamp
+        if len(batch) >= batch_size:
+            text_index.update(wiki_name, batch)
+            loaded += len(batch)
+            batch = []
+    text_index.update(wiki_name, batch)
+    loaded += len(batch)
+    text_index.finish(wiki_name, latest)
+    return loaded
+
+class TextIndex:
+    """
+    Full-text index of page content, in an SQLite database with an FTS5
+    table ranked by BM25, titles weighing more than the body.
+
+    Every wiki has a ``synced`` timestamp: changes made before it are in the
+    index. A wiki only answers searches once it is ``complete``, that is
+    once all of its pages were fetched; until then text search goes online.
+
+    Writes and searches use separate connections, and the database is in WAL
+    mode, so searches do not wait for the indexer.
+    """
+    SCHEMA_VERSION = 1
+    MAX_TEXT_LENGTH = 20000  # characters of body text kept per page
+    SNIPPET_TOKENS = 24
+    TITLE_WEIGHT = 10.0
+
+    def __init__(self, path):
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._writer = self._connect()
+        self._create_schema()
+        self._reader = self._connect()
+        self._complete = {name for name, in self._writer.execute("SELECT name FROM wikis WHERE complete")}
+
+    def _connect(self):
+        # Used from the indexer and the suggestion threads, under the locks
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _create_schema(self):
+        with self._write_lock, self._writer:
+            writer = self._writer
+            version = writer.execute("PRAGMA user_version").fetchone()[0]
+            if version != self.SCHEMA_VERSION:
+                # A cache like the page files, rebuilt rather than migrated
+                writer.execute("DROP TABLE IF EXISTS wikis")
+                writer.execute("DROP TABLE IF EXISTS documents")
+                writer.execute("DROP TABLE IF EXISTS content")
+            writer.execute("CREATE TABLE IF NOT EXISTS wikis ("
+                           "name TEXT PRIMARY KEY, synced TEXT, complete INTEGER NOT NULL DEFAULT 0)")
+            writer.execute("CREATE TABLE IF NOT EXISTS documents ("
+                           "id INTEGER PRIMARY KEY, wiki TEXT NOT NULL, pageid INTEGER NOT NULL, "
+                           "revid INTEGER, UNIQUE (wiki, pageid))")
+            writer.execute("CREATE VIRTUAL TABLE IF NOT EXISTS content USING fts5("
+                           "title, body, wiki UNINDEXED, "
+                           "tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+            writer.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def close(self):
+        with self._write_lock, self._read_lock:
+            self._writer.close()
+            self._reader.close()
+
+    def is_complete(self, wiki_name):
+        return wiki_name in self._complete
+
+    def state(self, wiki_name):
+        """Return ``(synced, complete)`` for *wiki_name*, or None if it was never indexed"""
+        with self._write_lock:
+            row = self._writer.execute(
+                "SELECT synced, complete FROM wikis WHERE name = ?", (wiki_name,)).fetchone()
+        return (row[0], bool(row[1])) if row else None
+
+    def begin(self, wiki_name, synced):
+        """Start indexing *wiki_name*, whose changes since *synced* will be fetched"""
+        with self._write_lock, self._writer:
+            self._writer.execute(
+                "INSERT OR IGNORE INTO wikis (name, synced, complete) VALUES (?, ?, 0)", (wiki_name, synced))
+
+    def finish(self, wiki_name, synced):
+        """Mark *wiki_name* as complete, holding every change made before *synced*"""
+        with self._write_lock, self._writer:
+            self._writer.execute(
+                "INSERT OR REPLACE INTO wikis (name, synced, complete) VALUES (?, ?, 1)", (wiki_name, synced))
+        self._complete.add(wiki_name)
+
+    def clear(self, wiki_name):
+        """Drop everything indexed for *wiki_name*"""
+        self._complete.discard(wiki_name)
+        with self._write_lock, self._writer:
+            self._writer.execute(
+                "DELETE FROM content WHERE rowid IN (SELECT id FROM documents WHERE wiki = ?)", (wiki_name,))
+            self._writer.execute("DELETE FROM documents WHERE wiki = ?", (wiki_name,))
+            self._writer.execute("DELETE FROM wikis WHERE name = ?", (wiki_name,))
+
+    def prune(self, wiki_names):
+        """Drop the wikis not in *wiki_names*"""
+        with self._write_lock:
+            indexed = [name for name, in self._writer.execute("SELECT name FROM wikis")]
+        for name in indexed:
+            if name not in wiki_names:
+                self.clear(name)
+
+    def revisions(self, wiki_name):
+        """Return a dict of page id to indexed revision id for *wiki_name*"""
+        with self._write_lock:
+            return dict(self._writer.execute(
+                "SELECT pageid, revid FROM documents WHERE wiki = ?", (wiki_name,)))
+
+    def update(self, wiki_name, pages):
+        """
+        Add or replace pages of *wiki_name*, given as ``(pageid, revid,
+        title, wikitext)``, in a single transaction.
+        """
+        rows = [(pageid, revid, title, plain_text(wikitext, self.MAX_TEXT_LENGTH))
+                for pageid, revid, title, wikitext in pages]
+        with self._write_lock, self._writer:
+            writer = self._writer
+            for pageid, revid, title, text in rows:
+                row = writer.execute(
+                    "SELECT id FROM documents WHERE wiki = ? AND pageid = ?", (wiki_name, pageid)).fetchone()
+                if row:
+                    document_id = row[0]
+                    writer.execute("UPDATE documents SET revid = ? WHERE id = ?", (revid, document_id))
+                    writer.execute("DELETE FROM content WHERE rowid = ?", (document_id,))
+                else:
+                    document_id = writer.execute(
+                        "INSERT INTO documents (wiki, pageid, revid) VALUES (?, ?, ?)",
+                        (wiki_name, pageid, revid)).lastrowid
+                writer.execute("INSERT INTO content (rowid, title, body, wiki) VALUES (?, ?, ?, ?)",
+                               (document_id, title, text, wiki_name))
+
+    def remove(self, wiki_name, pageids):
+        """Drop the pages of *wiki_name* whose ids are in *pageids*"""
+        with self._write_lock, self._writer:
+            for pageid in pageids:
+                row = self._writer.execute(
+                    "SELECT id FROM documents WHERE wiki = ? AND pageid = ?", (wiki_name, pageid)).fetchone()
+                if row:
+                    self._writer.execute("DELETE FROM content WHERE rowid = ?", row)
+                    self._writer.execute("DELETE FROM documents WHERE id = ?", row)
+
+    def count(self):
+        """Return the number of pages indexed over all wikis"""
+        with self._read_lock:
+            return self._reader.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def search(self, query, wiki_names, limit):
+        """
+        Return a dict of wiki name to at most *limit* results, best first, in
+        the shape of list=search results: ``{'pageid', 'title', 'snippet'}``
+        with the matched words of the snippet wrapped as the API does.
+        """
+        expression = match_expression(query)
+        results = {name: [] for name in wiki_names}
+        if expression is None or not wiki_names:
+            return results
+        # Ranked wiki by wiki, so one wiki's matches never crowd out
+        # another's. ORDER BY rank lets FTS5 sort on its own, so snippets are
+        # only built for the rows returned
+        with self._read_lock:
+            for name in wiki_names:
+                rows = self._reader.execute(
+                    "SELECT documents.pageid, content.title, snippet(content, 1, ?, ?, '...', ?) "
+                    "FROM content JOIN documents ON documents.id = content.rowid "
+                    "WHERE content MATCH ? AND content.wiki = ? AND rank MATCH ? "
+                    "ORDER BY rank LIMIT ?",
+                    (SEARCH_MATCH_START, SEARCH_MATCH_END, self.SNIPPET_TOKENS, expression, name,
+                     f"bm25({self.TITLE_WEIGHT}, 1.0)", limit)).fetchall()
+                results[name] = [{'pageid': pageid, 'title': title, 'snippet': snippet}
+                                 for pageid, title, snippet in rows]
+        return results
@@ -0,0 +1,203 @@
+import base64
+import http.client
+import json
+import ssl
+import threading
+import time
+import urllib.parse
+import zlib
+
+class HttpError(Exception):
+    """Raised for any HTTP response that is not a success"""
+    def __init__(self, status, reason, headers):
+        super().__init__(f"HTTP {status} {reason}")
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+
+class ApiTransport:
+    """
+    Shared HTTP transport for the MediaWiki API.
+
+    Connections are kept alive and pooled per host, responses are requested
+    gzip-compressed and decoded straight from the received bytes. Redirects
+    are followed as urllib does: 301, 302 and 303 turn a POST into a GET,
+    with its parameters in the query string, 307 and 308 repeat it. Proxies
+    follow the ``{scheme: url}`` layout of urllib's ProxyHandler.
+
+    With *metrics*, requests, received bytes, errors and latency are
+    recorded per host under ``http.*``.
+    """
+    USER_AGENT = "Keypirinha-FandomWiki/1.0"
+    MAX_IDLE_PER_HOST = 8
+    MAX_REDIRECTS = 5
+    REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+    # Errors raised when a pooled connection was closed by the server while
+    # idle; the request is replayed once on a fresh connection
+    _STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                     ConnectionResetError, BrokenPipeError)
+
+    def __init__(self, timeout=15, proxies=None, metrics=None):
+        self._timeout = timeout
+        self._metrics = metrics
+        self._proxies = dict(proxies or {})
+        self._ssl_context = ssl.create_default_context()
+        self._idle = {}
+        self._proxy_headers = {}  # headers for plain HTTP proxies, per host
+        self._lock = threading.Lock()
+
+    def request_json(self, url, params):
+        """POST form-encoded *params* to *url* and return the decoded JSON body"""
+        return json.loads(self.request(url, params))
+
+    def request(self, url, params=None):
+        """
+        Send a request (POST when *params* is given, GET otherwise) and return
+        the decompressed response body as bytes.
+        """
+        if self._metrics is None:
+            return self._request(url, params)
+        host = urllib.parse.urlsplit(url).netloc
+        start = time.perf_counter()
+        try:
+            data = self._request(url, params)
+        except Exception:
+            self._metrics.count("http.errors", label=host)
+            raise
+        finally:
+            self._metrics.count("http.requests", label=host)
+            self._metrics.observe_time("http.latency", time.perf_counter() - start, label=host)
+        return data
+
+    def _request(self, url, params):
+        for _ in range(self.MAX_REDIRECTS + 1):
+            response, data = self._fetch(url, params)
+            if response.status not in self.REDIRECT_STATUSES:
+                break
+            location = response.getheader('Location')
+            if not location:
+                raise HttpError(response.status, response.reason, response.headers)
+            url = urllib.parse.urljoin(url, location)
+            if response.status in (301, 302, 303) and params is not None:
+                url = self._with_query(url, params)
+                params = None
+        else:
+            raise HttpError(response.status, f"{response.reason} (more than {self.MAX_REDIRECTS} redirects)",
+                            response.headers)
+
+        if not 200 <= response.status < 300:
+            raise HttpError(response.status, response.reason, response.headers)
+        if response.getheader('Content-Encoding', '').lower() == 'gzip':
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        return data
+
+    @staticmethod
+    def _with_query(url, params):
+        # Keeps the parameters of a POST turned into a GET by a redirect
+        parts = urllib.parse.urlsplit(url)
+        query = "&".join(filter(None, (parts.query, urllib.parse.urlencode(params))))
+        return urllib.parse.urlunsplit(parts._replace(query=query))
+
+    def _fetch(self, url, params):
+        """Send one request and return the response with its raw body"""
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        headers = {
+            'User-Agent': self.USER_AGENT,
+            'Accept-Encoding': 'gzip',
+        }
+        body = None
+        if params is not None:
+            body = urllib.parse.urlencode(params).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        conn, reused = self._acquire(key)
+        try:
+            response = self._send(conn, key, path, body, headers)
+        except self._STALE_ERRORS:
+            conn.close()
+            if not reused:
+                raise
+            conn, reused = self._create(key), False
+            response = self._send(conn, key, path, body, headers)
+        except Exception:
+            conn.close()
+            raise
+
+        try:
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+
+        if self._metrics is not None:
+            self._metrics.count("http.bytes", len(data), label=parts.netloc)
+        return response, data
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _send(self, conn, key, path, body, headers):
+        proxy_headers = self._proxy_headers.get(key)
+        if proxy_headers is not None:
+            # Plain HTTP through a proxy takes the absolute URL
+            path = f"{key[0]}://{key[1]}{path}"
+            headers = dict(headers, **proxy_headers)
+        conn.request('POST' if body is not None else 'GET', path, body=body, headers=headers)
+        return conn.getresponse()
+
+    def _acquire(self, key):
+        with self._lock:
+            conns = self._idle.get(key)
+            if conns:
+                return conns.pop(), True
+        return self._create(key), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.MAX_IDLE_PER_HOST:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def _create(self, key):
+        scheme, netloc = key
+        proxy = self._proxies.get(scheme)
+
+        if not proxy:
+            if scheme == 'https':
+                return http.client.HTTPSConnection(netloc, timeout=self._timeout, context=self._ssl_context)
+            return http.client.HTTPConnection(netloc, timeout=self._timeout)
+
+        proxy_parts = urllib.parse.urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+        proxy_headers = {}
+        if proxy_parts.username:
+            credentials = f"{urllib.parse.unquote(proxy_parts.username)}:{urllib.parse.unquote(proxy_parts.password or '')}"
+            proxy_headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(credentials.encode()).decode()
+
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(
+                proxy_parts.hostname, proxy_parts.port or 8080,
+                timeout=self._timeout, context=self._ssl_context)
+            conn.set_tunnel(netloc, headers=proxy_headers)
+            return conn
+
+        with self._lock:
+            self._proxy_headers[key] = proxy_headers
+        return http.client.HTTPConnection(
+            proxy_parts.hostname, proxy_parts.port or 8080, timeout=self._timeout)
@@ -0,0 +1,124 @@
+import json
+import math
+import os
+import threading
+import time
+
+from .files import atomic_write
+
+USAGE_FILE_NAME = "usage.json"
+
+class UsageHistory:
+    """
+    Decayed count of the launches of each page, kept in a single JSON file.
+
+    A launch at time t adds ``2 ** ((t - epoch) / half_life)`` to the score
+    of its page rather than decaying every score as time passes: all scores
+    then shrink by the same factor, so comparing them compares the decayed
+    counts at any moment, and a score never needs updating until the page
+    is launched again. The epoch moves forward once the weights grow too
+    large for a float to stay precise.
+
+    Launches are batched: a save is scheduled *save_delay* seconds after the
+    first launch recorded since the last one, and writes whatever came in
+    meanwhile.
+
+    Layout: ``{"epoch": seconds, "scores": {wiki: {pageid: score}}}``
+    """
+    HALF_LIFE = 30 * 24 * 3600  # seconds for a launch to count half
+    MAX_PAGES = 5000  # the lowest scores are dropped beyond that
+    REBASE_EXPONENT = 64  # weights past 2 ** 64 move the epoch
+
+    def __init__(self, folder, save_delay=10.0, logger=None):
+        self.folder = folder
+        self.path = os.path.join(folder, USAGE_FILE_NAME)
+        self._save_delay = save_delay
+        self._logger = logger
+        self._epoch = time.time()
+        self._scores = {}  # wiki -> {pageid: score}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # the last history taken is the one kept
+        self._dirty = False
+        self._timer = None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        with self._lock:
+            self._epoch = data.get('epoch', time.time())
+            self._scores = {wiki: {int(pageid): score for pageid, score in scores.items()}
+                            for wiki, scores in data.get('scores', {}).items()}
+            self._dirty = False
+
+    def scores(self, wiki_name, now=None):
+        """
+        Return ``{pageid: score}`` of the launched pages of a wiki, a score
+        being the count of launches decayed to *now*: a launch a half-life
+        ago counts 0.5
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            factor = math.pow(2.0, (self._epoch - now) / self.HALF_LIFE)
+            return {pageid: score * factor for pageid, score in self._scores.get(wiki_name, {}).items()}
+
+    def record(self, wiki_name, pageid, now=None):
+        """Count a launch of a page and return its new score, as scores() does"""
+        now = time.time() if now is None else now
+        with self._lock:
+            exponent = (now - self._epoch) / self.HALF_LIFE
+            if exponent > self.REBASE_EXPONENT:
+                self._rebase(now, exponent)
+                exponent = 0.0
+            scores = self._scores.setdefault(wiki_name, {})
+            weight = math.pow(2.0, exponent)
+            score = scores[pageid] = scores.get(pageid, 0.0) + weight
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self._save_delay, self._scheduled_save)
+                self._timer.daemon = True
+                self._timer.start()
+        return score / weight
+
+    def save(self):
+        """Write the history if it changed"""
+        with self._save_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                self._prune()
+                data = json.dumps({'epoch': self._epoch, 'scores': self._scores})
+                self._dirty = False
+            os.makedirs(self.folder, exist_ok=True)
+            atomic_write(self.path, data)
+
+    def __len__(self):
+        return sum(len(scores) for scores in self._scores.values())
+
+    def _scheduled_save(self):
+        try:
+            self.save()
+        except Exception as e:
+            if self._logger:
+                self._logger.err(f"Error saving the usage history: {str(e)}")
+
+    def _rebase(self, now, exponent):
+        # Move the epoch to now, scaling every score down to match
+        factor = math.pow(2.0, -exponent)
+        self._scores = {wiki: {pageid: score * factor for pageid, score in scores.items()}
+                        for wiki, scores in self._scores.items()}
+        self._epoch = now
+
+    def _prune(self):
+        entries = [(score, wiki, pageid) for wiki, scores in self._scores.items()
+                   for pageid, score in scores.items()]
+        if len(entries) <= self.MAX_PAGES:
+            return
+        entries.sort(reverse=True)
+        self._scores = {}
+        for score, wiki, pageid in entries[:self.MAX_PAGES]:
+            self._scores.setdefault(wiki, {})[pageid] = score